@@ -8,82 +8,167 @@ from logic.utils import haversine
 # --- NOVA IMPORTAÇÃO ---
 # Importamos o nosso novo "trabalhador especializado"
 from logic.cep_processing import get_geocoded_ceps_for_city
+from logic.pipeline import executar_pipeline
+from logic.job_store import enfileirar_tarefa
+from logic.metrics import cronometrar, contar, execucao_monitorizada, ERROS_FATAIS
+from logic.routing_client import ceps_da_cidade
 
 # --- CONFIGURAÇÕES (inalteradas) ---
 NOME_PLANILHA_ENTRADA = "Roterizador_VIP"
 ABA_TAREFAS = "Ceps_Rotas"
 FICHEIRO_CREDENCIAL_JSON = "credentials.json"
+
+# --- PARALELISMO DO PIPELINE ---
+# Quantas cidades são geocodificadas ao mesmo tempo (cada uma já usa 20 threads de pedidos)
+WORKERS_GEOCODIFICACAO = 2
+# Quantos grupos são calculados ao mesmo tempo (distâncias e DataFrames)
+WORKERS_CALCULO = 1
+# Quantos escritores enviam abas para a planilha (1 mantém a ordem e respeita a quota da API)
+WORKERS_ESCRITA = 1
+# Quantos grupos prontos podem esperar entre dois estágios
+TAMANHO_FILA_PIPELINE = 2
 logger = get_logger(__name__)
 
-# A função _salvar_resultados continua exatamente igual
-def _salvar_resultados(planilha, nome_base, df, cep_partida=None):
-    """Função auxiliar para salvar resultados na planilha (inalterada)."""
+def _salvar_resultados(planilha, nome_base, df):
+    """Função auxiliar para salvar resultados na planilha."""
     try:
-        try:
-            planilha.del_worksheet(planilha.worksheet(nome_base))
-        except gspread.WorksheetNotFound:
-            pass 
-        nova_aba = planilha.add_worksheet(title=nome_base, rows=len(df) + 2, cols=len(df.columns) + 2)
-        if cep_partida and nome_base.endswith(" - Detalhado"):
-            nova_aba.update('L1', cep_partida, raw=False)
-            nova_aba.update('K1', 'CEP_PARTIDA:', raw=False)
-        df_para_escrever = df.fillna('')
-        dados_para_escrever = [df_para_escrever.columns.values.tolist()] + df_para_escrever.values.tolist()
-        nova_aba.update('A1', dados_para_escrever, value_input_option='USER_ENTERED')
+        with cronometrar("escrita_planilha"):
+            try:
+                planilha.del_worksheet(planilha.worksheet(nome_base))
+            except gspread.WorksheetNotFound:
+                pass 
+            nova_aba = planilha.add_worksheet(title=nome_base, rows=len(df) + 2, cols=len(df.columns) + 2)
+            df_para_escrever = df.fillna('')
+            dados_para_escrever = [df_para_escrever.columns.values.tolist()] + df_para_escrever.values.tolist()
+            nova_aba.update('A1', dados_para_escrever, value_input_option='USER_ENTERED')
         logger.info(f"Resultados guardados com sucesso na nova aba: '{nome_base}'")
         return True
     except Exception as e:
         logger.error(f"Falha ao escrever na planilha na aba '{nome_base}': {e}")
+        contar("abas_com_erro")
         return False
 
-# Esta é a nova função que processa um grupo inteiro de tarefas para a mesma cidade
-def processar_grupo_cidade(planilha, cidade, estado, tarefas_do_grupo, dados_geocodificados):
+# Calcula a tabela detalhada e o resumo de cada tarefa do grupo, sem tocar na planilha
+@cronometrar("calcular_resultados_grupo")
+def calcular_resultados_grupo(cidade, estado, tarefas_do_grupo, dados_geocodificados):
     logger.info(f"--- A processar {len(tarefas_do_grupo)} tarefa(s) para {cidade}/{estado} ---")
+    escritas = []
     for index, tarefa in tarefas_do_grupo.iterrows():
         empresa = tarefa.get('Empresa')
         cep_partida_str = str(tarefa.get('CEP de Partida', '')).strip().zfill(8)
         logger.info(f"A processar tarefa individual: '{empresa}' com CEP de partida {cep_partida_str}")
-        lat_partida, lon_partida, _, _ = get_info_from_cep(cep_partida_str)
-        if lat_partida is None:
+        with cronometrar("cep_partida"):
+            partida = get_info_from_cep(cep_partida_str)
+        if partida is None:
             logger.error(f"Não foi possível encontrar as coordenadas para o CEP de partida {cep_partida_str}. A pular tarefa.")
+            contar("tarefas_sem_partida")
             continue
+        lat_partida, lon_partida = partida.latitude, partida.longitude
         
         # AQUI ESTÁ A MAGIA: este ciclo é super rápido, pois não faz pedidos à internet
-        resultados_individuais = []
-        for cep_info in dados_geocodificados:
-            distancia = haversine(lat_partida, lon_partida, cep_info['latitude'], cep_info['longitude'])
-            resultados_individuais.append({
-                "Estado": estado, "Cidade": cidade, "Bairro": cep_info.get('bairro'), "Rua": cep_info.get('rua'),
-                "Raiz": cep_info['cep'][:5], "CEP": cep_info['cep'], "Distancia_km": round(distancia, 2),
-                "Latitude": cep_info['latitude'], "Longitude": cep_info['longitude']
+        if not dados_geocodificados: continue
+        with cronometrar("distancias_haversine"):
+            distancias = [
+                round(haversine(lat_partida, lon_partida, lat, lon), 2)
+                for lat, lon in zip(dados_geocodificados.latitudes, dados_geocodificados.longitudes)
+            ]
+        with cronometrar("dataframes"):
+            ceps = dados_geocodificados.lista_ceps()
+            df_detalhado = pd.DataFrame({
+                "Estado": estado, "Cidade": cidade,
+                "Bairro": dados_geocodificados.lista_bairros(), "Rua": dados_geocodificados.lista_ruas(),
+                "Raiz": [cep[:5] for cep in ceps], "CEP": ceps,
+                "Distancia_km": distancias,
+                "Latitude": dados_geocodificados.latitudes.tolist(), "Longitude": dados_geocodificados.longitudes.tolist(),
             })
-        
-        if not resultados_individuais: continue
-        df_detalhado = pd.DataFrame(resultados_individuais)
-        ordem_colunas = ['Estado', 'Cidade', 'Bairro', 'Rua', 'Raiz', 'CEP', 'Distancia_km', 'Latitude', 'Longitude']
-        df_detalhado = df_detalhado[ordem_colunas].sort_values(by='Distancia_km', ascending=True)
-        
-        nome_aba_detalhada = f"{empresa} - Detalhado"
-        if not _salvar_resultados(planilha, nome_aba_detalhada, df_detalhado, cep_partida_str): continue
-        
-        df_agregado = df_detalhado.groupby('Raiz')['Distancia_km'].agg(
-            Distancia_Media_km='mean', CEPs_Encontrados='count'
-        ).reset_index()
-        df_agregado['Distancia_Media_km'] = df_agregado['Distancia_Media_km'].round(2)
-        df_agregado['Tempo_Estimado_min'] = (df_agregado['Distancia_Media_km'] * 2).round(1)
-        df_agregado = df_agregado.sort_values(by='Distancia_Media_km', ascending=True)
-        nome_aba_resumo = f"{empresa} - Resumo"
-        _salvar_resultados(planilha, nome_aba_resumo, df_agregado)
+            ordem_colunas = ['Estado', 'Cidade', 'Bairro', 'Rua', 'Raiz', 'CEP', 'Distancia_km', 'Latitude', 'Longitude']
+            df_detalhado = df_detalhado[ordem_colunas].sort_values(by='Distancia_km', ascending=True)
+            
+            df_agregado = df_detalhado.groupby('Raiz')['Distancia_km'].agg(
+                Distancia_Media_km='mean', CEPs_Encontrados='count'
+            ).reset_index()
+            df_agregado['Distancia_Media_km'] = df_agregado['Distancia_Media_km'].round(2)
+            df_agregado['Tempo_Estimado_min'] = (df_agregado['Distancia_Media_km'] * 2).round(1)
+            df_agregado = df_agregado.sort_values(by='Distancia_Media_km', ascending=True)
+        contar("tarefas_calculadas")
+        contar("destinos_calculados", len(df_detalhado))
+        escritas.append({
+            "empresa": empresa, "estado": estado, "cidade": cidade, "cep_partida": cep_partida_str,
+            "lat_partida": lat_partida, "lon_partida": lon_partida,
+            "detalhado": df_detalhado, "resumo": df_agregado
+        })
+    return escritas
+
+def salvar_resultados_tarefa(planilha, escrita):
+    """
+    Escreve a aba de resumo de uma tarefa e, só depois de ela ser guardada, põe a tabela
+    detalhada na fila do cálculo das distâncias reais (a planilha não recebe a aba detalhada).
+    """
+    empresa = escrita["empresa"]
+    nome_aba_resumo = f"{empresa} - Resumo"
+    if not _salvar_resultados(planilha, nome_aba_resumo, escrita["resumo"]):
+        return False
+    df_detalhado = escrita["detalhado"]
+    with cronometrar("fila_tarefas"):
+        enfileirar_tarefa(NOME_PLANILHA_ENTRADA, empresa, escrita["estado"], escrita["cidade"], escrita["cep_partida"],
+                          escrita["lat_partida"], escrita["lon_partida"], {
+            "ceps": df_detalhado['CEP'].tolist(), "latitudes": df_detalhado['Latitude'].tolist(),
+            "longitudes": df_detalhado['Longitude'].tolist(), "distancias_km": df_detalhado['Distancia_km'].tolist(),
+            "bairros": df_detalhado['Bairro'].tolist(), "ruas": df_detalhado['Rua'].tolist(),
+        })
     return True
 
-if __name__ == "__main__":
+def processar_grupos_em_pipeline(planilha, grouped_tasks, total_grupos):
+    """
+    Processa os grupos em três estágios que correm em simultâneo:
+    geocodificação (rede) -> cálculo das distâncias (CPU) -> escrita na planilha (Sheets).
+    Enquanto uma cidade é calculada, as seguintes já estão a ser geocodificadas,
+    e as escritas ficam a cargo de um escritor em segundo plano.
+    """
+    def etapa_geocodificar(item):
+        i, ((cidade, estado), group) = item
+        logger.info(f"A processar GRUPO {i+1}/{total_grupos}: {cidade}/{estado}")
+        
+        # 1. CHAMA O TRABALHADOR PARA FAZER O MAPEAMENTO (SÓ UMA VEZ POR CIDADE)
+        # Se o serviço de rotas estiver a correr, o mapa vem já da memória dele
+        dados_geocodificados = ceps_da_cidade(estado, cidade)
+        if dados_geocodificados is None:
+            dados_geocodificados = get_geocoded_ceps_for_city(estado, cidade)
+        if not dados_geocodificados:
+            logger.error(f"Não foi possível obter dados geocodificados para {cidade}/{estado}. A pular este grupo.")
+            return None
+        return cidade, estado, group, dados_geocodificados
+
+    def etapa_calcular(item):
+        # 2. PROCESSA TODAS AS TAREFAS DO GRUPO COM O MAPA JÁ PRONTO
+        cidade, estado, group, dados_geocodificados = item
+        return calcular_resultados_grupo(cidade, estado, group, dados_geocodificados) or None
+
+    def etapa_escrever(escritas):
+        # 3. GUARDA OS RESULTADOS NA PLANILHA
+        for escrita in escritas:
+            salvar_resultados_tarefa(planilha, escrita)
+        return True
+
+    executar_pipeline(
+        enumerate(grouped_tasks),
+        [
+            ("geocodificacao", etapa_geocodificar, WORKERS_GEOCODIFICACAO),
+            ("calculo", etapa_calcular, WORKERS_CALCULO),
+            ("escrita", etapa_escrever, WORKERS_ESCRITA),
+        ],
+        tamanho_fila=TAMANHO_FILA_PIPELINE,
+    )
+
+def executar_automacao():
     try:
         logger.info("A iniciar a automação de rotas...")
-        gc = gspread.service_account(filename=FICHEIRO_CREDENCIAL_JSON)
-        planilha = gc.open(NOME_PLANILHA_ENTRADA)
-        aba_tarefas = planilha.worksheet(ABA_TAREFAS)
-        
-        tarefas_df = pd.DataFrame(aba_tarefas.get_all_records())
+        with cronometrar("leitura_planilha"):
+            gc = gspread.service_account(filename=FICHEIRO_CREDENCIAL_JSON)
+            planilha = gc.open(NOME_PLANILHA_ENTRADA)
+            aba_tarefas = planilha.worksheet(ABA_TAREFAS)
+            
+            tarefas_df = pd.DataFrame(aba_tarefas.get_all_records())
         if tarefas_df.empty:
             logger.info("Nenhuma tarefa encontrada na planilha. Encerrando.")
         else:
@@ -94,21 +179,17 @@ if __name__ == "__main__":
             total_grupos = len(grouped_tasks)
             logger.info(f"As tarefas foram agrupadas em {total_grupos} grupo(s) de Cidade/Estado.")
 
-            # CICLO INTELIGENTE: um ciclo por grupo de cidade
-            for i, ((cidade, estado), group) in enumerate(grouped_tasks):
-                logger.info(f"A processar GRUPO {i+1}/{total_grupos}: {cidade}/{estado}")
-                
-                # 1. CHAMA O TRABALHADOR PARA FAZER O MAPEAMENTO (SÓ UMA VEZ POR CIDADE)
-                dados_geocodificados = get_geocoded_ceps_for_city(estado, cidade)
-                
-                if not dados_geocodificados:
-                    logger.error(f"Não foi possível obter dados geocodificados para {cidade}/{estado}. A pular este grupo.")
-                    continue
-                
-                # 2. PROCESSA TODAS AS TAREFAS DO GRUPO COM O MAPA JÁ PRONTO
-                processar_grupo_cidade(planilha, cidade, estado, group, dados_geocodificados)
+            # CICLO INTELIGENTE: os grupos de cidade passam por um pipeline de estágios
+            processar_grupos_em_pipeline(planilha, grouped_tasks, total_grupos)
 
     except Exception as e:
         logger.error(f"Ocorreu um erro fatal na automação: {e}", exc_info=True)
+        contar(ERROS_FATAIS)
+        # Relançado para o workflow (e as métricas da execução) registarem a falha
+        raise
 
-    logger.info("✅ Automação de rotas concluída!")
\ No newline at end of file
+    logger.info("✅ Automação de rotas concluída!")
+
+if __name__ == "__main__":
+    with execucao_monitorizada("automacao_rotas"):
+        executar_automacao()
\ No newline at end of file
@@ -0,0 +1,313 @@
+# Arquivo: benchmark_rotas.py
+# Mede, sem o grafo do Brasil e sem planilha, as etapas de roteamento usadas pelo
+# 'cria_grafo.py' e pelo 'calcular_distancias_reais.py':
+#   construção do grafo, gravação/carregamento (graphml e pickle), localização dos pontos
+#   no mapa (nearest_nodes e o índice de nós do servidor_rotas.py) e cálculo de um-para-muitos
+#   (uma rota por destino, como hoje, contra uma única travessia de Dijkstra e a isócrona
+#   completa de logic/isochrones.py).
+# Os grafos são grelhas sintéticas com cara de malha urbana e um pequeno extrato OSM fixo, guardado
+# no repositório em 'benchmarks/extrato_ruas.osm' (vias com vários nós, rotunda, alças, sentidos únicos,
+# becos sem saída), que é lido offline para que todas as execuções meçam exatamente os mesmos dados.
+# Com --descarregar-osm mede-se também um extrato real do centro de Belo Horizonte, descarregado do
+# Overpass para 'benchmarks/extrato_bh_overpass.osm' (fora do git, por isso só comparável na mesma máquina).
+# O resultado vai para um JSON com o commit atual, para comparar o desempenho entre commits.
+#
+# Uso:
+#   python benchmark_rotas.py                         (grelhas 50x50 e 150x150 + extrato fixo)
+#   python benchmark_rotas.py --grelha 300 --destinos 2000 --repeticoes 5
+#   python benchmark_rotas.py --descarregar-osm       (junta o extrato real do Overpass)
+#   python benchmark_rotas.py --osm outro_extrato.osm --sem-sinteticos --saida resultado.json
+
+import os
+import sys
+import json
+import math
+import time
+import pickle
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+
+import networkx as nx
+import osmnx as ox
+from logic.logger import get_logger
+from logic.utils import haversine
+from logic.spatial_index import IndiceNosGrafo
+from logic.cep_record import RegistoCep, LoteCeps
+from logic.isochrones import calcular_isocrona
+
+logger = get_logger(__name__)
+
+# --- CONFIGURAÇÃO ---
+ARQUIVO_EXTRATO_OSM = os.path.join("benchmarks", "extrato_ruas.osm")
+ARQUIVO_EXTRATO_OVERPASS = os.path.join("benchmarks", "extrato_bh_overpass.osm")
+URL_OVERPASS = "https://overpass-api.de/api/interpreter"
+# Centro de Belo Horizonte (sul, oeste, norte, leste): malha real com avenidas, rotundas e sentidos únicos
+BBOX_EXTRATO = (-19.935, -43.950, -19.915, -43.928)
+TIPOS_VIA_EXTRATO = "motorway|trunk|primary|secondary|tertiary|unclassified|residential|living_street|service|road"
+DIRETORIO_RESULTADOS = os.path.join("benchmarks", "resultados")
+GRELHAS_POR_PADRAO = (50, 150)
+# Centro aproximado de Belo Horizonte: as grelhas ficam em coordenadas realistas
+LAT_CENTRO, LON_CENTRO = -19.92, -43.94
+ESPACAMENTO_M = 120
+# Fração de quarteirões sem ligação e de ruas de sentido único, para a grelha não ser perfeita
+FRACAO_ARESTAS_REMOVIDAS = 0.08
+FRACAO_SENTIDO_UNICO = 0.15
+METROS_POR_GRAU_LAT = 111_320
+
+def gerar_grafo_sintetico(lado, espacamento_m=ESPACAMENTO_M, semente=42):
+    """
+    Grelha 'lado' x 'lado' com os mesmos atributos de um grafo do osmnx (x/y em graus,
+    'length' em metros, 'highway', 'oneway'), com pequenas irregularidades nas posições,
+    algumas avenidas, ruas de sentido único e quarteirões sem ligação.
+    """
+    aleatorio = random.Random(semente)
+    G = nx.MultiDiGraph(crs="epsg:4326")
+    graus_lat = espacamento_m / METROS_POR_GRAU_LAT
+    graus_lon = espacamento_m / (METROS_POR_GRAU_LAT * math.cos(math.radians(LAT_CENTRO)))
+    lat0 = LAT_CENTRO - graus_lat * lado / 2
+    lon0 = LON_CENTRO - graus_lon * lado / 2
+
+    def no(i, j):
+        return i * lado + j
+
+    for i in range(lado):
+        for j in range(lado):
+            G.add_node(no(i, j),
+                       y=lat0 + (i + aleatorio.uniform(-0.2, 0.2)) * graus_lat,
+                       x=lon0 + (j + aleatorio.uniform(-0.2, 0.2)) * graus_lon)
+
+    for i in range(lado):
+        for j in range(lado):
+            for vi, vj, avenida in ((i, j + 1, i % 10 == 0), (i + 1, j, j % 10 == 0)):
+                if vi >= lado or vj >= lado:
+                    continue
+                if not avenida and aleatorio.random() < FRACAO_ARESTAS_REMOVIDAS:
+                    continue
+                u, v = no(i, j), no(vi, vj)
+                dados = {
+                    "length": haversine(G.nodes[u]['y'], G.nodes[u]['x'], G.nodes[v]['y'], G.nodes[v]['x']) * 1000,
+                    "highway": "primary" if avenida else "residential",
+                }
+                if avenida:
+                    dados["maxspeed"] = "60"
+                sentido_unico = not avenida and aleatorio.random() < FRACAO_SENTIDO_UNICO
+                G.add_edge(u, v, oneway=sentido_unico, **dados)
+                if not sentido_unico:
+                    G.add_edge(v, u, oneway=False, **dados)
+    # Tal como o osmnx, fica só a maior componente fortemente conexa
+    maior = max(nx.strongly_connected_components(G), key=len)
+    return G.subgraph(maior).copy()
+
+def descarregar_extrato_real(caminho=ARQUIVO_EXTRATO_OVERPASS, bbox=BBOX_EXTRATO):
+    """Descarrega as vias de condução da 'bbox' do Overpass (só se 'caminho' ainda não existir)."""
+    if os.path.exists(caminho):
+        return caminho
+    import requests
+    sul, oeste, norte, leste = bbox
+    consulta = (f'[out:xml][timeout:120];(way["highway"~"^({TIPOS_VIA_EXTRATO})(_link)?$"]'
+                f'({sul},{oeste},{norte},{leste});>;);out body;')
+    logger.info(f"A descarregar o extrato OSM real para '{caminho}'...")
+    resposta = requests.post(URL_OVERPASS, data={"data": consulta}, timeout=180)
+    resposta.raise_for_status()
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    temporario = caminho + ".tmp"
+    with open(temporario, "wb") as f:
+        f.write(resposta.content)
+    os.replace(temporario, caminho)
+    return caminho
+
+def carregar_extrato_osm(caminho):
+    return ox.graph_from_xml(caminho, retain_all=False)
+
+def _cronometrar(funcao, repeticoes):
+    """Corre 'funcao' várias vezes e devolve (último resultado, {min_s, mediana_s, max_s})."""
+    tempos = []
+    resultado = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return resultado, {
+        "min_s": round(min(tempos), 6),
+        "mediana_s": round(statistics.median(tempos), 6),
+        "max_s": round(max(tempos), 6),
+    }
+
+def _medir(resultados, nome, funcao, repeticoes):
+    """Como '_cronometrar', mas regista o erro em vez de interromper o benchmark todo."""
+    try:
+        resultado, tempos = _cronometrar(funcao, repeticoes)
+    except Exception as e:
+        logger.warning(f"  {nome}: falhou ({e})")
+        resultados[nome] = {"erro": str(e)}
+        return None
+    resultados[nome] = tempos
+    logger.info(f"  {nome}: mediana {tempos['mediana_s'] * 1000:.2f} ms")
+    return resultado
+
+def _pontos_aleatorios(G, quantidade, semente):
+    """Pontos de destino espalhados pela área do grafo (como CEPs geocodificados)."""
+    aleatorio = random.Random(semente)
+    ys = [d['y'] for _, d in G.nodes(data=True)]
+    xs = [d['x'] for _, d in G.nodes(data=True)]
+    return ([aleatorio.uniform(min(ys), max(ys)) for _ in range(quantidade)],
+            [aleatorio.uniform(min(xs), max(xs)) for _ in range(quantidade)])
+
+def medir_grafo(nome, construir, num_destinos, repeticoes, semente):
+    logger.info(f"--- {nome} ---")
+    etapas = {}
+
+    G = _medir(etapas, "construcao", construir, 1)
+    if G is None:
+        return {"grafo": nome, "etapas": etapas}
+    logger.info(f"  {G.number_of_nodes()} nós, {G.number_of_edges()} arestas.")
+
+    # Gravação e carregamento: graphml (formato usado hoje) e pickle, para comparação
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho_graphml = os.path.join(pasta, "grafo.graphml")
+        caminho_pickle = os.path.join(pasta, "grafo.pickle")
+
+        def gravar_pickle():
+            with open(caminho_pickle, "wb") as f:
+                pickle.dump(G, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        def carregar_pickle():
+            with open(caminho_pickle, "rb") as f:
+                return pickle.load(f)
+
+        _medir(etapas, "graphml_gravar", lambda: ox.save_graphml(G, caminho_graphml), repeticoes)
+        _medir(etapas, "graphml_carregar", lambda: ox.load_graphml(caminho_graphml), repeticoes)
+        _medir(etapas, "pickle_gravar", gravar_pickle, repeticoes)
+        _medir(etapas, "pickle_carregar", carregar_pickle, repeticoes)
+        tamanhos = {
+            "graphml_bytes": os.path.getsize(caminho_graphml) if os.path.exists(caminho_graphml) else None,
+            "pickle_bytes": os.path.getsize(caminho_pickle) if os.path.exists(caminho_pickle) else None,
+        }
+
+    # Localização dos destinos no mapa
+    lats, lons = _pontos_aleatorios(G, num_destinos, semente)
+    amostra_individual = min(len(lats), 200)
+    _medir(etapas, "nearest_nodes_lote", lambda: ox.nearest_nodes(G, X=lons, Y=lats), repeticoes)
+    _medir(etapas, f"nearest_nodes_individual_{amostra_individual}",
+           lambda: [ox.nearest_nodes(G, X=lons[i], Y=lats[i]) for i in range(amostra_individual)], 1)
+    # O índice que o servidor_rotas.py constrói uma vez e consulta em cada pedido
+    nos = list(G.nodes)
+    indice = _medir(etapas, "indice_nos_construir", lambda: IndiceNosGrafo(G), repeticoes)
+    destinos = None
+    if indice is not None:
+        pontos = list(zip(lats, lons))
+        destinos = _medir(etapas, "indice_nos_consultar", lambda: indice.localizar(pontos), repeticoes)
+    if destinos is None:
+        destinos = random.Random(semente).sample(nos, min(num_destinos, len(nos)))
+
+    # Um-para-muitos a partir de um nó central
+    origem = nos[len(nos) // 2]
+    amostra_rotas = min(len(destinos), 200)
+
+    def uma_rota_por_destino():
+        distancias = []
+        for destino in destinos[:amostra_rotas]:
+            try:
+                distancias.append(nx.shortest_path_length(G, origem, destino, weight='length'))
+            except nx.NetworkXNoPath:
+                distancias.append(None)
+        return distancias
+
+    _medir(etapas, f"rota_por_destino_{amostra_rotas}", uma_rota_por_destino, 1)
+    _medir(etapas, "dijkstra_origem_unica",
+           lambda: nx.single_source_dijkstra_path_length(G, origem, weight='length'), repeticoes)
+    # A isócrona completa (travessia limitada + ligação de cada destino ao grafo), como no consultar_isocronas.py
+    lote = LoteCeps.de_registos(RegistoCep(f"{i:08d}", lat, lon, f"Bairro {i % 20}")
+                                for i, (lat, lon) in enumerate(zip(lats, lons)))
+    _medir(etapas, "isocrona_15km",
+           lambda: calcular_isocrona(G, "00000000", G.nodes[origem]['y'], G.nodes[origem]['x'], lote), repeticoes)
+
+    por_destino = etapas.get(f"rota_por_destino_{amostra_rotas}", {}).get("mediana_s")
+    if por_destino is not None and amostra_rotas:
+        # Estimativa do tempo do método atual para todos os destinos, para comparar com uma travessia
+        etapas["rota_por_destino_estimado_total_s"] = round(por_destino / amostra_rotas * len(destinos), 6)
+
+    return {
+        "grafo": nome,
+        "nos": G.number_of_nodes(),
+        "arestas": G.number_of_edges(),
+        "destinos": len(destinos),
+        "tamanhos": tamanhos,
+        "etapas": etapas,
+    }
+
+def _commit_atual():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        alterado = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        return commit, bool(alterado)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+def executar_benchmark(grelhas, extratos, num_destinos, repeticoes, semente):
+    commit, alterado = _commit_atual()
+    relatorio = {
+        "commit": commit,
+        "alteracoes_locais": alterado,
+        "data": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "versoes": {"networkx": nx.__version__, "osmnx": ox.__version__},
+        "parametros": {"destinos": num_destinos, "repeticoes": repeticoes, "semente": semente},
+        "grafos": [],
+    }
+    for lado in grelhas:
+        relatorio["grafos"].append(medir_grafo(
+            f"sintetico_{lado}x{lado}", lambda lado=lado: gerar_grafo_sintetico(lado, semente=semente),
+            num_destinos, repeticoes, semente
+        ))
+    for caminho in extratos:
+        if caminho == ARQUIVO_EXTRATO_OVERPASS:
+            try:
+                descarregar_extrato_real(caminho)
+            except Exception as e:
+                logger.warning(f"Não foi possível descarregar o extrato OSM real ({e}).")
+                relatorio["grafos"].append({"grafo": f"osm:{os.path.basename(caminho)}", "etapas": {"construcao": {"erro": str(e)}}})
+                continue
+        relatorio["grafos"].append(medir_grafo(
+            f"osm:{os.path.basename(caminho)}", lambda caminho=caminho: carregar_extrato_osm(caminho),
+            num_destinos, repeticoes, semente
+        ))
+    return relatorio
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de construção, carregamento, localização e roteamento em grafos de ruas.")
+    parser.add_argument("--grelha", type=int, action="append", help="Lado de uma grelha sintética (pode repetir).")
+    parser.add_argument("--sem-sinteticos", action="store_true", help="Não usar grelhas sintéticas.")
+    parser.add_argument("--osm", action="append", help=f"Extrato OSM (.osm) a medir. Por padrão: {ARQUIVO_EXTRATO_OSM}.")
+    parser.add_argument("--descarregar-osm", action="store_true",
+                        help=f"Medir também o extrato real do Overpass (descarregado para {ARQUIVO_EXTRATO_OVERPASS} se faltar; precisa de rede).")
+    parser.add_argument("--destinos", type=int, default=1000, help="Número de destinos por grafo.")
+    parser.add_argument("--repeticoes", type=int, default=3, help="Repetições de cada medição.")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--saida", help="Ficheiro JSON do relatório.")
+    args = parser.parse_args()
+
+    grelhas = [] if args.sem_sinteticos else (args.grelha or list(GRELHAS_POR_PADRAO))
+    extratos = args.osm if args.osm is not None else [ARQUIVO_EXTRATO_OSM]
+    if args.descarregar_osm:
+        extratos.append(ARQUIVO_EXTRATO_OVERPASS)
+    relatorio = executar_benchmark(grelhas, extratos, args.destinos, args.repeticoes, args.semente)
+
+    saida = args.saida
+    if saida is None:
+        os.makedirs(DIRETORIO_RESULTADOS, exist_ok=True)
+        carimbo = datetime.now().strftime("%Y%m%d-%H%M%S")
+        saida = os.path.join(DIRETORIO_RESULTADOS, f"{carimbo}-{(relatorio['commit'] or 'sem-git')[:10]}.json")
+    with open(saida, "w", encoding="utf-8") as f:
+        json.dump(relatorio, f, ensure_ascii=False, indent=2)
+    logger.info(f"✅ Relatório do benchmark guardado em '{saida}'.")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,110 +1,169 @@
 # Arquivo: calcular_distancias_reais.py
 
+import os
+import argparse
 import osmnx as ox
 import gspread
 import pandas as pd
 from logic.logger import get_logger
-from logic.cep_service import get_info_from_cep # Reutilizamos para o CEP de partida
+from logic.cache_manager import DIRETORIO_OSMNX, podar_diretorio
+from logic.job_store import ARQUIVO_FILA, contar_pendentes, importar_tarefas, reservar_proxima_tarefa, concluir_tarefa, falhar_tarefa
+from logic.metrics import cronometrar, contar, execucao_monitorizada, ERROS_FATAIS
+from logic.routing_client import estado_servidor, matriz_distancias
 
 # --- CONFIGURAÇÃO ---
-NOME_PLANILHA = "Roteirizador_VIP"
-# O script agora procura as abas dinamicamente, esta variável não é mais necessária
-# ABA_A_PROCESSAR = "Rex Delivery - Detalhado" 
+# As tarefas vêm da fila (logic/job_store.py) preenchida pelo 'automacao_rotas.py', importada
+# com '--importar-fila' a partir do artefacto do workflow; cada tarefa traz o nome da planilha
+# onde o resultado final deve ser escrito.
 ARQUIVO_GRAFO = "brazil_drive_graph.graphml" # Verifique se este é o nome do seu grafo salvo
 ARQUIVO_CREDENCIAS = "credentials.json"
-COLUNA_DISTANCIA = 'H' # Letra da coluna "Distancia_km" na sua planilha
-CELULA_CEP_PARTIDA = 'L1' # Célula onde guardámos o CEP de partida
-SUFIXO_ABAS_A_PROCESSAR = " - Detalhado"
 SUFIXO_ABAS_CONCLUIDAS = " - Concluído"
+ORDEM_COLUNAS = ['Estado', 'Cidade', 'Bairro', 'Rua', 'Raiz', 'CEP', 'Distancia_km', 'Distancia_Real_km', 'Latitude', 'Longitude']
 
 logger = get_logger(__name__)
 
-# --- LÓGICA PRINCIPAL ---
-def calcular_distancias_em_fila():
-    # 1. Carregar o grafo
-    logger.info(f"Carregando o grafo de ruas '{ARQUIVO_GRAFO}'... Este passo pode ser demorado.")
+# Os pedidos guardados pelo osmnx vão para um subdiretório do cache, com orçamento de tamanho
+ox.settings.cache_folder = DIRETORIO_OSMNX
+
+def _escrever_aba_concluida(planilha, tarefa, df):
+    """Única escrita na planilha por tarefa: cria a aba 'Concluído'."""
+    empresa = tarefa['empresa']
+    nome_aba = f"{empresa}{SUFIXO_ABAS_CONCLUIDAS}"
     try:
+        planilha.del_worksheet(planilha.worksheet(nome_aba))
+    except gspread.WorksheetNotFound:
+        pass
+    nova_aba = planilha.add_worksheet(title=nome_aba, rows=len(df) + 2, cols=len(df.columns) + 2)
+    df_para_escrever = df.fillna('')
+    dados_para_escrever = [df_para_escrever.columns.values.tolist()] + df_para_escrever.values.tolist()
+    nova_aba.update('A1', dados_para_escrever, value_input_option='USER_ENTERED')
+    logger.info(f"Resultados guardados na aba '{nome_aba}'.")
+
+def _carregar_grafo():
+    logger.info(f"Carregando o grafo de ruas '{ARQUIVO_GRAFO}'... Este passo pode ser demorado.")
+    with cronometrar("carregar_grafo"):
         G = ox.load_graphml(ARQUIVO_GRAFO)
-    except FileNotFoundError:
-        logger.error(f"ERRO: Ficheiro do grafo '{ARQUIVO_GRAFO}' não encontrado. Execute o 'cria_grafo.py' primeiro.")
-        return
     logger.info("Grafo carregado com sucesso.")
+    return G
+
+def _calcular_distancias_localmente(G, tarefa):
+    """Localiza a partida e todos os destinos no grafo de uma vez e calcula uma rota por destino."""
+    with cronometrar("localizacao_no_mapa"):
+        orig_node = ox.nearest_nodes(G, X=tarefa['lon_partida'], Y=tarefa['lat_partida'])
+        dest_nodes = ox.nearest_nodes(G, X=list(tarefa['longitudes']), Y=list(tarefa['latitudes']))
+    logger.info(f"Ponto de partida ({tarefa['cep_partida']}) localizado no mapa.")
+
+    logger.info(f"Iniciando cálculo de {len(dest_nodes)} rotas...")
+    distancias_reais_km = []
+    with cronometrar("rotas"):
+        for index, dest_node in enumerate(dest_nodes):
+            try:
+                distancia_metros = ox.shortest_path_length(G, orig_node, dest_node, weight='length')
+                distancias_reais_km.append(round(distancia_metros / 1000, 2))
+            except Exception as e:
+                logger.error(f"CEP {tarefa['ceps'][index]}: Não foi possível encontrar uma rota. Erro: {e}")
+                distancias_reais_km.append("Sem Rota")
+    return distancias_reais_km
+
+def _calcular_distancias_no_servico(tarefa):
+    """Pede a linha da matriz de distâncias ao serviço de rotas; devolve None se ele falhar."""
+    logger.info(f"A pedir {len(tarefa['ceps'])} rotas ao serviço de rotas...")
+    with cronometrar("rotas_servico"):
+        matriz = matriz_distancias([(tarefa['lat_partida'], tarefa['lon_partida'])],
+                                   list(zip(tarefa['latitudes'], tarefa['longitudes'])))
+    if matriz is None:
+        return None
+    return [d if d is not None else "Sem Rota" for d in matriz[0]]
 
-    # 2. Conectar à Planilha
-    logger.info("Conectando à Planilha Google...")
-    gc = gspread.service_account(filename=ARQUIVO_CREDENCIAS)
-    planilha = gc.open(NOME_PLANILHA)
-    
-    # 3. Encontrar todas as abas na fila
-    todas_as_abas = planilha.worksheets()
-    abas_na_fila = [aba for aba in todas_as_abas if aba.title.endswith(SUFIXO_ABAS_A_PROCESSAR)]
-
-    if not abas_na_fila:
-        logger.info("Nenhuma aba na fila para processar. Encerrando.")
+# --- LÓGICA PRINCIPAL ---
+def calcular_distancias_em_fila(filas_a_importar=()):
+    for arquivo in filas_a_importar:
+        try:
+            importar_tarefas(arquivo)
+        except FileNotFoundError:
+            logger.error(f"ERRO: Ficheiro de fila '{arquivo}' não encontrado.")
+            contar(ERROS_FATAIS)
+            return
+
+    if not os.path.exists(ARQUIVO_FILA):
+        # Sem fila local nem fila importada, a execução não tem o que fazer: é um erro de configuração
+        logger.error(f"ERRO: Fila de tarefas '{ARQUIVO_FILA}' não encontrada. Use --importar-fila com a fila publicada pelo workflow.")
+        contar(ERROS_FATAIS)
+        return
+
+    pendentes = contar_pendentes()
+    if not pendentes:
+        logger.info("Nenhuma tarefa na fila para processar. Encerrando.")
         return
+    logger.info(f"Encontradas {pendentes} tarefas na fila.")
+
+    # 1. O grafo: se o serviço de rotas ('servidor_rotas.py') já o tem em memória, não é carregado aqui
+    G = None
+    servico = estado_servidor()
+    if servico and servico.get("grafo_carregado"):
+        logger.info("Serviço de rotas ativo: as rotas serão calculadas por ele, sem carregar o grafo.")
+    else:
+        try:
+            G = _carregar_grafo()
+        except FileNotFoundError:
+            logger.error(f"ERRO: Ficheiro do grafo '{ARQUIVO_GRAFO}' não encontrado. Execute o 'cria_grafo.py' primeiro.")
+            contar(ERROS_FATAIS)
+            return
 
-    logger.info(f"Encontradas {len(abas_na_fila)} abas na fila: {[aba.title for aba in abas_na_fila]}")
+    # 2. Conectar à Planilha (cada planilha é aberta uma única vez)
+    logger.info("Conectando à Planilha Google...")
+    with cronometrar("ligacao_planilha"):
+        gc = gspread.service_account(filename=ARQUIVO_CREDENCIAS)
+    planilhas = {}
 
-    # 4. Processar cada aba na fila
-    for aba in abas_na_fila:
-        logger.info(f"--- Processando aba: {aba.title} ---")
+    # 3. Processar cada tarefa da fila
+    while (tarefa := reservar_proxima_tarefa()) is not None:
+        logger.info(f"--- Processando tarefa: {tarefa['empresa']} ({tarefa['cidade']}/{tarefa['estado']}) ---")
         try:
-            # 4.1 Ler CEP de partida e dados
-            cep_partida_str = aba.acell(CELULA_CEP_PARTida).value
-            if not cep_partida_str:
-                logger.error(f"CEP de Partida não encontrado na célula {CELULA_CEP_PARTIDA} da aba '{aba.title}'. A pular.")
-                continue
-            
-            lat_partida, lon_partida, _, _ = get_info_from_cep(cep_partida_str)
-            if not lat_partida:
-                logger.error(f"Não foi possível geocodificar o CEP de partida {cep_partida_str} da aba '{aba.title}'. A pular.")
-                continue
-
-            orig_node = ox.nearest_nodes(G, X=lon_partida, Y=lat_partida)
-            logger.info(f"Ponto de partida ({cep_partida_str}) localizado no mapa.")
-
-            dados_df = pd.DataFrame(aba.get_all_records())
-            
-            # 4.2 Calcular distâncias
-            distancias_reais_km = []
-            total_rows = len(dados_df)
-            logger.info(f"Iniciando cálculo de {total_rows} rotas...")
-
-            for index, row in dados_df.iterrows():
-                # Garante que as colunas existem antes de tentar aceder
-                lat_destino = row.get('Latitude')
-                lon_destino = row.get('Longitude')
-
-                if lat_destino is None or lon_destino is None:
-                    logger.warning(f"Linha {index + 2}: Colunas Latitude/Longitude não encontradas ou vazias. A pular.")
-                    distancias_reais_km.append("Erro Coords")
-                    continue
-                
-                try:
-                    coords_destino = (float(lat_destino), float(lon_destino))
-                    dest_node = ox.nearest_nodes(G, X=coords_destino[1], Y=coords_destino[0])
-                    distancia_metros = ox.shortest_path_length(G, orig_node, dest_node, weight='length')
-                    distancias_reais_km.append(round(distancia_metros / 1000, 2))
-                except Exception as e:
-                    logger.error(f"Linha {index + 2}: Não foi possível encontrar uma rota. Erro: {e}")
-                    distancias_reais_km.append("Sem Rota")
-            
-            # 4.3 Atualizar planilha
-            update_data = [[d] for d in distancias_reais_km]
-            range_to_update = f'{COLUNA_DISTANCIA}2:{COLUNA_DISTANCIA}{len(update_data) + 1}'
-            aba.update(range_to_update, update_data)
-            logger.info("Coluna de distâncias atualizada com sucesso.")
-
-            # 4.4 Renomear aba para marcar como concluída
-            novo_nome = aba.title.replace(SUFIXO_ABAS_A_PROCESSAR, SUFIXO_ABAS_CONCLUIDAS)
-            aba.update_title(novo_nome)
-            logger.info(f"Aba renomeada para '{novo_nome}'.")
+            # 3.1 O CEP de partida já vem geocodificado na tarefa; as rotas vêm do serviço ou do grafo local
+            total_rows = len(tarefa['ceps'])
+            distancias_reais_km = _calcular_distancias_no_servico(tarefa) if G is None else None
+            if distancias_reais_km is None:
+                if G is None:
+                    # O serviço deixou de responder: a partir daqui o grafo é usado localmente
+                    G = _carregar_grafo()
+                distancias_reais_km = _calcular_distancias_localmente(G, tarefa)
+            sem_rota = distancias_reais_km.count("Sem Rota")
+            contar("rotas_calculadas", total_rows - sem_rota)
+            contar("rotas_sem_caminho", sem_rota)
+
+            # 3.2 Montar a tabela final e escrevê-la na planilha
+            with cronometrar("dataframes"):
+                df = pd.DataFrame({
+                    'Estado': tarefa['estado'], 'Cidade': tarefa['cidade'],
+                    'Bairro': tarefa['bairros'], 'Rua': tarefa['ruas'],
+                    'Raiz': [c[:5] for c in tarefa['ceps']], 'CEP': tarefa['ceps'],
+                    'Distancia_km': list(tarefa['distancias_km']), 'Distancia_Real_km': distancias_reais_km,
+                    'Latitude': list(tarefa['latitudes']), 'Longitude': list(tarefa['longitudes']),
+                })[ORDEM_COLUNAS]
+                ordenacao = pd.to_numeric(df['Distancia_Real_km'], errors='coerce')
+                df = df.loc[ordenacao.sort_values(na_position='last').index]
+
+            with cronometrar("escrita_planilha"):
+                if tarefa['planilha'] not in planilhas:
+                    planilhas[tarefa['planilha']] = gc.open(tarefa['planilha'])
+                _escrever_aba_concluida(planilhas[tarefa['planilha']], tarefa, df)
+            concluir_tarefa(tarefa['id'])
+            contar("tarefas_concluidas")
 
         except Exception as e:
-            logger.error(f"Ocorreu um erro inesperado ao processar a aba '{aba.title}': {e}")
+            logger.error(f"Ocorreu um erro inesperado ao processar a tarefa de '{tarefa['empresa']}': {e}")
+            falhar_tarefa(tarefa['id'], e)
+            contar("tarefas_com_erro")
             continue
 
+    podar_diretorio("osmnx", DIRETORIO_OSMNX)
     logger.info("✅ Fila de cálculo de distâncias processada com sucesso!")
 
 if __name__ == "__main__":
-    calcular_distancias_em_fila()
\ No newline at end of file
+    with execucao_monitorizada("calcular_distancias_reais"):
+        parser = argparse.ArgumentParser(description="Calcula as distâncias reais das tarefas em fila e escreve as abas 'Concluído'.")
+        parser.add_argument("--importar-fila", action="append", default=[], metavar="ARQUIVO",
+                            help="Fila gerada noutra máquina (p.ex. o artefacto 'fila-tarefas' do workflow) a juntar antes de calcular.")
+        args = parser.parse_args()
+        calcular_distancias_em_fila(args.importar_fila)
@@ -0,0 +1,39 @@
+# Arquivo: consultar_isocronas.py
+# Uso: python consultar_isocronas.py "<Estado>" "<Cidade>" <CEP de partida> [faixa_km] [--profile]
+import sys
+from logic.logger import get_logger
+from logic.isochrones import obter_isocrona, consultar_faixa, FAIXAS_KM
+from logic.metrics import contar, execucao_monitorizada, ERROS_FATAIS
+
+logger = get_logger(__name__)
+
+# --- LÓGICA PRINCIPAL ---
+def mostrar_isocronas(estado, cidade, cep_partida, faixas_pedidas):
+    isocrona = obter_isocrona(estado, cidade, cep_partida)
+    if isocrona is None:
+        # O motivo já foi registado por obter_isocrona; sem isócrona, a execução falhou
+        contar(ERROS_FATAIS)
+        return
+
+    for faixa in faixas_pedidas:
+        raizes = consultar_faixa(isocrona, faixa, "raizes")
+        bairros = consultar_faixa(isocrona, faixa, "bairros")
+        ceps = consultar_faixa(isocrona, faixa, "ceps")
+        print(f"\n--- Até {faixa} km de condução a partir de {cep_partida} ---")
+        print(f"{len(ceps)} CEPs, {len(bairros)} bairros, {len(raizes)} raízes.")
+        print("Raízes: " + ", ".join(f"{r} ({isocrona['raizes'][r]} km)" for r in raizes))
+        print("Bairros: " + ", ".join(f"{b} ({isocrona['bairros'][b]} km)" for b in bairros))
+
+def main():
+    if len(sys.argv) not in (4, 5):
+        print('Uso: python consultar_isocronas.py "<Estado>" "<Cidade>" <CEP de partida> [faixa_km] [--profile]')
+        sys.exit(1)
+    estado, cidade = sys.argv[1], sys.argv[2]
+    cep_partida = sys.argv[3].replace('-', '').strip().zfill(8)
+    faixas = [int(sys.argv[4])] if len(sys.argv) == 5 else list(FAIXAS_KM)
+    mostrar_isocronas(estado, cidade, cep_partida, faixas)
+
+if __name__ == "__main__":
+    # O '--profile' é retirado dos argumentos por execucao_monitorizada, antes de main() os ler
+    with execucao_monitorizada("consultar_isocronas"):
+        main()
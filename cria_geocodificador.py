@@ -0,0 +1,26 @@
+# Arquivo: cria_geocodificador.py
+from logic.logger import get_logger
+from logic.metrics import contar, execucao_monitorizada, ERROS_FATAIS
+from logic.offline_geocoder import construir_indice, ARQUIVO_INDICE, MAP_FILE
+
+logger = get_logger(__name__)
+
+# --- LÓGICA PRINCIPAL ---
+def criar_e_salvar_geocodificador():
+    logger.info(f"Iniciando a criação do geocodificador local a partir do ficheiro: '{MAP_FILE}'")
+    logger.warning("Execute o 'cria_limites.py' antes: as ruas são atribuídas aos municípios extraídos por ele.")
+
+    try:
+        if construir_indice(MAP_FILE, ARQUIVO_INDICE):
+            logger.info(f"✅ Processo concluído! O ficheiro '{ARQUIVO_INDICE}' foi criado.")
+
+    except FileNotFoundError:
+        logger.error(f"ERRO: Ficheiro de mapa '{MAP_FILE}' não encontrado na pasta do projeto.")
+        contar(ERROS_FATAIS)
+    except Exception as e:
+        logger.error(f"Ocorreu um erro inesperado durante a criação do geocodificador: {e}")
+        contar(ERROS_FATAIS)
+
+if __name__ == "__main__":
+    with execucao_monitorizada("cria_geocodificador"):
+        criar_e_salvar_geocodificador()
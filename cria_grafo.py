@@ -1,9 +1,14 @@
 # Arquivo: cria_grafo.py
 import osmnx as ox
 from logic.logger import get_logger # Vamos usar o nosso logger
+from logic.cache_manager import DIRETORIO_OSMNX, podar_diretorio
+from logic.metrics import contar, execucao_monitorizada, ERROS_FATAIS
 
 logger = get_logger(__name__)
 
+# Os pedidos guardados pelo osmnx vão para um subdiretório do cache, com orçamento de tamanho
+ox.settings.cache_folder = DIRETORIO_OSMNX
+
 # --- CONFIGURAÇÃO ---
 # Verifique se este nome corresponde exatamente ao seu ficheiro de mapa descarregado
 MAP_FILE = "brazil-latest.osm.pbf" 
@@ -30,8 +35,13 @@ def criar_e_salvar_grafo():
     except FileNotFoundError:
         logger.error(f"ERRO: Ficheiro de mapa '{MAP_FILE}' não encontrado na pasta do projeto.")
         logger.error("Por favor, confirme que o nome e a localização do ficheiro estão corretos.")
+        contar(ERROS_FATAIS)
     except Exception as e:
         logger.error(f"Ocorreu um erro inesperado durante a criação do grafo: {e}")
+        contar(ERROS_FATAIS)
+    finally:
+        podar_diretorio("osmnx", DIRETORIO_OSMNX)
 
 if __name__ == "__main__":
-    criar_e_salvar_grafo()
\ No newline at end of file
+    with execucao_monitorizada("cria_grafo"):
+        criar_e_salvar_grafo()
\ No newline at end of file
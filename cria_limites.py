@@ -0,0 +1,31 @@
+# Arquivo: cria_limites.py
+from logic.logger import get_logger
+from logic.metrics import contar, execucao_monitorizada, ERROS_FATAIS
+from logic.boundary_validation import extrair_limites_do_pbf, MAP_FILE
+from logic.cep_processing import validar_cache_da_cidade, listar_cidades_mapeadas
+
+logger = get_logger(__name__)
+
+# --- LÓGICA PRINCIPAL ---
+def criar_limites_e_validar_caches():
+    # 1. Extrai os polígonos de municípios e bairros do mesmo mapa usado para o grafo
+    try:
+        extrair_limites_do_pbf(MAP_FILE)
+    except FileNotFoundError:
+        logger.error(f"ERRO: Ficheiro de mapa '{MAP_FILE}' não encontrado na pasta do projeto.")
+        contar(ERROS_FATAIS)
+        return
+    except Exception as e:
+        logger.error(f"Ocorreu um erro inesperado durante a extração dos limites: {e}")
+        contar(ERROS_FATAIS)
+        return
+
+    # 2. Revalida todos os mapas detalhados que já existem no cache
+    for estado, cidade in listar_cidades_mapeadas():
+        validar_cache_da_cidade(estado, cidade)
+
+    logger.info("✅ Processo concluído! Limites extraídos e caches validados.")
+
+if __name__ == "__main__":
+    with execucao_monitorizada("cria_limites"):
+        criar_limites_e_validar_caches()
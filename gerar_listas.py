@@ -1,8 +1,9 @@
-import requests
 from bs4 import BeautifulSoup
 import gspread
 import time
 from logic.logger import get_logger
+from logic.http_cache import criar_sessao_com_cache
+from logic.metrics import contar, execucao_monitorizada, ERROS_FATAIS
 
 logger = get_logger(__name__)
 BASE_URL = "https://codigo-postal.org/pt-br/brasil"
@@ -10,13 +11,15 @@ HEADERS = {'User-Agent': 'ListaGerador/1.0 (Projeto Pessoal; automacao)'}
 NOME_PLANILHA = "Roterizador_VIP"
 NOME_ABA_DADOS = "_DadosApoio" # O '_' ajuda a indicar que é uma aba 'oculta' ou de sistema
 FICHEIRO_CREDENCIAL_JSON = "credentials.json"
+# Partilha o cache condicional de páginas com o city_cep_scraper
+SESSAO = criar_sessao_com_cache(HEADERS, "https://codigo-postal.org")
 
 def buscar_estados():
     """Busca a lista de todos os estados e seus links."""
     logger.info("Buscando a lista de estados...")
     url = f"{BASE_URL}/"
     try:
-        response = requests.get(url, headers=HEADERS, timeout=15)
+        response = SESSAO.get(url, timeout=15)
         response.raise_for_status()
         soup = BeautifulSoup(response.text, 'lxml')
         
@@ -40,7 +43,7 @@ def buscar_cidades_do_estado(estado_info):
     url_estado = estado_info['url']
     logger.info(f"Buscando cidades para o estado: {nome_estado}...")
     try:
-        response = requests.get(url_estado, headers=HEADERS, timeout=15)
+        response = SESSAO.get(url_estado, timeout=15)
         response.raise_for_status()
         soup = BeautifulSoup(response.text, 'lxml')
         
@@ -57,14 +60,15 @@ def buscar_cidades_do_estado(estado_info):
         logger.error(f"Falha ao buscar cidades de {nome_estado}: {e}")
         return []
 
-if __name__ == "__main__":
+def gerar_listas():
     logger.info("A iniciar o processo de geração de listas de estados e cidades.")
     
     # Busca todos os dados primeiro
     estados = buscar_estados()
     if not estados:
         logger.error("Não foi possível obter a lista de estados. A abortar.")
-        exit()
+        contar(ERROS_FATAIS)
+        return
         
     dados_completos = {}
     for estado in estados:
@@ -115,4 +119,9 @@ if __name__ == "__main__":
         logger.info("Agora, siga as instruções da Parte 2 para configurar a validação de dados.")
 
     except Exception as e:
-        logger.error(f"Ocorreu um erro ao interagir com a planilha: {e}")
\ No newline at end of file
+        logger.error(f"Ocorreu um erro ao interagir com a planilha: {e}")
+        contar(ERROS_FATAIS)
+
+if __name__ == "__main__":
+    with execucao_monitorizada("gerar_listas"):
+        gerar_listas()
@@ -0,0 +1,258 @@
+# logic/boundary_validation.py
+# Validação offline de coordenadas: verifica se cada ponto cai dentro do município e do bairro
+# esperados, usando polígonos extraídos do mesmo ficheiro PBF usado pelo 'cria_grafo.py'.
+# As bibliotecas geoespaciais (osmium, shapely) só são importadas quando são mesmo usadas,
+# para que a automação continue a correr em máquinas onde não estão instaladas.
+
+import os
+import glob
+import threading
+from collections import defaultdict
+from .logger import get_logger
+from .utils import normalizar_nome, normalizar_estado
+from . import cache_manager
+
+logger = get_logger(__name__)
+
+MAP_FILE = "brazil-latest.osm.pbf"
+CACHE_DIR = "cache"
+
+# Que fronteiras do OSM contam como estado, município e bairro
+NIVEIS_ESTADO = {'4'}
+NIVEIS_MUNICIPIO = {'8'}
+NIVEIS_BAIRRO = {'9', '10'}
+LUGARES_BAIRRO = {'suburb', 'neighbourhood', 'quarter'}
+
+# Resultados possíveis da validação de um ponto
+VALIDO = "ok"
+FORA_DO_MUNICIPIO = "fora_municipio"
+BAIRRO_DIVERGENTE = "bairro_divergente"
+SEM_COBERTURA = "sem_cobertura"  # Dentro do município, mas o OSM não tem o polígono do bairro
+FALHAS = {FORA_DO_MUNICIPIO, BAIRRO_DIVERGENTE}
+
+_limites_em_memoria = {}
+_trinco = threading.Lock()
+
+NAMESPACE_CACHE = "limites"
+
+def _caminho_limites(estado, cidade):
+    """Caminho antigo (JSON solto no cache), migrado para o gestor de cache no primeiro acesso."""
+    return os.path.join(CACHE_DIR, f"{estado.lower()}-{cidade.lower()}-LIMITES.json")
+
+def _chave_limites(estado, cidade):
+    """
+    Chave dos limites de uma cidade. Os nomes vêm do OSM na extração e da planilha/APIs na consulta,
+    por isso ambos os lados são normalizados (acentos, hífenes, sigla ou nome do estado).
+    """
+    return cache_manager.chave_cidade(normalizar_estado(estado), normalizar_nome(cidade))
+
+def limites_disponiveis(estado, cidade):
+    """Indica se os polígonos desta cidade já foram extraídos do PBF."""
+    if not (estado and cidade):
+        return False
+    return (cache_manager.existe(NAMESPACE_CACHE, _chave_limites(estado, cidade))
+            # Entradas gravadas antes da normalização da chave, só encontradas com a grafia exata
+            or cache_manager.existe(NAMESPACE_CACHE, cache_manager.chave_cidade(estado, cidade),
+                                    legado=_caminho_limites(estado, cidade)))
+
+def _ler_limites(estado, cidade):
+    conteudo = cache_manager.ler(NAMESPACE_CACHE, _chave_limites(estado, cidade))
+    if conteudo is None:
+        conteudo = cache_manager.ler(NAMESPACE_CACHE, cache_manager.chave_cidade(estado, cidade),
+                                     legado=_caminho_limites(estado, cidade))
+    return conteudo
+
+# --- EXTRAÇÃO A PARTIR DO PBF (corre uma vez, através do 'cria_limites.py') ---
+
+def _ler_areas_do_pbf(map_file):
+    """Lê o PBF uma única vez e devolve as áreas de estados, municípios e bairros como (nome, wkb_hex)."""
+    import osmium
+
+    fabrica = osmium.geom.WKBFactory()
+    estados, municipios, bairros = [], [], []
+
+    class ColetorLimites(osmium.SimpleHandler):
+        def area(self, area):
+            tags = area.tags
+            nome = tags.get('name')
+            if not nome:
+                return
+            nivel = tags.get('admin_level') if tags.get('boundary') == 'administrative' else None
+            if nivel in NIVEIS_ESTADO:
+                destino = estados
+            elif nivel in NIVEIS_MUNICIPIO:
+                destino = municipios
+            elif nivel in NIVEIS_BAIRRO or tags.get('place') in LUGARES_BAIRRO:
+                destino = bairros
+            else:
+                return
+            try:
+                destino.append((nome, fabrica.create_multipolygon(area)))
+            except RuntimeError:
+                # Polígonos partidos no OSM (anéis abertos, etc.) são simplesmente ignorados
+                pass
+
+    ColetorLimites().apply_file(map_file, locations=True, idx='flex_mem')
+    return estados, municipios, bairros
+
+def _atribuir_a_poligonos(geometrias, poligonos):
+    """Para cada geometria, devolve o índice do polígono que contém o seu ponto interior (-1 se nenhum)."""
+    import numpy as np
+    import shapely
+
+    resultado = np.full(len(geometrias), -1)
+    if len(geometrias) == 0 or len(poligonos) == 0:
+        return resultado
+    arvore = shapely.STRtree(poligonos)
+    idx_geometrias, idx_poligonos = arvore.query(shapely.point_on_surface(geometrias), predicate='within')
+    resultado[idx_geometrias] = idx_poligonos
+    return resultado
+
+def extrair_limites_do_pbf(map_file=MAP_FILE):
+    """
+    Extrai do PBF os polígonos de todos os municípios e respetivos bairros,
+    e guarda uma entrada por município no namespace 'limites' do cache.
+    """
+    import shapely
+
+    logger.info(f"A extrair fronteiras administrativas de '{map_file}'. Isto pode demorar bastante.")
+    estados, municipios, bairros = _ler_areas_do_pbf(map_file)
+    logger.info(f"Encontrados {len(estados)} estados, {len(municipios)} municípios e {len(bairros)} bairros.")
+
+    geom_estados = shapely.from_wkb([w for _, w in estados])
+    geom_municipios = shapely.from_wkb([w for _, w in municipios])
+    geom_bairros = shapely.from_wkb([w for _, w in bairros])
+
+    estado_do_municipio = _atribuir_a_poligonos(geom_municipios, geom_estados)
+    municipio_do_bairro = _atribuir_a_poligonos(geom_bairros, geom_municipios)
+
+    bairros_por_municipio = defaultdict(list)
+    for i, m in enumerate(municipio_do_bairro.tolist()):
+        if m >= 0:
+            bairros_por_municipio[m].append(i)
+
+    total = 0
+    for m, (nome_cidade, wkb_municipio) in enumerate(municipios):
+        e = int(estado_do_municipio[m])
+        if e < 0:
+            continue
+        nome_estado = estados[e][0]
+        conteudo = {
+            "estado": nome_estado, "cidade": nome_cidade, "municipio": wkb_municipio,
+            "bairros": [{"nome": bairros[b][0], "wkb": bairros[b][1]} for b in bairros_por_municipio[m]]
+        }
+        cache_manager.gravar(NAMESPACE_CACHE, _chave_limites(nome_estado, nome_cidade), conteudo)
+        total += 1
+
+    logger.info(f"💾 Limites guardados para {total} municípios.")
+    return total
+
+def carregar_municipios_extraidos():
+    """Lê todas as entradas de limites e devolve (estados, cidades, geometrias) dos municípios extraídos."""
+    import shapely
+
+    # Migra primeiro os ficheiros soltos de versões anteriores
+    for caminho in glob.glob(os.path.join(CACHE_DIR, "*-LIMITES.json")):
+        chave = os.path.basename(caminho)[:-len("-LIMITES.json")]
+        cache_manager.ler(NAMESPACE_CACHE, chave, legado=caminho)
+
+    estados, cidades, wkbs = [], [], []
+    for chave in cache_manager.listar_chaves(NAMESPACE_CACHE):
+        conteudo = cache_manager.ler(NAMESPACE_CACHE, chave)
+        if conteudo is None:
+            continue
+        estados.append(conteudo['estado'])
+        cidades.append(conteudo['cidade'])
+        wkbs.append(conteudo['municipio'])
+    return estados, cidades, shapely.from_wkb(wkbs)
+
+# --- VALIDAÇÃO EM LOTE ---
+
+def _carregar_limites(estado, cidade):
+    """
+    Carrega (uma vez por processo) os polígonos da cidade e constrói o índice espacial dos bairros.
+    Uma cidade sem limites também fica registada, para o aviso sair uma só vez.
+    """
+    chave = _chave_limites(estado, cidade)
+    with _trinco:
+        if chave in _limites_em_memoria:
+            return _limites_em_memoria[chave]
+
+    conteudo = _ler_limites(estado, cidade)
+    if conteudo is None:
+        logger.warning(f"Sem limites extraídos para {cidade}/{estado}: a validação offline fica desligada "
+                       f"para esta cidade. Confirme o nome da cidade e do estado, ou execute o 'cria_limites.py'.")
+        with _trinco:
+            _limites_em_memoria[chave] = None
+        return None
+
+    import shapely
+
+    municipio = shapely.from_wkb(conteudo['municipio'])
+    shapely.prepare(municipio)
+    nomes_bairros = [normalizar_nome(b['nome']) for b in conteudo['bairros']]
+    geom_bairros = shapely.from_wkb([b['wkb'] for b in conteudo['bairros']])
+    limites = {
+        "municipio": municipio,
+        "nomes_bairros": nomes_bairros,
+        "arvore": shapely.STRtree(geom_bairros) if nomes_bairros else None,
+    }
+    with _trinco:
+        _limites_em_memoria[chave] = limites
+    return limites
+
+def _bairro_confere(bairro_original, bairros_do_ponto):
+    original = normalizar_nome(bairro_original or '')
+    if not original:
+        return False
+    return any(original in b or b in original for b in bairros_do_ponto)
+
+def validar_pontos(estado, cidade, lote):
+    """
+    Valida em lote os pontos de um LoteCeps (coordenadas e bairro esperado).
+    Devolve o resultado da validação de cada ponto, ou None se os limites da cidade não foram extraídos.
+    """
+    limites = _carregar_limites(estado, cidade)
+    if limites is None:
+        return None
+    if not lote:
+        return []
+
+    import numpy as np
+    import shapely
+
+    # Os arrays do lote são lidos diretamente, sem cópia
+    lons = np.frombuffer(lote.longitudes, dtype=np.float64)
+    lats = np.frombuffer(lote.latitudes, dtype=np.float64)
+    dentro_do_municipio = shapely.contains_xy(limites['municipio'], lons, lats).tolist()
+
+    bairros_do_ponto = [[] for _ in range(len(lote))]
+    if limites['arvore'] is not None:
+        idx_pontos, idx_bairros = limites['arvore'].query(shapely.points(lons, lats), predicate='within')
+        for p, b in zip(idx_pontos.tolist(), idx_bairros.tolist()):
+            bairros_do_ponto[p].append(limites['nomes_bairros'][b])
+
+    resultados = []
+    for i in range(len(lote)):
+        if not dentro_do_municipio[i]:
+            resultados.append(FORA_DO_MUNICIPIO)
+        elif not bairros_do_ponto[i]:
+            resultados.append(SEM_COBERTURA)
+        elif _bairro_confere(lote.bairro(i), bairros_do_ponto[i]):
+            resultados.append(VALIDO)
+        else:
+            resultados.append(BAIRRO_DIVERGENTE)
+    return resultados
+
+def marcar_validacao(estado, cidade, lote):
+    """
+    Guarda no lote geocodificado o resultado da validação de cada ponto.
+    Devolve o número de pontos que falharam, ou None se não houver limites para a cidade.
+    """
+    resultados = validar_pontos(estado, cidade, lote)
+    if resultados is None:
+        return None
+    lote.definir_validacao(resultados)
+    falhas = sum(1 for r in resultados if r in FALHAS)
+    logger.info(f"Validação offline de {cidade}/{estado}: {falhas} de {len(resultados)} pontos suspeitos.")
+    return falhas
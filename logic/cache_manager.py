@@ -0,0 +1,320 @@
+# logic/cache_manager.py
+# Gestor do diretório 'cache/'. Cada tipo de dado vive num "namespace" (subdiretório) com
+# orçamento de tamanho próprio. As entradas são JSON comprimido (zstd se disponível, senão gzip),
+# gravadas de forma atómica (ficheiro temporário + rename) e registadas num índice SQLite
+# que guarda os acessos para o despejo LRU/LFU e as estatísticas de acertos por namespace.
+#
+# Estatísticas:  python -m logic.cache_manager stats
+
+import os
+import re
+import sys
+import json
+import gzip
+import zlib
+import time
+import hashlib
+import sqlite3
+import tempfile
+import threading
+from .logger import get_logger
+from . import metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Erros de uma entrada truncada ou corrompida: tratada como ausente e removida
+ERROS_ENTRADA_CORROMPIDA = (ValueError, EOFError, gzip.BadGzipFile, zlib.error)
+if zstandard is not None:
+    ERROS_ENTRADA_CORROMPIDA += (zstandard.ZstdError,)
+
+logger = get_logger(__name__)
+
+CACHE_DIR = "cache"
+ARQUIVO_INDICE = os.path.join(CACHE_DIR, "_indice.sqlite")
+# Diretório do cache de pedidos do osmnx (não é indexado por nós, só podado por tamanho)
+DIRETORIO_OSMNX = os.path.join(CACHE_DIR, "osmnx")
+
+MB = 1024 * 1024
+# Orçamento de bytes (já comprimidos) por namespace. None = nunca despejar.
+ORCAMENTOS = {
+    "cidades": 20 * MB,      # Listas de CEPs por cidade
+    "geocoded": 300 * MB,    # Mapas detalhados (CEP -> coordenadas) por cidade
+    "limites": None,         # Polígonos extraídos do PBF: recriá-los custa horas
+    "osmnx": 100 * MB,       # Respostas guardadas pelo osmnx
+    "http": 200 * MB,        # Páginas descarregadas pelos scrapers (ver http_cache.py)
+    "raizes": 50 * MB,       # CEPs encontrados e ausentes por raiz (ver cep_processing.py)
+}
+ORCAMENTO_PADRAO = 100 * MB
+# Política de despejo por namespace: 'lru' (menos recente) ou 'lfu' (menos usado)
+POLITICAS = {}
+POLITICA_PADRAO = "lru"
+
+NIVEL_ZSTD = 10
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS entradas (
+    namespace TEXT, chave TEXT, ficheiro TEXT, bytes INTEGER,
+    acessos INTEGER DEFAULT 0, ultimo_acesso REAL,
+    PRIMARY KEY (namespace, chave)
+);
+CREATE TABLE IF NOT EXISTS estatisticas (
+    namespace TEXT PRIMARY KEY, hits INTEGER DEFAULT 0, misses INTEGER DEFAULT 0,
+    escritas INTEGER DEFAULT 0, despejos INTEGER DEFAULT 0
+);
+"""
+
+_local = threading.local()
+_CHAVE_LEGIVEL = re.compile(r"^[\w .-]{1,120}$")
+
+def chave_cidade(estado, cidade):
+    """Chave usada pelos namespaces que guardam uma entrada por cidade."""
+    return f"{estado.lower()}-{cidade.lower()}"
+
+def _conexao():
+    """Uma ligação por thread; o SQLite trata da concorrência entre processos."""
+    con = getattr(_local, 'conexao', None)
+    if con is None:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        con = sqlite3.connect(ARQUIVO_INDICE, timeout=30, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.executescript(_ESQUEMA)
+        _local.conexao = con
+    return con
+
+def _contar(namespace, campo, n=1):
+    _conexao().execute(
+        f"INSERT INTO estatisticas (namespace, {campo}) VALUES (?, ?) "
+        f"ON CONFLICT (namespace) DO UPDATE SET {campo} = {campo} + excluded.{campo}",
+        (namespace, n)
+    )
+
+def _nome_ficheiro(chave):
+    base = chave if _CHAVE_LEGIVEL.match(chave) else hashlib.sha1(chave.encode('utf-8')).hexdigest()
+    return base + (".json.zst" if zstandard else ".json.gz")
+
+def _comprimir(dados):
+    if zstandard:
+        return zstandard.ZstdCompressor(level=NIVEL_ZSTD).compress(dados)
+    return gzip.compress(dados)
+
+def _descomprimir(caminho, dados):
+    if caminho.endswith(".zst"):
+        if zstandard is None:
+            raise ValueError("entrada comprimida com zstd, mas o módulo 'zstandard' não está instalado")
+        return zstandard.ZstdDecompressor().decompress(dados)
+    return gzip.decompress(dados)
+
+def _gravar_atomico(caminho, dados):
+    """Grava num temporário do mesmo diretório e troca-o de uma vez, para nunca deixar meio ficheiro."""
+    diretorio = os.path.dirname(caminho)
+    os.makedirs(diretorio, exist_ok=True)
+    descritor, temporario = tempfile.mkstemp(dir=diretorio, prefix=".tmp-")
+    try:
+        with os.fdopen(descritor, 'wb') as f:
+            f.write(dados)
+        os.replace(temporario, caminho)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+def _importar_legado(namespace, chave, legado):
+    """Migra um ficheiro JSON antigo (sem compressão nem índice) para o gestor."""
+    try:
+        with open(legado, 'r', encoding='utf-8') as f:
+            valor = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Não foi possível importar o cache antigo '{legado}': {e}")
+        return None
+    gravar(namespace, chave, valor)
+    os.remove(legado)
+    logger.info(f"Cache antigo '{legado}' migrado para o namespace '{namespace}'.")
+    return valor
+
+def existe(namespace, chave, legado=None):
+    """Indica se há uma entrada para a chave, sem contar como acesso."""
+    linha = _conexao().execute(
+        "SELECT ficheiro FROM entradas WHERE namespace = ? AND chave = ?", (namespace, chave)
+    ).fetchone()
+    if linha and os.path.exists(os.path.join(CACHE_DIR, namespace, linha[0])):
+        return True
+    return bool(legado) and os.path.exists(legado)
+
+def ler(namespace, chave, legado=None):
+    """
+    Devolve o valor guardado para a chave, ou None se não existir.
+    'legado' é o caminho do ficheiro JSON antigo equivalente, migrado no primeiro acesso.
+    """
+    con = _conexao()
+    linha = con.execute(
+        "SELECT ficheiro FROM entradas WHERE namespace = ? AND chave = ?", (namespace, chave)
+    ).fetchone()
+    if linha:
+        caminho = os.path.join(CACHE_DIR, namespace, linha[0])
+        try:
+            with open(caminho, 'rb') as f:
+                valor = json.loads(_descomprimir(caminho, f.read()))
+            con.execute(
+                "UPDATE entradas SET acessos = acessos + 1, ultimo_acesso = ? WHERE namespace = ? AND chave = ?",
+                (time.time(), namespace, chave)
+            )
+            _contar(namespace, "hits")
+            metrics.registar_cache(namespace, True)
+            return valor
+        except FileNotFoundError:
+            # Despejado por outro processo entre a consulta ao índice e a leitura
+            con.execute("DELETE FROM entradas WHERE namespace = ? AND chave = ?", (namespace, chave))
+        except ERROS_ENTRADA_CORROMPIDA as e:
+            logger.warning(f"Entrada corrompida no cache '{namespace}/{chave}': {e}")
+            remover(namespace, chave)
+
+    if legado and os.path.exists(legado):
+        valor = _importar_legado(namespace, chave, legado)
+        if valor is not None:
+            _contar(namespace, "hits")
+            metrics.registar_cache(namespace, True)
+            return valor
+
+    _contar(namespace, "misses")
+    metrics.registar_cache(namespace, False)
+    return None
+
+def gravar(namespace, chave, valor):
+    """Guarda o valor (serializável em JSON) comprimido e aplica o orçamento do namespace."""
+    dados = _comprimir(json.dumps(valor, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+    ficheiro = _nome_ficheiro(chave)
+    _gravar_atomico(os.path.join(CACHE_DIR, namespace, ficheiro), dados)
+
+    con = _conexao()
+    anterior = con.execute(
+        "SELECT ficheiro FROM entradas WHERE namespace = ? AND chave = ?", (namespace, chave)
+    ).fetchone()
+    if anterior and anterior[0] != ficheiro:
+        # A entrada antiga foi gravada com outro compressor: apaga o ficheiro órfão
+        try:
+            os.remove(os.path.join(CACHE_DIR, namespace, anterior[0]))
+        except FileNotFoundError:
+            pass
+    con.execute(
+        "INSERT INTO entradas (namespace, chave, ficheiro, bytes, acessos, ultimo_acesso) VALUES (?, ?, ?, ?, 1, ?) "
+        "ON CONFLICT (namespace, chave) DO UPDATE SET ficheiro = excluded.ficheiro, bytes = excluded.bytes, "
+        "ultimo_acesso = excluded.ultimo_acesso",
+        (namespace, chave, ficheiro, len(dados), time.time())
+    )
+    _contar(namespace, "escritas")
+    _aplicar_orcamento(namespace)
+
+def remover(namespace, chave):
+    con = _conexao()
+    linha = con.execute(
+        "SELECT ficheiro FROM entradas WHERE namespace = ? AND chave = ?", (namespace, chave)
+    ).fetchone()
+    con.execute("DELETE FROM entradas WHERE namespace = ? AND chave = ?", (namespace, chave))
+    if linha:
+        try:
+            os.remove(os.path.join(CACHE_DIR, namespace, linha[0]))
+        except FileNotFoundError:
+            pass
+
+def listar_chaves(namespace):
+    linhas = _conexao().execute("SELECT chave FROM entradas WHERE namespace = ? ORDER BY chave", (namespace,))
+    return [chave for (chave,) in linhas]
+
+def _aplicar_orcamento(namespace):
+    orcamento = ORCAMENTOS.get(namespace, ORCAMENTO_PADRAO)
+    if orcamento is None:
+        return
+    con = _conexao()
+    (total,) = con.execute(
+        "SELECT COALESCE(SUM(bytes), 0) FROM entradas WHERE namespace = ?", (namespace,)
+    ).fetchone()
+    if total <= orcamento:
+        return
+
+    if POLITICAS.get(namespace, POLITICA_PADRAO) == "lfu":
+        ordem = "acessos ASC, ultimo_acesso ASC"
+    else:
+        ordem = "ultimo_acesso ASC"
+    candidatos = con.execute(
+        f"SELECT chave, bytes FROM entradas WHERE namespace = ? ORDER BY {ordem}", (namespace,)
+    ).fetchall()
+    despejados = 0
+    for chave, tamanho in candidatos:
+        if total <= orcamento:
+            break
+        remover(namespace, chave)
+        total -= tamanho
+        despejados += 1
+    _contar(namespace, "despejos", despejados)
+    logger.info(f"Cache '{namespace}' acima do orçamento: {despejados} entrada(s) despejada(s).")
+
+def podar_diretorio(namespace, diretorio):
+    """
+    Aplica o orçamento a um diretório gerido por outra biblioteca (ex.: o cache do osmnx),
+    apagando primeiro os ficheiros acedidos há mais tempo.
+    """
+    orcamento = ORCAMENTOS.get(namespace, ORCAMENTO_PADRAO)
+    if orcamento is None or not os.path.isdir(diretorio):
+        return 0
+    ficheiros = []
+    for raiz, _, nomes in os.walk(diretorio):
+        for nome in nomes:
+            caminho = os.path.join(raiz, nome)
+            info = os.stat(caminho)
+            ficheiros.append((max(info.st_atime, info.st_mtime), info.st_size, caminho))
+    total = sum(tamanho for _, tamanho, _ in ficheiros)
+    despejados = 0
+    for _, tamanho, caminho in sorted(ficheiros):
+        if total <= orcamento:
+            break
+        os.remove(caminho)
+        total -= tamanho
+        despejados += 1
+    if despejados:
+        _contar(namespace, "despejos", despejados)
+        logger.info(f"Diretório '{diretorio}' podado: {despejados} ficheiro(s) apagado(s).")
+    return despejados
+
+def estatisticas():
+    """Devolve, por namespace, o número de entradas, bytes ocupados e taxa de acertos."""
+    con = _conexao()
+    ocupacao = {
+        ns: (n, b) for ns, n, b in con.execute(
+            "SELECT namespace, COUNT(*), COALESCE(SUM(bytes), 0) FROM entradas GROUP BY namespace"
+        )
+    }
+    contadores = {
+        ns: (h, m, e, d) for ns, h, m, e, d in con.execute(
+            "SELECT namespace, hits, misses, escritas, despejos FROM estatisticas"
+        )
+    }
+    resultado = []
+    for ns in sorted(set(ocupacao) | set(contadores)):
+        entradas, tamanho = ocupacao.get(ns, (0, 0))
+        hits, misses, escritas, despejos = contadores.get(ns, (0, 0, 0, 0))
+        consultas = hits + misses
+        resultado.append({
+            "namespace": ns, "entradas": entradas, "bytes": tamanho,
+            "orcamento": ORCAMENTOS.get(ns, ORCAMENTO_PADRAO),
+            "hits": hits, "misses": misses,
+            "taxa_acerto": round(hits / consultas, 3) if consultas else None,
+            "escritas": escritas, "despejos": despejos,
+        })
+    return resultado
+
+def imprimir_estatisticas():
+    print(f"{'namespace':<12} {'entradas':>9} {'MB':>9} {'orçamento':>10} {'hits':>8} {'misses':>8} {'acerto':>7} {'despejos':>9}")
+    for e in estatisticas():
+        orcamento = f"{e['orcamento'] / MB:.0f}" if e['orcamento'] is not None else "-"
+        acerto = f"{e['taxa_acerto']:.1%}" if e['taxa_acerto'] is not None else "-"
+        print(f"{e['namespace']:<12} {e['entradas']:>9} {e['bytes'] / MB:>9.2f} {orcamento:>10} "
+              f"{e['hits']:>8} {e['misses']:>8} {acerto:>7} {e['despejos']:>9}")
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["stats"]:
+        imprimir_estatisticas()
+    else:
+        print("Uso: python -m logic.cache_manager stats")
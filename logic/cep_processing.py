@@ -1,55 +1,162 @@
 # logic/cep_processing.py
 
 import os
-import json
-from concurrent.futures import ThreadPoolExecutor
+import time
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from .logger import get_logger
 from .city_cep_scraper import get_ceps_from_city
-from .cep_service import get_info_from_cep
+from .cep_service import consultar_cep, CEP_INEXISTENTE
+from .cep_scrapers import estatisticas_qualocep
+from .boundary_validation import marcar_validacao
+from .cep_record import LoteCeps
+from . import cache_manager
+from . import metrics
 
 logger = get_logger(__name__)
 CACHE_DIR = "cache"
+NAMESPACE_CACHE = "geocoded"
+# CEPs por raiz (5 primeiros dígitos), usados pelos cálculos por raiz de distance_calc.py
+NAMESPACE_RAIZES = "raizes"
+# Um CEP que todas as fontes disseram não ter volta a ser consultado depois deste prazo
+VALIDADE_AUSENTES_S = 30 * 24 * 60 * 60
 
-def get_geocoded_ceps_for_city(estado, cidade):
-    # Define um nome de ficheiro para o novo cache com as coordenadas
-    geocoded_cache_filename = os.path.join(CACHE_DIR, f"{estado.lower()}-{cidade.lower()}-GEOCODED.json")
+# Um trinco por raiz: duas threads que juntem CEPs à mesma raiz não apagam os da outra
+_trinco_raizes = threading.Lock()
+_trincos_por_raiz = {}
+
+def _caminho_geocoded(estado, cidade):
+    """Caminho antigo (JSON solto no cache), migrado para o gestor de cache no primeiro acesso."""
+    return os.path.join(CACHE_DIR, f"{estado.lower()}-{cidade.lower()}-GEOCODED.json")
+
+def _ler_mapa_da_cidade(estado, cidade):
+    dados = cache_manager.ler(NAMESPACE_CACHE, cache_manager.chave_cidade(estado, cidade),
+                              legado=_caminho_geocoded(estado, cidade))
+    return LoteCeps.de_json(dados) if dados is not None else None
+
+def _gravar_mapa_da_cidade(estado, cidade, lote):
+    cache_manager.gravar(NAMESPACE_CACHE, cache_manager.chave_cidade(estado, cidade), lote.para_json())
 
+def get_geocoded_ceps_for_city(estado, cidade):
     # Primeiro, ele verifica se o mapa detalhado já existe
-    if os.path.exists(geocoded_cache_filename):
+    mapa_em_cache = _ler_mapa_da_cidade(estado, cidade)
+    if mapa_em_cache is not None:
         logger.info(f"✅ Mapa detalhado (GEOCODED) encontrado para '{cidade}/{estado}'.")
-        with open(geocoded_cache_filename, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return mapa_em_cache
 
     logger.info(f"🚀 Mapa detalhado não encontrado. A iniciar o mapeamento para '{cidade}/{estado}'.")
     
     # Se não existe, ele busca a lista simples de CEPs (que também usa o seu próprio cache)
     ceps_da_cidade = get_ceps_from_city(estado, cidade)
     if not ceps_da_cidade:
-        return []
+        return LoteCeps()
 
     logger.info(f"A obter coordenadas para {len(ceps_da_cidade)} CEPs. Isto pode demorar, mas só acontece uma vez por cidade.")
     
-    resultados_geocodificados = []
+    resultados_geocodificados = LoteCeps()
+    ausentes = []
     total_ceps = len(ceps_da_cidade)
 
     # Ele faz as consultas online em paralelo para ser mais rápido
-    with ThreadPoolExecutor(max_workers=20) as executor:
-        future_to_cep = {executor.submit(get_info_from_cep, cep): cep for cep in ceps_da_cidade}
-        for i, future in enumerate(executor.as_completed(future_to_cep)):
+    with metrics.cronometrar("mapeamento_cidade"), ThreadPoolExecutor(max_workers=20) as executor:
+        future_to_cep = {executor.submit(consultar_cep, cep): cep for cep in ceps_da_cidade}
+        for i, future in enumerate(as_completed(future_to_cep)):
             cep = future_to_cep[future]
             try:
-                lat, lon, bairro, rua = future.result()
-                if lat is not None and lon is not None:
-                    resultados_geocodificados.append({
-                        "cep": cep, "latitude": lat, "longitude": lon, "bairro": bairro, "rua": rua
-                    })
+                registo = future.result()
+                # Só fica marcado como ausente o que todas as fontes negaram; uma falha (None) não
+                if registo is CEP_INEXISTENTE:
+                    ausentes.append(cep)
+                elif registo is not None:
+                    resultados_geocodificados.adicionar(registo)
             except Exception as e:
                 logger.error(f"Erro no CEP {cep} durante mapeamento: {e}")
             if (i + 1) % 100 == 0: logger.info(f"Mapeados {i + 1}/{total_ceps} CEPs...")
     
+    # Marca os pontos que caem fora do município ou do bairro esperado (só se houver limites extraídos)
+    marcar_validacao(estado, cidade, resultados_geocodificados)
+    metrics.contar("ceps_mapeados", len(resultados_geocodificados))
+    metrics.contar("ceps_sem_dados", total_ceps - len(resultados_geocodificados))
+
     # Finalmente, ele salva o mapa detalhado num novo ficheiro de cache
+    logger.info(f"Caminhos usados no qualocep.com (acumulado): {estatisticas_qualocep()}")
     logger.info(f"💾 Mapeamento concluído. A salvar {len(resultados_geocodificados)} ruas no cache.")
-    with open(geocoded_cache_filename, 'w', encoding='utf-8') as f:
-        json.dump(resultados_geocodificados, f, ensure_ascii=False, indent=2)
+    _gravar_mapa_da_cidade(estado, cidade, resultados_geocodificados)
+    # Os cálculos por raiz passam a encontrar estes CEPs (e os ausentes) sem nenhuma consulta
+    registar_ceps_por_raiz(resultados_geocodificados, ausentes)
+
+    return resultados_geocodificados
+
+def ler_ceps_da_raiz(raiz):
+    """
+    Devolve ({cep: RegistoCep}, {cep ausente}) já conhecidos para a raiz.
+    Os ausentes mais antigos do que VALIDADE_AUSENTES_S não são devolvidos.
+    """
+    dados = cache_manager.ler(NAMESPACE_RAIZES, raiz)
+    if dados is None:
+        return {}, set()
+    registos = {registo.cep: registo for registo in LoteCeps.de_json(dados['ceps'])}
+    limite = time.time() - VALIDADE_AUSENTES_S
+    ausentes = {cep for cep, quando in dados['ausentes'].items() if quando >= limite}
+    return registos, ausentes
+
+def _trinco_da_raiz(raiz):
+    with _trinco_raizes:
+        return _trincos_por_raiz.setdefault(raiz, threading.Lock())
+
+def registar_ceps_da_raiz(raiz, registos, ausentes=()):
+    """Junta CEPs encontrados e ausentes ao que já está no cache da raiz."""
+    if not registos and not ausentes:
+        return
+    with _trinco_da_raiz(raiz):
+        dados = cache_manager.ler(NAMESPACE_RAIZES, raiz)
+        conhecidos = {r.cep: r for r in LoteCeps.de_json(dados['ceps'])} if dados else {}
+        datas_ausentes = dict(dados['ausentes']) if dados else {}
+        for registo in registos:
+            conhecidos[registo.cep] = registo
+        agora = time.time()
+        for cep in ausentes:
+            datas_ausentes[cep] = agora
+        datas_ausentes = {cep: quando for cep, quando in datas_ausentes.items() if cep not in conhecidos}
+        cache_manager.gravar(NAMESPACE_RAIZES, raiz, {
+            "ceps": LoteCeps.de_registos(conhecidos.values()).para_json(),
+            "ausentes": datas_ausentes,
+        })
+
+def registar_ceps_por_raiz(registos, ausentes=()):
+    """Distribui CEPs encontrados (RegistoCep) e ausentes (texto) pelos caches das suas raízes."""
+    por_raiz = defaultdict(list)
+    ausentes_por_raiz = defaultdict(list)
+    for registo in registos:
+        por_raiz[registo.cep[:5]].append(registo)
+    for cep in ausentes:
+        ausentes_por_raiz[cep[:5]].append(cep)
+    for raiz in sorted(set(por_raiz) | set(ausentes_por_raiz)):
+        registar_ceps_da_raiz(raiz, por_raiz[raiz], ausentes_por_raiz[raiz])
+
+def listar_cidades_mapeadas():
+    """Devolve (estado, cidade) de todos os mapas detalhados no cache, incluindo os ficheiros antigos."""
+    chaves = set(cache_manager.listar_chaves(NAMESPACE_CACHE))
+    sufixo = "-GEOCODED.json"
+    if os.path.isdir(CACHE_DIR):
+        chaves.update(nome[:-len(sufixo)] for nome in os.listdir(CACHE_DIR) if nome.endswith(sufixo))
+    # A chave é '<estado>-<cidade>', e o nome do estado nunca tem hífens
+    return [tuple(chave.split('-', 1)) for chave in sorted(chaves) if '-' in chave]
+
+def validar_cache_da_cidade(estado, cidade):
+    """
+    Valida offline todos os pontos do mapa detalhado (GEOCODED) de uma cidade
+    e regrava o cache com o campo 'validacao'. Devolve o número de pontos suspeitos.
+    """
+    dados_geocodificados = _ler_mapa_da_cidade(estado, cidade)
+    if dados_geocodificados is None:
+        return None
+
+    falhas = marcar_validacao(estado, cidade, dados_geocodificados)
+    if falhas is None:
+        logger.warning(f"Sem limites extraídos para '{cidade}/{estado}'. Execute o 'cria_limites.py' primeiro.")
+        return None
 
-    return resultados_geocodificados
\ No newline at end of file
+    _gravar_mapa_da_cidade(estado, cidade, dados_geocodificados)
+    return falhas
\ No newline at end of file
@@ -0,0 +1,146 @@
+# logic/cep_record.py
+# Tipos compactos para resultados de geocodificação de CEPs.
+# RegistoCep substitui o antigo tuplo (lat, lon, bairro, rua): os campos são sempre lidos pelo
+# nome, por isso um erro de aridade ao desempacotar deixa de ser possível.
+# LoteCeps guarda muitos registos em arrays tipados, com cada texto de bairro/rua guardado uma só vez.
+
+import sys
+from array import array
+
+def _internar(texto):
+    return sys.intern(texto) if isinstance(texto, str) else texto
+
+class RegistoCep:
+    """Resultado da geocodificação de um CEP."""
+    __slots__ = ('cep', 'latitude', 'longitude', 'bairro', 'rua', 'validacao')
+
+    def __init__(self, cep, latitude, longitude, bairro=None, rua=None, validacao=None):
+        self.cep = str(cep)
+        self.latitude = float(latitude)
+        self.longitude = float(longitude)
+        self.bairro = _internar(bairro)
+        self.rua = _internar(rua)
+        self.validacao = _internar(validacao)
+
+    def __repr__(self):
+        return f"RegistoCep({self.cep!r}, {self.latitude}, {self.longitude}, {self.bairro!r}, {self.rua!r})"
+
+    def __eq__(self, outro):
+        if not isinstance(outro, RegistoCep):
+            return NotImplemented
+        return all(getattr(self, c) == getattr(outro, c) for c in self.__slots__)
+
+    def para_dict(self):
+        dados = {"cep": self.cep, "latitude": self.latitude, "longitude": self.longitude,
+                 "bairro": self.bairro, "rua": self.rua}
+        if self.validacao is not None:
+            dados["validacao"] = self.validacao
+        return dados
+
+class LoteCeps:
+    """
+    Coleção de registos em colunas: CEPs e coordenadas em arrays tipados, e bairro, rua e
+    validação como códigos para uma tabela de textos partilhada (o código 0 é "sem valor").
+    """
+    __slots__ = ('ceps', 'latitudes', 'longitudes', 'codigos_bairro', 'codigos_rua', 'codigos_validacao',
+                 'textos', '_codigo_do_texto')
+
+    def __init__(self):
+        self.ceps = array('q')
+        self.latitudes = array('d')
+        self.longitudes = array('d')
+        self.codigos_bairro = array('I')
+        self.codigos_rua = array('I')
+        self.codigos_validacao = array('I')
+        self.textos = [None]
+        self._codigo_do_texto = {None: 0}
+
+    def _codigo(self, texto):
+        codigo = self._codigo_do_texto.get(texto)
+        if codigo is None:
+            codigo = len(self.textos)
+            texto = _internar(texto)
+            self.textos.append(texto)
+            self._codigo_do_texto[texto] = codigo
+        return codigo
+
+    def adicionar(self, registo):
+        self.ceps.append(int(registo.cep))
+        self.latitudes.append(registo.latitude)
+        self.longitudes.append(registo.longitude)
+        self.codigos_bairro.append(self._codigo(registo.bairro))
+        self.codigos_rua.append(self._codigo(registo.rua))
+        self.codigos_validacao.append(self._codigo(registo.validacao))
+
+    def __len__(self):
+        return len(self.ceps)
+
+    def __bool__(self):
+        return len(self.ceps) > 0
+
+    def cep(self, i):
+        return str(self.ceps[i]).zfill(8)
+
+    def bairro(self, i):
+        return self.textos[self.codigos_bairro[i]]
+
+    def rua(self, i):
+        return self.textos[self.codigos_rua[i]]
+
+    def validacao(self, i):
+        return self.textos[self.codigos_validacao[i]]
+
+    def __getitem__(self, i):
+        return RegistoCep(self.cep(i), self.latitudes[i], self.longitudes[i],
+                          self.bairro(i), self.rua(i), self.validacao(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def lista_ceps(self):
+        return [self.cep(i) for i in range(len(self))]
+
+    def lista_bairros(self):
+        return [self.textos[c] for c in self.codigos_bairro]
+
+    def lista_ruas(self):
+        return [self.textos[c] for c in self.codigos_rua]
+
+    def definir_validacao(self, resultados):
+        self.codigos_validacao = array('I', (self._codigo(r) for r in resultados))
+
+    @classmethod
+    def de_registos(cls, registos):
+        lote = cls()
+        for registo in registos:
+            lote.adicionar(registo)
+        return lote
+
+    def para_json(self):
+        """Formato em colunas para o cache (bem mais pequeno do que uma lista de dicts)."""
+        return {
+            "formato": "colunas",
+            "ceps": self.ceps.tolist(), "latitudes": self.latitudes.tolist(), "longitudes": self.longitudes.tolist(),
+            "textos": self.textos, "bairros": self.codigos_bairro.tolist(), "ruas": self.codigos_rua.tolist(),
+            "validacao": self.codigos_validacao.tolist(),
+        }
+
+    @classmethod
+    def de_json(cls, dados):
+        """Aceita o formato em colunas e também a lista de dicts dos caches antigos."""
+        if isinstance(dados, list):
+            return cls.de_registos(
+                RegistoCep(d['cep'], d['latitude'], d['longitude'], d.get('bairro'), d.get('rua'), d.get('validacao'))
+                for d in dados
+            )
+        lote = cls()
+        lote.ceps = array('q', dados['ceps'])
+        lote.latitudes = array('d', dados['latitudes'])
+        lote.longitudes = array('d', dados['longitudes'])
+        lote.codigos_bairro = array('I', dados['bairros'])
+        lote.codigos_rua = array('I', dados['ruas'])
+        lote.codigos_validacao = array('I', dados.get('validacao') or [0] * len(lote.ceps))
+        lote.textos = [_internar(t) for t in dados['textos']]
+        lote._codigo_do_texto = {t: i for i, t in enumerate(lote.textos)}
+        return lote
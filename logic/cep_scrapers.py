@@ -1,10 +1,14 @@
 # logic/cep_scrapers.py
 
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 import re
 import time
+import threading
 from .logger import get_logger
+from .cep_record import RegistoCep
+from . import metrics
 
 # --- NOVAS IMPORTAÇÕES PARA O SELENIUM ---
 from selenium import webdriver
@@ -16,6 +20,35 @@ from webdriver_manager.chrome import ChromeDriverManager
 
 logger = get_logger(__name__)
 
+URL_QUALOCEP = "https://www.qualocep.com/busca-cep/{cep}/"
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+# --- CAMINHO RÁPIDO (HTTP SIMPLES) ---
+# Muitas páginas do qualocep chegam como HTML estático: um GET numa sessão com pool de ligações
+# e o mesmo parser resolvem em milissegundos. O Chrome só é usado quando a página vem bloqueada,
+# é um desafio anti-bot, ou não traz os dados.
+SESSAO = requests.Session()
+SESSAO.headers.update({
+    'User-Agent': USER_AGENT,
+    'Accept': 'text/html,application/xhtml+xml',
+    'Accept-Language': 'pt-BR,pt;q=0.9',
+})
+# 20 ligações, tantas quantas as threads do mapeamento de cidades
+SESSAO.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=20))
+
+# Sinais de que recebemos uma página de bloqueio/desafio em vez do conteúdo
+MARCADORES_BLOQUEIO = (
+    'cf-challenge', 'challenge-platform', 'cf-browser-verification', 'just a moment',
+    'attention required', 'captcha', 'access denied',
+)
+# Depois de tantos bloqueios seguidos, o caminho rápido é suspenso por algum tempo
+BLOQUEIOS_PARA_SUSPENDER = 5
+SUSPENSAO_CAMINHO_RAPIDO_S = 10 * 60
+
+ESTATISTICAS = {"http": 0, "selenium": 0, "bloqueios": 0, "escaladas": 0, "falhas": 0}
+_estado_caminho_rapido = {"bloqueios_seguidos": 0, "suspenso_ate": 0.0}
+_trinco = threading.Lock()
+
 # --- CONFIGURAÇÃO DO NAVEGADOR SELENIUM ---
 # Isto configura o Chrome para correr em "headless mode" (sem interface gráfica),
 # que é essencial para correr em servidores como o GitHub Actions.
@@ -24,67 +57,169 @@ options.add_argument("--headless")
 options.add_argument("--no-sandbox")
 options.add_argument("--disable-dev-shm-usage")
 options.add_argument("--window-size=1920,1080")
-options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36")
+options.add_argument(f"user-agent={USER_AGENT}")
+
+# O serviço do WebDriver só é criado na primeira vez que o Chrome for mesmo preciso
+# (o ChromeDriverManager descarrega o driver necessário automaticamente)
+_servico = None
+
+def _obter_servico():
+    global _servico
+    with _trinco:
+        if _servico is None:
+            _servico = Service(ChromeDriverManager().install())
+        return _servico
+
+def _contar(campo):
+    with _trinco:
+        ESTATISTICAS[campo] += 1
+
+def estatisticas_qualocep():
+    """Quantas vezes cada caminho foi usado (http, selenium) e quantos bloqueios/escaladas houve."""
+    with _trinco:
+        return dict(ESTATISTICAS)
 
-# Inicializa o serviço do WebDriver uma vez para reutilizar
-# O ChromeDriverManager irá descarregar o driver necessário automaticamente
-servico = Service(ChromeDriverManager().install())
+def _extrair_dados_pagina(html, cep_limpo):
+    """Lê rua, bairro e coordenadas do HTML de uma página do qualocep. Devolve um RegistoCep ou None."""
+    soup = BeautifulSoup(html, 'lxml')
 
-def scrape_qualocep(cep_limpo):
+    rua, bairro = None, None
+    tabela_tr = soup.find('tr', class_='info')
+    if tabela_tr:
+        linha_dados = tabela_tr.find_next_sibling('tr')
+        if linha_dados:
+            celulas = linha_dados.find_all('td')
+            if len(celulas) >= 3:
+                rua = celulas[1].get_text(strip=True)
+                bairro = celulas[2].get_text(strip=True)
+
+    lat, lon = None, None
+    h4_coords = soup.find('h4', string=re.compile(r'Latitude:.*Longitude:'))
+    if h4_coords:
+        texto_coords = h4_coords.get_text()
+        match_lat = re.search(r'Latitude:.*?(-?\d+\.\d+)', texto_coords)
+        match_lon = re.search(r'Longitude:.*?(-?\d+\.\d+)', texto_coords)
+        if match_lat and match_lon:
+            lat = float(match_lat.group(1))
+            lon = float(match_lon.group(1))
+
+    if lat and lon and bairro and rua:
+        return RegistoCep(cep_limpo, lat, lon, bairro, rua)
+    return None
+
+def _pagina_bloqueada(status_code, html):
+    if status_code in (403, 429, 503):
+        return True
+    inicio = html[:5000].lower()
+    return any(marcador in inicio for marcador in MARCADORES_BLOQUEIO)
+
+def _caminho_rapido_ativo():
+    with _trinco:
+        return time.time() >= _estado_caminho_rapido["suspenso_ate"]
+
+def _registar_bloqueio(bloqueado):
+    with _trinco:
+        if not bloqueado:
+            _estado_caminho_rapido["bloqueios_seguidos"] = 0
+            return
+        ESTATISTICAS["bloqueios"] += 1
+        metrics.contar("qualocep_bloqueios")
+        _estado_caminho_rapido["bloqueios_seguidos"] += 1
+        if _estado_caminho_rapido["bloqueios_seguidos"] >= BLOQUEIOS_PARA_SUSPENDER:
+            _estado_caminho_rapido["bloqueios_seguidos"] = 0
+            _estado_caminho_rapido["suspenso_ate"] = time.time() + SUSPENSAO_CAMINHO_RAPIDO_S
+            logger.warning(f"qualocep.com está a bloquear pedidos simples. A usar só o Selenium durante {SUSPENSAO_CAMINHO_RAPIDO_S // 60} min.")
+
+def _tentar_http(cep_limpo, tentativas):
+    """
+    Caminho rápido: GET simples e parse do HTML. Devolve um RegistoCep ou None, e junta a
+    'tentativas' SEM_RESULTADO (página real sem o CEP) ou FALHA (rede, bloqueio, erro do site).
+    """
+    with metrics.medir_fonte("qualocep_http") as chamada:
+        try:
+            resposta = SESSAO.get(URL_QUALOCEP.format(cep=cep_limpo), timeout=10)
+        except requests.RequestException as e:
+            logger.debug(f"Pedido simples ao qualocep.com falhou para {cep_limpo}: {e}")
+            chamada.resultado = metrics.FALHA
+            tentativas.append(chamada.resultado)
+            return None
+
+        bloqueado = _pagina_bloqueada(resposta.status_code, resposta.text)
+        _registar_bloqueio(bloqueado)
+        if bloqueado or resposta.status_code not in (200, 404):
+            chamada.resultado = metrics.FALHA
+            tentativas.append(chamada.resultado)
+            return None
+        registo = _extrair_dados_pagina(resposta.text, cep_limpo) if resposta.status_code == 200 else None
+        if registo is None:
+            chamada.resultado = metrics.SEM_RESULTADO
+            tentativas.append(chamada.resultado)
+        return registo
+
+def _tentar_selenium(cep_limpo, tentativas):
     """
     Extrai dados de CEP do qualocep.com usando Selenium para contornar bloqueios.
+    Junta a 'tentativas' SEM_RESULTADO ou FALHA, como '_tentar_http'.
     """
     driver = None # Garante que a variável driver existe
-    try:
-        # Inicializa o navegador para cada pedido
-        driver = webdriver.Chrome(service=servico, options=options)
-        
-        url = f"https://www.qualocep.com/busca-cep/{cep_limpo}/"
-        logger.info(f"A tentar extrair dados do qualocep.com para o CEP {cep_limpo} usando Selenium...")
-        
-        driver.get(url)
-
-        # --- A MÁGICA ESTÁ AQUI ---
-        # Espera até 10 segundos para que a tabela de dados do CEP apareça na página.
-        # Isto garante que a página (e os anúncios) carregaram antes de tentarmos ler os dados.
-        WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.CLASS_NAME, "info"))
-        )
-
-        # Agora que a página está carregada, pegamos o HTML e usamos o BeautifulSoup como antes
-        soup = BeautifulSoup(driver.page_source, 'lxml')
-
-        rua, bairro = None, None
-        tabela_tr = soup.find('tr', class_='info')
-        if tabela_tr:
-            linha_dados = tabela_tr.find_next_sibling('tr')
-            if linha_dados:
-                celulas = linha_dados.find_all('td')
-                if len(celulas) >= 3:
-                    rua = celulas[1].get_text(strip=True)
-                    bairro = celulas[2].get_text(strip=True)
-
-        lat, lon = None, None
-        h4_coords = soup.find('h4', string=re.compile(r'Latitude:.*Longitude:'))
-        if h4_coords:
-            texto_coords = h4_coords.get_text()
-            match_lat = re.search(r'Latitude:.*?(-?\d+\.\d+)', texto_coords)
-            match_lon = re.search(r'Longitude:.*?(-?\d+\.\d+)', texto_coords)
-            if match_lat and match_lon:
-                lat = float(match_lat.group(1))
-                lon = float(match_lon.group(1))
-
-        if lat and lon and bairro and rua:
-            logger.info(f"Sucesso! Dados extraídos de qualocep.com para {cep_limpo}.")
-            return (lat, lon, bairro, rua)
-        else:
-            logger.warning(f"Dados incompletos encontrados em qualocep.com para {cep_limpo}.")
+    with metrics.medir_fonte("qualocep_selenium") as chamada:
+        try:
+            # Inicializa o navegador para cada pedido
+            driver = webdriver.Chrome(service=_obter_servico(), options=options)
+
+            url = URL_QUALOCEP.format(cep=cep_limpo)
+            logger.info(f"A tentar extrair dados do qualocep.com para o CEP {cep_limpo} usando Selenium...")
+
+            driver.get(url)
+
+            # --- A MÁGICA ESTÁ AQUI ---
+            # Espera até 10 segundos para que a tabela de dados do CEP apareça na página.
+            # Isto garante que a página (e os anúncios) carregaram antes de tentarmos ler os dados.
+            WebDriverWait(driver, 10).until(
+                EC.presence_of_element_located((By.CLASS_NAME, "info"))
+            )
+
+            # Agora que a página está carregada, usamos o mesmo parser do caminho rápido
+            registo = _extrair_dados_pagina(driver.page_source, cep_limpo)
+            if registo is None:
+                chamada.resultado = metrics.SEM_RESULTADO
+                tentativas.append(chamada.resultado)
+            return registo
+
+        except Exception as e:
+            logger.error(f"Erro com Selenium ao processar a página de qualocep.com para {cep_limpo}: {e}")
+            chamada.resultado = metrics.FALHA
+            tentativas.append(chamada.resultado)
             return None
+        finally:
+            # É muito importante fechar o navegador no final, mesmo que dê erro
+            if driver:
+                driver.quit()
+
+def scrape_qualocep(cep_limpo, respostas=None):
+    """
+    Extrai dados de CEP do qualocep.com. Tenta primeiro um pedido HTTP simples e só
+    abre o Chrome (Selenium) se a página vier bloqueada ou sem os dados.
+    Sem resultado, junta a 'respostas' SEM_RESULTADO se algum caminho recebeu a página
+    do site sem o CEP, ou FALHA se nenhum a conseguiu ler.
+    """
+    tentativas = []
+    if _caminho_rapido_ativo():
+        registo = _tentar_http(cep_limpo, tentativas)
+        if registo:
+            _contar("http")
+            logger.info(f"Sucesso! Dados extraídos de qualocep.com para {cep_limpo} (HTTP simples).")
+            return registo
+        _contar("escaladas")
+
+    registo = _tentar_selenium(cep_limpo, tentativas)
+    if registo:
+        _contar("selenium")
+        logger.info(f"Sucesso! Dados extraídos de qualocep.com para {cep_limpo}.")
+        return registo
 
-    except Exception as e:
-        logger.error(f"Erro com Selenium ao processar a página de qualocep.com para {cep_limpo}: {e}")
-        return None
-    finally:
-        # É muito importante fechar o navegador no final, mesmo que dê erro
-        if driver:
-            driver.quit()
\ No newline at end of file
+    _contar("falhas")
+    logger.warning(f"Dados incompletos encontrados em qualocep.com para {cep_limpo}.")
+    if respostas is not None:
+        respostas.append(metrics.SEM_RESULTADO if metrics.SEM_RESULTADO in tentativas else metrics.FALHA)
+    return None
@@ -5,76 +5,142 @@ import time
 from .geocoding import get_precise_coord
 from .logger import get_logger
 from .cep_scrapers import scrape_qualocep
+from .cep_record import RegistoCep
+from .metrics import medir_fonte, SUCESSO, FALHA, SEM_RESULTADO
 
 logger = get_logger(__name__)
 HEADERS = {'User-Agent': 'Roterizador/1.0 (Projeto Pessoal; automacao)'}
+# Devolvido por consultar_cep quando todas as fontes responderam que não têm o CEP.
+# None, pelo contrário, também cobre falhas de rede e fontes bloqueadas ou suspensas.
+CEP_INEXISTENTE = "cep_inexistente"
+# Respostas HTTP das APIs que querem dizer "este CEP não existe" (as outras são falhas).
+# Um 200 só conta como "não existe" se o corpo o disser (ver _cep_desconhecido): um 200 com
+# o endereço incompleto é de um CEP que existe, e fica como FALHA para voltar a ser consultado.
+ESTADOS_SEM_RESULTADO = (400, 404)
 
-def _try_awesomeapi(cep_limpo):
-    """Tenta obter coordenadas da AwesomeAPI."""
-    try:
-        url = f"https://cep.awesomeapi.com.br/json/{cep_limpo}"
-        res = requests.get(url, headers=HEADERS, timeout=5)
-        if res.status_code == 200:
-            data = res.json()
-            lat, lon = data.get('lat'), data.get('lng')
-            bairro = data.get('district')
-            
-            # --- CORREÇÃO AQUI: Procura por vários nomes de rua ---
-            rua = data.get('address') or data.get('address_name') or data.get('logradouro') or 'N/A'
+def _cep_desconhecido(data):
+    """Indica se o corpo de um 200 diz explicitamente que a API não tem o CEP."""
+    if not isinstance(data, dict):
+        return False
+    return bool(data.get('erro')) or data.get('code') in ('not_found', 'invalid')
 
-            if lat and lon and bairro:
-                logger.info(f"Sucesso com a API AwesomeAPI para {cep_limpo}")
-                return (float(lat), float(lon), bairro, rua)
-    except requests.RequestException as e:
-        logger.warning(f"AwesomeAPI falhou para {cep_limpo}: {e}")
+def _guardar_endereco(endereco, rua, bairro, cidade, estado):
+    """Guarda o endereço de uma API que respondeu sem coordenadas, para a geocodificação no fim da cascata."""
+    if endereco is not None and cidade and not endereco.get('localidade'):
+        endereco.update({'logradouro': rua if rua != 'N/A' else None, 'bairro': bairro, 'localidade': cidade, 'estado': estado})
+
+def _try_awesomeapi(cep_limpo, endereco=None, respostas=None):
+    """Tenta obter coordenadas da AwesomeAPI. Sem resultado, junta SEM_RESULTADO ou FALHA a 'respostas'."""
+    with medir_fonte("awesomeapi") as chamada:
+        try:
+            url = f"https://cep.awesomeapi.com.br/json/{cep_limpo}"
+            res = requests.get(url, headers=HEADERS, timeout=5)
+            if res.status_code == 200:
+                data = res.json()
+                if _cep_desconhecido(data):
+                    chamada.resultado = SEM_RESULTADO
+                    return None
+                lat, lon = data.get('lat'), data.get('lng')
+                bairro = data.get('district')
+                
+                # --- CORREÇÃO AQUI: Procura por vários nomes de rua ---
+                rua = data.get('address') or data.get('address_name') or data.get('logradouro') or 'N/A'
+
+                if lat and lon and bairro:
+                    logger.info(f"Sucesso com a API AwesomeAPI para {cep_limpo}")
+                    return RegistoCep(cep_limpo, lat, lon, bairro, rua)
+                # Endereço sem coordenadas ou sem bairro: o CEP existe, e o endereço segue para a geocodificação
+                _guardar_endereco(endereco, rua, bairro, data.get('city'), data.get('state'))
+                chamada.resultado = FALHA
+            else:
+                chamada.resultado = SEM_RESULTADO if res.status_code in ESTADOS_SEM_RESULTADO else FALHA
+        except (requests.RequestException, ValueError) as e:
+            chamada.resultado = FALHA
+            logger.warning(f"AwesomeAPI falhou para {cep_limpo}: {e}")
+        finally:
+            if respostas is not None and chamada.resultado != SUCESSO:
+                respostas.append(chamada.resultado)
     return None
 
-def _try_brasilapi(cep_limpo):
-    """Tenta obter coordenadas da BrasilAPI."""
-    try:
-        url = f"https://brasilapi.com.br/api/cep/v2/{cep_limpo}"
-        res = requests.get(url, headers=HEADERS, timeout=5)
-        if res.status_code == 200:
-            data = res.json()
-            if data.get('location') and data.get('location').get('coordinates'):
-                coords = data['location']['coordinates']
-                if coords.get('latitude') and coords.get('longitude'):
-                    lat, lon = coords.get('latitude'), coords.get('longitude')
-                    bairro = data.get('neighborhood') or data.get('bairro')
+def _try_brasilapi(cep_limpo, endereco=None, respostas=None):
+    """Tenta obter coordenadas da BrasilAPI. Sem resultado, junta SEM_RESULTADO ou FALHA a 'respostas'."""
+    with medir_fonte("brasilapi") as chamada:
+        try:
+            url = f"https://brasilapi.com.br/api/cep/v2/{cep_limpo}"
+            res = requests.get(url, headers=HEADERS, timeout=5)
+            if res.status_code == 200:
+                data = res.json()
+                if _cep_desconhecido(data):
+                    chamada.resultado = SEM_RESULTADO
+                    return None
+                bairro = data.get('neighborhood') or data.get('bairro')
 
-                    # --- CORREÇÃO AQUI: Procura por vários nomes de rua ---
-                    rua = data.get('street') or data.get('logradouro') or 'N/A'
+                # --- CORREÇÃO AQUI: Procura por vários nomes de rua ---
+                rua = data.get('street') or data.get('logradouro') or 'N/A'
 
-                    if lat and lon and bairro:
-                        logger.info(f"Sucesso com a API BrasilAPI para {cep_limpo}")
-                        return (float(lat), float(lon), bairro, rua)
-    except requests.RequestException as e:
-        logger.warning(f"BrasilAPI falhou para {cep_limpo}: {e}")
+                if data.get('location') and data.get('location').get('coordinates'):
+                    coords = data['location']['coordinates']
+                    if coords.get('latitude') and coords.get('longitude'):
+                        lat, lon = coords.get('latitude'), coords.get('longitude')
+                        if lat and lon and bairro:
+                            logger.info(f"Sucesso com a API BrasilAPI para {cep_limpo}")
+                            return RegistoCep(cep_limpo, lat, lon, bairro, rua)
+                _guardar_endereco(endereco, rua, bairro, data.get('city'), data.get('state'))
+                chamada.resultado = FALHA
+            else:
+                chamada.resultado = SEM_RESULTADO if res.status_code in ESTADOS_SEM_RESULTADO else FALHA
+        except (requests.RequestException, ValueError) as e:
+            chamada.resultado = FALHA
+            logger.warning(f"BrasilAPI falhou para {cep_limpo}: {e}")
+        finally:
+            if respostas is not None and chamada.resultado != SUCESSO:
+                respostas.append(chamada.resultado)
     return None
 
-def get_info_from_cep(cep):
+def consultar_cep(cep):
     """
     Busca informações do CEP usando uma cascata de fontes.
-    Todas as fontes agora retornam (lat, lon, bairro, rua).
+    Devolve um RegistoCep; CEP_INEXISTENTE se todas as fontes responderam sem o CEP;
+    ou None se alguma falhou (rede, bloqueio) e o CEP pode existir.
     """
     cep_limpo = str(cep).replace('-', '').strip()
     if not cep_limpo or len(cep_limpo) != 8 or not cep_limpo.isdigit():
-        return None, None, None, None
+        return CEP_INEXISTENTE
 
-    # 1. Tenta o Web Scraping (que já retorna 4 valores)
-    resultado = scrape_qualocep(cep_limpo)
+    respostas = []
+    # 1. Tenta o Web Scraping
+    resultado = scrape_qualocep(cep_limpo, respostas)
     if resultado:
         return resultado
         
     # 2. Se falhar, tenta a AwesomeAPI
-    resultado = _try_awesomeapi(cep_limpo)
+    endereco = {}
+    resultado = _try_awesomeapi(cep_limpo, endereco, respostas)
     if resultado:
         return resultado
 
     # 3. Se falhar, tenta a BrasilAPI
-    resultado = _try_brasilapi(cep_limpo)
+    resultado = _try_brasilapi(cep_limpo, endereco, respostas)
     if resultado:
         return resultado
-    
+
+    # 4. Se alguma API conhecia o endereço mas não as coordenadas, geocodifica-o
+    #    (índice offline primeiro, Nominatim só se ele não tiver resposta)
+    if endereco.get('bairro'):
+        lat, lon = get_precise_coord(cep_limpo, endereco)
+        if lat and lon:
+            logger.info(f"Sucesso com a geocodificação do endereço para {cep_limpo}")
+            return RegistoCep(cep_limpo, lat, lon, endereco['bairro'], endereco['logradouro'] or 'N/A')
+        # O CEP existe: a geocodificação pode ter falhado só desta vez
+        respostas.append(FALHA)
+
     logger.error(f"Falha completa em todas as fontes para o CEP {cep_limpo}.")
-    return None, None, None, None
\ No newline at end of file
+    return CEP_INEXISTENTE if all(r == SEM_RESULTADO for r in respostas) else None
+
+def get_info_from_cep(cep):
+    """
+    Busca informações do CEP usando uma cascata de fontes.
+    Todas as fontes retornam um RegistoCep; se nenhuma encontrar o CEP, retorna None.
+    """
+    resultado = consultar_cep(cep)
+    return resultado if isinstance(resultado, RegistoCep) else None
@@ -4,21 +4,23 @@ import requests
 from bs4 import BeautifulSoup
 import time
 import os
-import json
 from concurrent.futures import ThreadPoolExecutor
 from .logger import get_logger
+from . import cache_manager
+from .http_cache import criar_sessao_com_cache, resumo_estatisticas
+from .metrics import cronometrar
 
 logger = get_logger(__name__)
 BASE_URL = "https://codigo-postal.org"
 HEADERS = {'User-Agent': 'Roterizador/2.0 (Projeto Pessoal; automacao)'}
 
-SESSAO = requests.Session()
-SESSAO.headers.update(HEADERS)
+# As páginas passam por um cache condicional: re-raspar uma cidade custa sobretudo respostas 304
+SESSAO = criar_sessao_com_cache(HEADERS, BASE_URL, pool_maxsize=10)
 
-# --- NOVA CONFIGURAÇÃO DE CACHE ---
+# --- CONFIGURAÇÃO DE CACHE ---
+# As listas vivem no namespace 'cidades' do gestor de cache; CACHE_DIR só serve para migrar os ficheiros antigos
 CACHE_DIR = "cache"
-if not os.path.exists(CACHE_DIR):
-    os.makedirs(CACHE_DIR)
+NAMESPACE_CACHE = "cidades"
 
 def _get_page_soup(url):
     """Busca e 'parseia' o HTML de uma URL usando uma sessão."""
@@ -27,7 +29,8 @@ def _get_page_soup(url):
             url = BASE_URL + url
         response = SESSAO.get(url, timeout=20)
         response.raise_for_status()
-        return BeautifulSoup(response.text, 'lxml')
+        with cronometrar("parse_html"):
+            return BeautifulSoup(response.text, 'lxml')
     except requests.RequestException as e:
         logger.error(f"Falha ao aceder a URL {url}: {e}")
         return None
@@ -55,6 +58,7 @@ def _get_neighborhood_links(city_soup):
     logger.info(f"Encontrados {len(links_bairros)} links de bairros.")
     return links_bairros
 
+@cronometrar("extracao_ceps_html")
 def _extract_ceps_from_page(neighborhood_soup):
     """Extrai os CEPs de uma página."""
     if not neighborhood_soup: return set()
@@ -95,11 +99,12 @@ def get_ceps_from_city(estado, cidade):
     3. Salva o resultado no cache para uso futuro.
     """
     # Lógica de Cache (Leitura)
-    cache_filename = os.path.join(CACHE_DIR, f"{estado.lower()}-{cidade.lower()}.json")
-    if os.path.exists(cache_filename):
-        logger.info(f"✅ Cache encontrado para '{cidade}/{estado}'. A carregar do ficheiro.")
-        with open(cache_filename, 'r') as f:
-            return json.load(f)
+    chave_cache = cache_manager.chave_cidade(estado, cidade)
+    cache_antigo = os.path.join(CACHE_DIR, f"{chave_cache}.json")
+    lista_em_cache = cache_manager.ler(NAMESPACE_CACHE, chave_cache, legado=cache_antigo)
+    if lista_em_cache is not None:
+        logger.info(f"✅ Cache encontrado para '{cidade}/{estado}'. A carregar do cache.")
+        return lista_em_cache
 
     logger.info(f"🚀 Cache não encontrado. Iniciando busca online para '{cidade}/{estado}'.")
 
@@ -134,11 +139,11 @@ def get_ceps_from_city(estado, cidade):
         return None
 
     logger.info(f"Extração online concluída! Encontrados {len(todos_os_ceps)} CEPs únicos para {cidade}.")
+    logger.info(f"Páginas HTTP (acumulado): {resumo_estatisticas()}")
     
     # Lógica de Cache (Escrita)
     lista_final_ceps = list(todos_os_ceps)
-    with open(cache_filename, 'w') as f:
-        json.dump(lista_final_ceps, f)
-    logger.info(f"💾 Resultado para '{cidade}/{estado}' salvo no cache: {cache_filename}")
+    cache_manager.gravar(NAMESPACE_CACHE, chave_cache, lista_final_ceps)
+    logger.info(f"💾 Resultado para '{cidade}/{estado}' salvo no cache: {NAMESPACE_CACHE}/{chave_cache}")
 
     return lista_final_ceps
\ No newline at end of file
@@ -1,153 +1,272 @@
 # logic/distance_calc.py
-# AJUSTE: Criadas novas funções que usam 'logger' para o progresso e 'return' para o resultado final,
-# removendo a necessidade do 'yield' para a automação.
+# Cálculo de distâncias por raiz de CEP, partilhado pela aplicação web (SSE) e pela automação.
+# Um único motor em geradores produz eventos: primeiro resultados provisórios com o que já está
+# no cache da raiz, depois atualizações à medida que as consultas online chegam, e por fim o
+# resultado final de cada bairro. As funções '_calcular_por_*' enviam os eventos em SSE;
+# as '*_automacao' registam-nos no logger e devolvem a lista final.
 
 import json
 import statistics
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from .utils import haversine
-from .cep_service import get_info_from_cep
+from .cep_service import consultar_cep, CEP_INEXISTENTE
+from .cep_processing import ler_ceps_da_raiz, registar_ceps_da_raiz
 from .logger import get_logger
+from .metrics import cronometrar, contar
 
 logger = get_logger(__name__)
 
-# SUAS FUNÇÕES ORIGINAIS PARA A APLICAÇÃO WEB (NÃO MEXEMOS NELAS)
-def _calcular_por_varredura_detalhada(lat_partida, lon_partida, raiz_str):
-    """
-    Sua função original para o Flask app. Usa 'yield' para streaming.
-    """
-    yield f"data: {json.dumps({'tipo':'log','msg':f'Iniciando varredura de alta precisão para a raiz {raiz_str}...'})}\n\n"
-    # ... (lógica original omitida para clareza) ...
-    return [] # O return em geradores é complexo, tratado no app.py
+# De quantas em quantas consultas online são enviados o progresso e os resultados provisórios
+PASSO_PROGRESSO_VARREDURA = 50
+PASSO_PROGRESSO_CENTROIDE = 2
+BAIRRO_SEM_NOME = 'Bairro não identificado'
 
-def _calcular_por_centroide_rapido(lat_partida, lon_partida, raiz_str):
-    """
-    Sua função original para o Flask app. Usa 'yield' para streaming.
-    """
-    yield f"data: {json.dumps({'tipo':'log', 'msg':f'Iniciando consulta rápida para a raiz {raiz_str}...'})}\n\n"
-    # ... (lógica original omitida para clareza) ...
-    return []
+# --- EVENTOS ---
 
+def _log(msg):
+    return {'tipo': 'log', 'msg': msg}
 
-# --- NOVAS FUNÇÕES PARA A AUTOMAÇÃO ---
+def _progresso(msg, feitos, total):
+    return {'tipo': 'progresso', 'msg': msg, 'feitos': feitos, 'total': total}
 
-def calcular_varredura_automacao(lat_partida, lon_partida, raiz_str):
+def _resultado(linha, final):
+    return {'tipo': 'resultado', 'final': final, 'linha': linha}
+
+def _nome_bairro(registo):
+    return registo.bairro.strip() if registo.bairro else BAIRRO_SEM_NOME
+
+# --- CONSULTAS COM CACHE ---
+
+def _consultar_amostra(raiz_str, ceps_amostra, max_workers, passo, descricao):
     """
-    Versão da sua lógica de busca detalhada, adaptada para automação.
-    Usa logger para progresso e 'return' para o resultado.
+    Gerador que resolve os CEPs da amostra: os conhecidos vêm do cache da raiz, os que já
+    se sabe não existirem são saltados, e só os restantes vão às fontes online.
+    Produz ('cache', [RegistoCep], n_a_consultar) uma vez, depois ('progresso', evento, [novos RegistoCep],
+    n_em_falta) a cada 'passo' consultas, e devolve a lista de todos os registos encontrados.
     """
-    logger.info(f'Iniciando varredura de alta precisão para a raiz {raiz_str}...')
-    
-    ceps_para_consultar = [f"{raiz_str}{d+i:03d}" for d in range(0, 1000, 10) for i in [0, 1, 4, 7]]
-    total_ceps = len(ceps_para_consultar)
-    resultados_brutos = []
-    
-    with ThreadPoolExecutor(max_workers=20) as executor:
-        f_to_cep = {executor.submit(get_info_from_cep, c): c for c in ceps_para_consultar}
-        
+    conhecidos, ausentes = ler_ceps_da_raiz(raiz_str)
+    encontrados = [conhecidos[c] for c in ceps_amostra if c in conhecidos]
+    a_consultar = [c for c in ceps_amostra if c not in conhecidos and c not in ausentes]
+    contar("raiz_ceps_em_cache", len(ceps_amostra) - len(a_consultar))
+    contar("raiz_ceps_consultados", len(a_consultar))
+    yield 'cache', list(encontrados), len(a_consultar)
+
+    if not a_consultar:
+        return encontrados
+
+    novos, novos_ausentes, pendentes = [], [], []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        f_to_cep = {executor.submit(consultar_cep, c): c for c in a_consultar}
         for i, future in enumerate(as_completed(f_to_cep)):
             cep_c = f_to_cep[future]
-            res_c = future.result()
-            
-            if res_c and res_c[0] is not None:
-                lat, lon, bairro = res_c
-                dist = round(haversine(lat_partida, lon_partida, lat, lon), 2)
-                resultados_brutos.append({'cep': cep_c, 'bairro': bairro, 'distancia': dist, 'lat': lat, 'lon': lon})
-            
-            if (i+1) % 50 == 0:
-                # Substituímos o 'yield' por um log de progresso
-                logger.info(f'Verificados {i+1}/{total_ceps} CEPs para a raiz {raiz_str}...')
-    
-    resultados_finais = []
-    if resultados_brutos:
-        bairros_temp = {}
-        for res in resultados_brutos:
-            bairro = res['bairro'].strip() if res.get('bairro') else 'Bairro não identificado'
-            if bairro not in bairros_temp:
-                bairros_temp[bairro] = []
-            bairros_temp[bairro].append(res)
-        
-        for bairro, pontos in bairros_temp.items():
-            if not pontos: continue
-
-            # Sua lógica de "Ponto Mais Central" permanece idêntica
+            try:
+                registo = future.result()
+            except Exception as e:
+                logger.error(f"Erro no CEP {cep_c} da raiz {raiz_str}: {e}")
+                registo = None
+            # Só fica marcado como ausente o que todas as fontes negaram; uma falha (None) volta a ser consultada
+            if registo is CEP_INEXISTENTE:
+                novos_ausentes.append(cep_c)
+            elif registo is not None:
+                novos.append(registo)
+                pendentes.append(registo)
+            if (i + 1) % passo == 0 or i + 1 == len(a_consultar):
+                evento = _progresso(f'{descricao} {i + 1}/{len(a_consultar)} para a raiz {raiz_str}...', i + 1, len(a_consultar))
+                yield 'progresso', evento, pendentes, len(a_consultar) - (i + 1)
+                pendentes = []
+
+    registar_ceps_da_raiz(raiz_str, novos, novos_ausentes)
+    return encontrados + novos
+
+# --- VARREDURA DETALHADA ("PONTO MAIS CENTRAL" POR BAIRRO) ---
+
+def _linha_do_bairro(lat_partida, lon_partida, raiz_str, bairro, pontos):
+    # Sua lógica de "Ponto Mais Central" permanece idêntica
+    pontos_confiaveis = pontos
+    if len(pontos) > 2:
+        lat_centro_preliminar = statistics.mean(p.latitude for p in pontos)
+        lon_centro_preliminar = statistics.mean(p.longitude for p in pontos)
+        pontos_confiaveis = [p for p in pontos if haversine(p.latitude, p.longitude, lat_centro_preliminar, lon_centro_preliminar) < 3]
+        if not pontos_confiaveis:
             pontos_confiaveis = pontos
-            if len(pontos) > 2:
-                lat_centro_preliminar = statistics.mean(p['lat'] for p in pontos)
-                lon_centro_preliminar = statistics.mean(p['lon'] for p in pontos)
-                pontos_confiaveis = [p for p in pontos if haversine(p['lat'], p['lon'], lat_centro_preliminar, lon_centro_preliminar) < 3]
-                if not pontos_confiaveis:
-                    pontos_confiaveis = pontos
-
-            if not pontos_confiaveis: continue
-
-            lat_centro_bairro = statistics.mean(p['lat'] for p in pontos_confiaveis)
-            lon_centro_bairro = statistics.mean(p['lon'] for p in pontos_confiaveis)
-            ponto_referencia = min(pontos_confiaveis, key=lambda p: haversine(p['lat'], p['lon'], lat_centro_bairro, lon_centro_bairro))
-            distancia_final = round(haversine(lat_partida, lon_partida, ponto_referencia['lat'], ponto_referencia['lon']), 2)
-
-            resultados_finais.append({
-                'tipo_linha': 'bairro', 'raiz': raiz_str, 'bairro': bairro,
-                'distancia': distancia_final, 'tempo': round(distancia_final * 2, 1),
-                'ceps_consultados': len(pontos_confiaveis), 'lat': ponto_referencia['lat'],
-                'lon': ponto_referencia['lon'], 'cep_referencia': ponto_referencia['cep']
-            })
-
-        if resultados_finais:
-            media_geral = round(statistics.mean(r['distancia'] for r in resultados_brutos), 2)
-            resultados_finais.insert(0, {
-                'tipo_linha': 'resumo_raiz', 'raiz': raiz_str, 'bairro': 'MÉDIA GERAL DA RAIZ',
-                'distancia': media_geral, 'tempo': round(media_geral * 2, 1),
-                'ceps_consultados': len(resultados_brutos), 'lat': None, 'lon': None, 'cep_referencia': None
-            })
-    
-    if not resultados_finais:
+
+    lat_centro_bairro = statistics.mean(p.latitude for p in pontos_confiaveis)
+    lon_centro_bairro = statistics.mean(p.longitude for p in pontos_confiaveis)
+    ponto_referencia = min(pontos_confiaveis, key=lambda p: haversine(p.latitude, p.longitude, lat_centro_bairro, lon_centro_bairro))
+    distancia_final = round(haversine(lat_partida, lon_partida, ponto_referencia.latitude, ponto_referencia.longitude), 2)
+
+    return {
+        'tipo_linha': 'bairro', 'raiz': raiz_str, 'bairro': bairro,
+        'distancia': distancia_final, 'tempo': round(distancia_final * 2, 1),
+        'ceps_consultados': len(pontos_confiaveis), 'lat': ponto_referencia.latitude,
+        'lon': ponto_referencia.longitude, 'cep_referencia': ponto_referencia.cep
+    }
+
+def _agrupar_por_bairro(registos):
+    # Por ordem de CEP, para o resultado não depender da ordem de chegada (nem de vir do cache)
+    bairros = {}
+    for registo in sorted(registos, key=lambda r: r.cep):
+        bairros.setdefault(_nome_bairro(registo), []).append(registo)
+    return bairros
+
+def _resultados_varredura(lat_partida, lon_partida, raiz_str, registos):
+    resultados_finais = [
+        _linha_do_bairro(lat_partida, lon_partida, raiz_str, bairro, pontos)
+        for bairro, pontos in _agrupar_por_bairro(registos).items()
+    ]
+    if resultados_finais:
+        media_geral = round(statistics.mean(
+            round(haversine(lat_partida, lon_partida, r.latitude, r.longitude), 2) for r in registos
+        ), 2)
+        resultados_finais.insert(0, {
+            'tipo_linha': 'resumo_raiz', 'raiz': raiz_str, 'bairro': 'MÉDIA GERAL DA RAIZ',
+            'distancia': media_geral, 'tempo': round(media_geral * 2, 1),
+            'ceps_consultados': len(registos), 'lat': None, 'lon': None, 'cep_referencia': None
+        })
+    else:
         resultados_finais.append({
             'tipo_linha': 'erro_raiz', 'raiz': raiz_str, 'bairro': 'NENHUM CEP VÁLIDO ENCONTRADO',
             'distancia': '-', 'tempo': '-', 'ceps_consultados': 0,
             'lat': None, 'lon': None, 'cep_referencia': None
         })
-    
-    # Usamos 'return' para devolver a lista final de resultados
+
     return sorted(resultados_finais, key=lambda x: (
         x['tipo_linha'] != 'resumo_raiz',
         x.get('distancia', 9999) if isinstance(x.get('distancia'), (int, float)) else 9999
     ))
 
-def calcular_centroide_automacao(lat_partida, lon_partida, raiz_str):
+def _eventos_varredura(lat_partida, lon_partida, raiz_str):
     """
-    Versão da sua lógica de cálculo rápido, adaptada para automação.
+    Motor da varredura de alta precisão. Um bairro só é final quando todos os CEPs da amostra
+    estão resolvidos (qualquer CEP em falta pode pertencer-lhe); até lá, cada bairro com
+    pontos novos é reenviado como provisório. Devolve a lista final de resultados.
     """
-    logger.info(f'Iniciando consulta rápida para a raiz {raiz_str}...')
-    
-    ceps_para_amostra = [f"{raiz_str}{i:03d}" for i in range(0, 1000, 100)]
-    coordenadas = []
-    
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        for i, resultado in enumerate(executor.map(get_info_from_cep, ceps_para_amostra)):
-            if resultado and resultado[0] is not None:
-                coordenadas.append((resultado[0], resultado[1]))
-            if (i+1) % 2 == 0:
-                logger.info(f'Processadas {i+1}/{len(ceps_para_amostra)} amostras para a raiz {raiz_str}...')
-    
-    if coordenadas:
-        lat_media = statistics.mean(c[0] for c in coordenadas)
-        lon_media = statistics.mean(c[1] for c in coordenadas)
-        distancia = round(haversine(lat_partida, lon_partida, lat_media, lon_media), 2)
-        descricao_bairro = f"Centro da Raiz {raiz_str} ({len(coordenadas)} amostras)"
-        
-        resultado_final = [{
-            'tipo_linha': 'bairro', 'raiz': raiz_str, 'bairro': descricao_bairro,
-            'distancia': distancia, 'tempo': round(distancia * 2, 1), 
-            'ceps_consultados': len(coordenadas), 'lat': lat_media, 'lon': lon_media, 
-            'cep_referencia': 'N/A'
-        }]
-    else:
-        resultado_final = [{
+    yield _log(f'Iniciando varredura de alta precisão para a raiz {raiz_str}...')
+    ceps_para_consultar = [f"{raiz_str}{d+i:03d}" for d in range(0, 1000, 10) for i in [0, 1, 4, 7]]
+
+    consultas = _consultar_amostra(raiz_str, ceps_para_consultar, 20, PASSO_PROGRESSO_VARREDURA, 'Verificados')
+    encontrados = []
+    while True:
+        try:
+            passo = next(consultas)
+        except StopIteration as fim:
+            encontrados = fim.value
+            break
+        if passo[0] == 'cache':
+            _, encontrados, em_falta = passo
+            yield _log(f'{len(encontrados)} CEPs da raiz {raiz_str} encontrados no cache, {em_falta} a consultar.')
+            alterados = encontrados
+        else:
+            _, evento, alterados, em_falta = passo
+            yield evento
+            encontrados.extend(alterados)
+        # Provisórios só para os bairros que mudaram, e só enquanto faltar algo (senão segue-se o final)
+        if alterados and em_falta:
+            por_bairro = _agrupar_por_bairro(encontrados)
+            for bairro in sorted({_nome_bairro(r) for r in alterados}):
+                yield _resultado(_linha_do_bairro(lat_partida, lon_partida, raiz_str, bairro, por_bairro[bairro]), final=False)
+
+    resultados = _resultados_varredura(lat_partida, lon_partida, raiz_str, encontrados)
+    for linha in resultados:
+        yield _resultado(linha, final=True)
+    return resultados
+
+# --- CONSULTA RÁPIDA (CENTRO DA RAIZ) ---
+
+def _linha_centroide(lat_partida, lon_partida, raiz_str, registos):
+    if not registos:
+        return {
             'tipo_linha': 'erro_raiz', 'raiz': raiz_str, 'bairro': 'NENHUMA AMOSTRA ENCONTRADA',
             'distancia': '-', 'tempo': '-', 'ceps_consultados': 0,
             'lat': None, 'lon': None, 'cep_referencia': None
-        }]
-    
-    # Usamos 'return' para devolver a lista final de resultados
-    return resultado_final
\ No newline at end of file
+        }
+    lat_media = statistics.mean(r.latitude for r in registos)
+    lon_media = statistics.mean(r.longitude for r in registos)
+    distancia = round(haversine(lat_partida, lon_partida, lat_media, lon_media), 2)
+    return {
+        'tipo_linha': 'bairro', 'raiz': raiz_str, 'bairro': f"Centro da Raiz {raiz_str} ({len(registos)} amostras)",
+        'distancia': distancia, 'tempo': round(distancia * 2, 1),
+        'ceps_consultados': len(registos), 'lat': lat_media, 'lon': lon_media,
+        'cep_referencia': 'N/A'
+    }
+
+def _eventos_centroide(lat_partida, lon_partida, raiz_str):
+    """Motor da consulta rápida: o centro provisório sai logo com as amostras do cache."""
+    yield _log(f'Iniciando consulta rápida para a raiz {raiz_str}...')
+    ceps_para_amostra = [f"{raiz_str}{i:03d}" for i in range(0, 1000, 100)]
+
+    consultas = _consultar_amostra(raiz_str, ceps_para_amostra, 10, PASSO_PROGRESSO_CENTROIDE, 'Processadas')
+    encontrados = []
+    while True:
+        try:
+            passo = next(consultas)
+        except StopIteration as fim:
+            encontrados = fim.value
+            break
+        if passo[0] == 'cache':
+            _, encontrados, em_falta = passo
+        else:
+            _, evento, novos, em_falta = passo
+            yield evento
+            encontrados.extend(novos)
+        if encontrados and em_falta:
+            yield _resultado(_linha_centroide(lat_partida, lon_partida, raiz_str, encontrados), final=False)
+
+    resultado_final = [_linha_centroide(lat_partida, lon_partida, raiz_str, encontrados)]
+    yield _resultado(resultado_final[0], final=True)
+    return resultado_final
+
+# --- ADAPTADORES ---
+
+def _em_sse(eventos):
+    """Envia cada evento do motor no formato Server-Sent Events e devolve o resultado do motor."""
+    while True:
+        try:
+            evento = next(eventos)
+        except StopIteration as fim:
+            yield f"data: {json.dumps({'tipo': 'fim', 'resultados': fim.value})}\n\n"
+            return fim.value
+        yield f"data: {json.dumps(evento)}\n\n"
+
+def _consumir(eventos):
+    """Corre o motor até ao fim, com os logs e o progresso no logger, e devolve a lista final."""
+    while True:
+        try:
+            evento = next(eventos)
+        except StopIteration as fim:
+            return fim.value
+        if evento['tipo'] in ('log', 'progresso'):
+            logger.info(evento['msg'])
+
+# FUNÇÕES PARA A APLICAÇÃO WEB (streaming via SSE)
+def _calcular_por_varredura_detalhada(lat_partida, lon_partida, raiz_str):
+    """
+    Varredura de alta precisão em streaming: cada linha de bairro é enviada assim que existe
+    (provisória, 'final': false) e de novo quando é final. O último evento traz a lista final.
+    """
+    return (yield from _em_sse(_eventos_varredura(lat_partida, lon_partida, raiz_str)))
+
+def _calcular_por_centroide_rapido(lat_partida, lon_partida, raiz_str):
+    """
+    Consulta rápida em streaming: o centro provisório sai com as amostras já em cache
+    e é atualizado à medida que as restantes chegam.
+    """
+    return (yield from _em_sse(_eventos_centroide(lat_partida, lon_partida, raiz_str)))
+
+
+# --- FUNÇÕES PARA A AUTOMAÇÃO ---
+
+@cronometrar("varredura_detalhada")
+def calcular_varredura_automacao(lat_partida, lon_partida, raiz_str):
+    """
+    Versão da sua lógica de busca detalhada, adaptada para automação.
+    Usa logger para progresso e 'return' para o resultado.
+    """
+    return _consumir(_eventos_varredura(lat_partida, lon_partida, raiz_str))
+
+@cronometrar("centroide_rapido")
+def calcular_centroide_automacao(lat_partida, lon_partida, raiz_str):
+    """
+    Versão da sua lógica de cálculo rápido, adaptada para automação.
+    """
+    return _consumir(_eventos_centroide(lat_partida, lon_partida, raiz_str))
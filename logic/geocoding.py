@@ -3,12 +3,22 @@
 import requests
 from urllib.parse import quote
 from logic.logger import get_logger
+from logic.offline_geocoder import geocodificar_offline
+from logic.boundary_validation import limites_disponiveis, validar_pontos, VALIDO
+from logic.cep_record import RegistoCep, LoteCeps
+from logic.metrics import medir_fonte, registar_cache, FALHA, SEM_RESULTADO
 
 logger = get_logger(__name__)
 
 HEADERS = {'User-Agent': 'CalculadoraDistancia/1.0 (Projeto Pessoal)'}
 
 def get_precise_coord(cep, endereco_info):
+    # Primeiro o índice local construído a partir do PBF: microssegundos e sem rede
+    coord = geocodificar_offline(cep, endereco_info)
+    registar_cache("geocodificador_offline", bool(coord))
+    if coord:
+        return float(coord[0]), float(coord[1])
+
     query_params = {
         'street': endereco_info.get('logradouro'),
         'city': endereco_info.get('localidade'),
@@ -19,36 +29,47 @@ def get_precise_coord(cep, endereco_info):
     query_string = "&".join(f"{key}={quote(str(value))}" for key, value in query_params.items() if value)
     url = f"https://nominatim.openstreetmap.org/search?{query_string}"
 
-    try:
-        res = requests.get(url, headers=HEADERS, timeout=15)
-        res.raise_for_status()
-        data = res.json()
-        if data and isinstance(data, list):
-            return float(data[0]['lat']), float(data[0]['lon'])
-    except Exception as e:
-        logger.warning(f"Nominatim falhou para {cep}: {e}")
+    with medir_fonte("nominatim_search") as chamada:
+        try:
+            res = requests.get(url, headers=HEADERS, timeout=15)
+            res.raise_for_status()
+            data = res.json()
+            if data and isinstance(data, list):
+                return float(data[0]['lat']), float(data[0]['lon'])
+            chamada.resultado = SEM_RESULTADO
+        except Exception as e:
+            chamada.resultado = FALHA
+            logger.warning(f"Nominatim falhou para {cep}: {e}")
 
     return None, None
 
-def reverse_geocode_and_validate(lat, lon, bairro_original, cidade_original):
+def reverse_geocode_and_validate(lat, lon, bairro_original, cidade_original, estado_original=None):
     if not all([lat, lon, bairro_original, cidade_original]):
         return False
 
+    # Se os limites da cidade já foram extraídos do PBF, a validação é feita offline
+    if limites_disponiveis(estado_original, cidade_original):
+        ponto = LoteCeps.de_registos([RegistoCep(0, lat, lon, bairro_original)])
+        resultado = validar_pontos(estado_original, cidade_original, ponto)
+        return resultado[0] == VALIDO
+
     url = f"https://nominatim.openstreetmap.org/reverse?lat={lat}&lon={lon}&format=jsonv2"
 
-    try:
-        res = requests.get(url, headers=HEADERS, timeout=10)
-        res.raise_for_status()
-        data = res.json()
+    with medir_fonte("nominatim_reverse") as chamada:
+        try:
+            res = requests.get(url, headers=HEADERS, timeout=10)
+            res.raise_for_status()
+            data = res.json()
 
-        addr = data.get('address', {})
-        bairro_reverso = addr.get('suburb') or addr.get('city_district')
-        cidade_reversa = addr.get('city') or addr.get('town') or addr.get('village')
+            addr = data.get('address', {})
+            bairro_reverso = addr.get('suburb') or addr.get('city_district')
+            cidade_reversa = addr.get('city') or addr.get('town') or addr.get('village')
 
-        if cidade_reversa and cidade_original in cidade_reversa:
-            if bairro_reverso and bairro_original in bairro_reverso:
-                return True
-    except Exception as e:
-        logger.warning(f"Reverse geocoding falhou para {lat},{lon}: {e}")
+            if cidade_reversa and cidade_original in cidade_reversa:
+                if bairro_reverso and bairro_original in bairro_reverso:
+                    return True
+        except Exception as e:
+            chamada.resultado = FALHA
+            logger.warning(f"Reverse geocoding falhou para {lat},{lon}: {e}")
 
     return False
\ No newline at end of file
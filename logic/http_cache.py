@@ -0,0 +1,113 @@
+# logic/http_cache.py
+# Cache de respostas HTTP montado por trás das sessões 'requests' dos scrapers.
+# Enquanto uma página está "fresca" é servida do cache sem nenhum pedido; depois disso é
+# revalidada com um pedido condicional (If-None-Match / If-Modified-Since), e um 304 custa
+# só os cabeçalhos. Os corpos ficam comprimidos no namespace 'http' do gestor de cache.
+
+import re
+import time
+import threading
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from .logger import get_logger
+from . import cache_manager
+from . import metrics
+
+logger = get_logger(__name__)
+
+NAMESPACE_CACHE = "http"
+DIA = 24 * 60 * 60
+
+# Frescura (segundos) por padrão de URL; vale o primeiro padrão que corresponder.
+# As listas de estados e de cidades quase nunca mudam; as páginas de bairros mudam um pouco mais.
+FRESCURA_POR_PADRAO = [
+    (re.compile(r"^https?://codigo-postal\.org/pt-br/brasil/?$"), 30 * DIA),        # Lista de estados
+    (re.compile(r"^https?://codigo-postal\.org/pt-br/brasil/[^/]+/?$"), 14 * DIA),  # Cidades de um estado
+    (re.compile(r"^https?://codigo-postal\.org/"), 7 * DIA),                        # Cidades e bairros
+]
+FRESCURA_PADRAO = 0  # Sem padrão: revalida sempre (mas continua a poupar o corpo com 304)
+
+# Cabeçalhos da resposta original que vale a pena guardar
+CABECALHOS_GUARDADOS = ('Content-Type', 'ETag', 'Last-Modified')
+
+ESTATISTICAS = {"frescos": 0, "revalidados": 0, "descarregados": 0}
+_trinco = threading.Lock()
+
+def _contar(campo):
+    with _trinco:
+        ESTATISTICAS[campo] += 1
+
+def _frescura(url):
+    for padrao, segundos in FRESCURA_POR_PADRAO:
+        if padrao.match(url):
+            return segundos
+    return FRESCURA_PADRAO
+
+def _resposta_do_cache(pedido, entrada):
+    """Constrói uma resposta 'requests' a partir de uma entrada do cache."""
+    resposta = requests.Response()
+    resposta.status_code = 200
+    resposta.reason = "OK"
+    resposta.url = pedido.url
+    resposta.request = pedido
+    resposta.headers = CaseInsensitiveDict(entrada['cabecalhos'])
+    resposta.encoding = 'utf-8'
+    resposta._content = entrada['corpo'].encode('utf-8')
+    resposta.from_cache = True
+    return resposta
+
+class AdaptadorCacheCondicional(HTTPAdapter):
+    """Adaptador de transporte que serve GETs do cache e revalida-os com pedidos condicionais."""
+
+    def send(self, request, **kwargs):
+        if request.method != 'GET':
+            return super().send(request, **kwargs)
+
+        entrada = cache_manager.ler(NAMESPACE_CACHE, request.url)
+        if entrada:
+            if time.time() - entrada['gravado_em'] < _frescura(request.url):
+                _contar("frescos")
+                return _resposta_do_cache(request, entrada)
+            etag = entrada['cabecalhos'].get('ETag')
+            ultima_modificacao = entrada['cabecalhos'].get('Last-Modified')
+            if etag:
+                request.headers['If-None-Match'] = etag
+            if ultima_modificacao:
+                request.headers['If-Modified-Since'] = ultima_modificacao
+
+        with metrics.medir_fonte(urlparse(request.url).hostname) as chamada:
+            resposta = super().send(request, **kwargs)
+            if resposta.status_code == 304:
+                chamada.resultado = "revalidado"
+            elif resposta.status_code != 200:
+                chamada.resultado = f"http_{resposta.status_code}"
+
+        if resposta.status_code == 304 and entrada:
+            resposta.close()
+            entrada['gravado_em'] = time.time()
+            cache_manager.gravar(NAMESPACE_CACHE, request.url, entrada)
+            _contar("revalidados")
+            logger.debug(f"304 para {request.url}: corpo servido do cache.")
+            return _resposta_do_cache(request, entrada)
+
+        if resposta.status_code == 200:
+            _contar("descarregados")
+            cache_manager.gravar(NAMESPACE_CACHE, request.url, {
+                "corpo": resposta.text,
+                "cabecalhos": {c: resposta.headers[c] for c in CABECALHOS_GUARDADOS if c in resposta.headers},
+                "gravado_em": time.time(),
+            })
+        return resposta
+
+def criar_sessao_com_cache(headers, base_url, pool_maxsize=10):
+    """Cria uma sessão 'requests' cujos GETs para 'base_url' passam pelo cache condicional."""
+    sessao = requests.Session()
+    sessao.headers.update(headers)
+    sessao.mount(base_url, AdaptadorCacheCondicional(pool_connections=1, pool_maxsize=pool_maxsize))
+    return sessao
+
+def resumo_estatisticas():
+    with _trinco:
+        return dict(ESTATISTICAS)
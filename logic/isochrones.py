@@ -0,0 +1,204 @@
+# logic/isochrones.py
+# Isócronas sobre o grafo de ruas usado pelo 'calcular_distancias_reais.py'.
+# Para cada CEP de partida corre-se uma única travessia (Dijkstra limitado à maior faixa),
+# que dá ao mesmo tempo a distância de condução e o tempo estimado pelas velocidades das vias.
+# O resultado já traz a pertença às faixas para todos os CEPs, bairros e raízes da cidade,
+# e fica guardado no cache por (versão do grafo, origem): perguntas repetidas custam uma leitura.
+
+import os
+import re
+import heapq
+import hashlib
+import statistics
+from collections import defaultdict
+from .logger import get_logger
+from . import cache_manager
+
+logger = get_logger(__name__)
+
+ARQUIVO_GRAFO = "brazil_drive_graph.graphml"
+NAMESPACE_CACHE = "isocronas"
+FAIXAS_KM = (5, 10, 15)
+# Um CEP só é ligado ao grafo se o nó mais próximo estiver a esta distância (em linha reta)
+DISTANCIA_MAX_SNAP_KM = 0.3
+
+# Velocidades usadas quando a via não tem 'maxspeed' no OSM
+VELOCIDADES_PADRAO_KMH = {
+    'motorway': 100, 'motorway_link': 60, 'trunk': 80, 'trunk_link': 50,
+    'primary': 60, 'primary_link': 40, 'secondary': 50, 'secondary_link': 40,
+    'tertiary': 40, 'tertiary_link': 30, 'unclassified': 30, 'residential': 30,
+    'living_street': 15, 'service': 20, 'road': 30,
+}
+VELOCIDADE_PADRAO_KMH = 30
+
+_isocronas_em_memoria = {}
+_grafo = None
+
+def versao_grafo(caminho=ARQUIVO_GRAFO):
+    """
+    Identifica a versão do grafo pelo tamanho e data do ficheiro (barato, sem o ler).
+    Devolve None se o ficheiro não existir.
+    """
+    try:
+        info = os.stat(caminho)
+    except FileNotFoundError:
+        return None
+    return hashlib.sha1(f"{info.st_size}-{int(info.st_mtime)}".encode()).hexdigest()[:12]
+
+def _carregar_grafo():
+    global _grafo
+    if _grafo is None:
+        import osmnx as ox
+        logger.info(f"Carregando o grafo de ruas '{ARQUIVO_GRAFO}'... Este passo pode ser demorado.")
+        _grafo = ox.load_graphml(ARQUIVO_GRAFO)
+    return _grafo
+
+def _primeiro(valor):
+    """Atributos do osmnx podem vir como lista (vias fundidas) ou como texto de uma lista."""
+    if isinstance(valor, list):
+        return valor[0] if valor else None
+    if isinstance(valor, str) and valor.startswith('['):
+        itens = re.findall(r"'([^']*)'", valor)
+        return itens[0] if itens else None
+    return valor
+
+def _velocidade_kmh(dados_aresta):
+    maxspeed = _primeiro(dados_aresta.get('maxspeed'))
+    if maxspeed:
+        numero = re.match(r"\s*(\d+(?:\.\d+)?)", str(maxspeed))
+        if numero:
+            velocidade = float(numero.group(1))
+            if 'mph' in str(maxspeed):
+                velocidade *= 1.609
+            if velocidade > 0:
+                return velocidade
+    return VELOCIDADES_PADRAO_KMH.get(_primeiro(dados_aresta.get('highway')), VELOCIDADE_PADRAO_KMH)
+
+def _dijkstra_limitado(G, origem, limite_m):
+    """
+    Distâncias mínimas (em metros) a partir de 'origem' até 'limite_m', e o tempo (em segundos)
+    ao longo desse mesmo caminho. Devolve {no: (distancia_m, tempo_s)}.
+    """
+    alcancados = {}
+    fila = [(0.0, 0.0, origem)]
+    while fila:
+        dist, tempo, u = heapq.heappop(fila)
+        if u in alcancados:
+            continue
+        alcancados[u] = (dist, tempo)
+        for v, arestas in G.adj[u].items():
+            if v in alcancados:
+                continue
+            # Entre arestas paralelas, fica a mais curta
+            dados = min(arestas.values(), key=lambda d: float(d.get('length', 0)))
+            comprimento = float(dados.get('length', 0))
+            nova_dist = dist + comprimento
+            if nova_dist > limite_m:
+                continue
+            novo_tempo = tempo + comprimento / (_velocidade_kmh(dados) / 3.6)
+            heapq.heappush(fila, (nova_dist, novo_tempo, v))
+    return alcancados
+
+def _mediana(valores):
+    return statistics.median(valores) if valores else float('inf')
+
+def calcular_isocrona(G, cep_origem, lat_origem, lon_origem, dados_geocodificados, faixas=FAIXAS_KM):
+    """
+    Calcula a isócrona de um CEP de partida para todos os CEPs do mapa geocodificado (LoteCeps) da cidade.
+    Um bairro (ou raiz) pertence a uma faixa quando pelo menos metade dos seus CEPs está dentro dela.
+    """
+    import osmnx as ox
+
+    faixas = sorted(faixas)
+    limite_km = faixas[-1]
+    origem = ox.nearest_nodes(G, X=lon_origem, Y=lat_origem)
+    alcancados = _dijkstra_limitado(G, origem, limite_km * 1000)
+    logger.info(f"Isócrona de {cep_origem}: {len(alcancados)} nós alcançados até {limite_km} km.")
+
+    # Cada CEP é ligado ao nó mais próximo de todo o grafo; só conta se esse nó foi alcançado
+    nos, snaps_m = ox.nearest_nodes(G, X=list(dados_geocodificados.longitudes), Y=list(dados_geocodificados.latitudes),
+                                    return_dist=True)
+
+    por_cep = {}
+    distancias_bairro = defaultdict(list)
+    distancias_raiz = defaultdict(list)
+    for registo, no, snap_m in zip(dados_geocodificados, nos, snaps_m):
+        cep = registo.cep
+        snap_km = snap_m / 1000
+        distancia_km = float('inf')
+        if snap_km <= DISTANCIA_MAX_SNAP_KM and no in alcancados:
+            dist_m, tempo_s = alcancados[no]
+            # O troço entre o CEP e a rua soma-se à distância, à velocidade padrão
+            distancia_km = dist_m / 1000 + snap_km
+            tempo_min = tempo_s / 60 + snap_km / VELOCIDADE_PADRAO_KMH * 60
+        if distancia_km <= limite_km:
+            faixa = next(f for f in faixas if distancia_km <= f)
+            por_cep[cep] = [round(distancia_km, 2), round(tempo_min, 1), faixa]
+        distancias_bairro[registo.bairro or 'Bairro não identificado'].append(distancia_km)
+        distancias_raiz[cep[:5]].append(distancia_km)
+
+    medianas_bairro = {b: _mediana(d) for b, d in distancias_bairro.items()}
+    medianas_raiz = {r: _mediana(d) for r, d in distancias_raiz.items()}
+    por_faixa = {}
+    for f in faixas:
+        por_faixa[str(f)] = {
+            "ceps": sorted(c for c, (d, _, _) in por_cep.items() if d <= f),
+            "bairros": sorted(b for b, m in medianas_bairro.items() if m <= f),
+            "raizes": sorted(r for r, m in medianas_raiz.items() if m <= f),
+        }
+
+    return {
+        "cep_origem": cep_origem,
+        "faixas_km": faixas,
+        "ceps": por_cep,
+        "bairros": {b: round(m, 2) for b, m in medianas_bairro.items() if m <= limite_km},
+        "raizes": {r: round(m, 2) for r, m in medianas_raiz.items() if m <= limite_km},
+        "por_faixa": por_faixa,
+    }
+
+def obter_isocrona(estado, cidade, cep_origem, faixas=FAIXAS_KM):
+    """
+    Devolve a isócrona do CEP de partida, calculando-a só se ainda não existir
+    para a versão atual do grafo. O grafo só é carregado quando é preciso calcular.
+    """
+    from .cep_service import get_info_from_cep
+    from .cep_processing import get_geocoded_ceps_for_city
+
+    pedido = f"{estado.lower()}-{cidade.lower()}-{cep_origem}-{'-'.join(map(str, sorted(faixas)))}"
+    # Aponta para a isócrona calculada com o grafo mais recente, para quando o ficheiro do grafo não está aqui
+    chave_ultima = f"ultima-{pedido}"
+    versao = versao_grafo()
+    if versao is None:
+        ultima = cache_manager.ler(NAMESPACE_CACHE, chave_ultima)
+        if ultima is None:
+            logger.error(f"ERRO: Ficheiro do grafo '{ARQUIVO_GRAFO}' não encontrado e não há isócrona guardada para {cep_origem}.")
+            return None
+        logger.warning(f"Ficheiro do grafo '{ARQUIVO_GRAFO}' não encontrado: a usar a isócrona guardada ({ultima['chave']}).")
+        chave = ultima['chave']
+    else:
+        chave = f"{versao}-{pedido}"
+    if chave in _isocronas_em_memoria:
+        return _isocronas_em_memoria[chave]
+    isocrona = cache_manager.ler(NAMESPACE_CACHE, chave)
+    if isocrona is None and versao is None:
+        logger.error(f"A isócrona guardada '{chave}' já não está no cache e o grafo não está disponível.")
+        return None
+    if isocrona is None:
+        partida = get_info_from_cep(cep_origem)
+        if partida is None:
+            logger.error(f"Não foi possível encontrar as coordenadas para o CEP de partida {cep_origem}.")
+            return None
+        dados_geocodificados = get_geocoded_ceps_for_city(estado, cidade)
+        if not dados_geocodificados:
+            logger.error(f"Não foi possível obter dados geocodificados para {cidade}/{estado}.")
+            return None
+        isocrona = calcular_isocrona(_carregar_grafo(), cep_origem, partida.latitude, partida.longitude,
+                                     dados_geocodificados, faixas)
+        cache_manager.gravar(NAMESPACE_CACHE, chave, isocrona)
+        cache_manager.gravar(NAMESPACE_CACHE, chave_ultima, {"chave": chave})
+    _isocronas_em_memoria[chave] = isocrona
+    return isocrona
+
+def consultar_faixa(isocrona, faixa_km, nivel="bairros"):
+    """Lista os CEPs, bairros ou raízes ('ceps', 'bairros', 'raizes') dentro da faixa: uma única consulta."""
+    return isocrona["por_faixa"].get(str(faixa_km), {}).get(nivel, [])
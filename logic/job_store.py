@@ -0,0 +1,184 @@
+# logic/job_store.py
+# Fila de tarefas entre o 'automacao_rotas.py' e o 'calcular_distancias_reais.py'.
+# Cada tarefa guarda o CEP de partida já geocodificado e os arrays de destinos (CEPs,
+# coordenadas e distâncias em linha reta) em BLOBs binários, para que o cálculo das
+# distâncias reais leia tudo do disco em vez de ler as abas de volta da planilha.
+#
+# Os dois scripts correm em máquinas diferentes, por isso a fila é partilhada explicitamente:
+# o workflow noturno publica o 'fila_tarefas.sqlite' como artefacto 'fila-tarefas', e a máquina
+# do grafo junta-o à sua fila antes de calcular:
+#   gh run download <id da execução> -n fila-tarefas -D fila_importada
+#   python calcular_distancias_reais.py --importar-fila fila_importada/fila_tarefas.sqlite
+# Em alternativa, ROTERIZADOR_FILA pode apontar as duas máquinas para o mesmo ficheiro.
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from array import array
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+ARQUIVO_FILA = os.environ.get("ROTERIZADOR_FILA", "fila_tarefas.sqlite")
+# Uma tarefa 'em_curso' há mais tempo do que isto é considerada abandonada e volta à fila
+LIMITE_EM_CURSO_S = 6 * 60 * 60
+
+PENDENTE = "pendente"
+EM_CURSO = "em_curso"
+CONCLUIDA = "concluida"
+ERRO = "erro"
+SUBSTITUIDA = "substituida"
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS tarefas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    planilha TEXT, empresa TEXT, estado TEXT, cidade TEXT,
+    cep_partida TEXT, lat_partida REAL, lon_partida REAL,
+    situacao TEXT, criada_em REAL, atualizada_em REAL, erro TEXT,
+    ceps BLOB, latitudes BLOB, longitudes BLOB, distancias_km BLOB, textos TEXT
+);
+CREATE INDEX IF NOT EXISTS tarefas_situacao ON tarefas (situacao, id);
+"""
+
+_local = threading.local()
+
+def _conexao():
+    con = getattr(_local, 'conexao', None)
+    if con is None:
+        con = sqlite3.connect(ARQUIVO_FILA, timeout=30, isolation_level=None)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA journal_mode=WAL")
+        con.executescript(_ESQUEMA)
+        _local.conexao = con
+    return con
+
+def enfileirar_tarefa(planilha, empresa, estado, cidade, cep_partida, lat_partida, lon_partida, destinos):
+    """
+    Guarda uma tarefa de cálculo de distâncias reais. 'destinos' é um dict de colunas:
+    'ceps', 'latitudes', 'longitudes', 'distancias_km', 'bairros' e 'ruas'.
+    Uma tarefa pendente anterior da mesma empresa é substituída.
+    """
+    agora = time.time()
+    con = _conexao()
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        con.execute(
+            "UPDATE tarefas SET situacao = ?, atualizada_em = ? WHERE planilha = ? AND empresa = ? AND situacao = ?",
+            (SUBSTITUIDA, agora, planilha, empresa, PENDENTE)
+        )
+        cursor = con.execute(
+            "INSERT INTO tarefas (planilha, empresa, estado, cidade, cep_partida, lat_partida, lon_partida, "
+            "situacao, criada_em, atualizada_em, ceps, latitudes, longitudes, distancias_km, textos) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                planilha, empresa, estado, cidade, cep_partida, lat_partida, lon_partida,
+                PENDENTE, agora, agora,
+                array('q', (int(c) for c in destinos['ceps'])).tobytes(),
+                array('d', destinos['latitudes']).tobytes(),
+                array('d', destinos['longitudes']).tobytes(),
+                array('d', destinos['distancias_km']).tobytes(),
+                json.dumps({"bairros": list(destinos['bairros']), "ruas": list(destinos['ruas'])}, ensure_ascii=False),
+            )
+        )
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    logger.info(f"Tarefa de '{empresa}' guardada na fila ({len(destinos['ceps'])} destinos).")
+    return cursor.lastrowid
+
+def importar_tarefas(arquivo):
+    """
+    Junta à fila as tarefas pendentes de outro ficheiro de fila (p.ex. o artefacto do workflow).
+    Uma tarefa já importada, ou mais antiga do que uma tarefa já conhecida da mesma empresa,
+    é ignorada; as pendentes anteriores da mesma empresa são substituídas, como em 'enfileirar_tarefa'.
+    Devolve o número de tarefas importadas.
+    """
+    if not os.path.exists(arquivo):
+        raise FileNotFoundError(arquivo)
+    origem = sqlite3.connect(arquivo, timeout=30)
+    origem.row_factory = sqlite3.Row
+    try:
+        linhas = origem.execute("SELECT * FROM tarefas WHERE situacao = ? ORDER BY id", (PENDENTE,)).fetchall()
+    finally:
+        origem.close()
+
+    colunas = ("planilha", "empresa", "estado", "cidade", "cep_partida", "lat_partida", "lon_partida",
+               "situacao", "criada_em", "atualizada_em", "ceps", "latitudes", "longitudes", "distancias_km", "textos")
+    importadas = 0
+    con = _conexao()
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        for linha in linhas:
+            (mais_recente,) = con.execute(
+                "SELECT MAX(criada_em) FROM tarefas WHERE planilha = ? AND empresa = ?",
+                (linha['planilha'], linha['empresa'])
+            ).fetchone()
+            if mais_recente is not None and mais_recente >= linha['criada_em']:
+                continue
+            con.execute(
+                "UPDATE tarefas SET situacao = ?, atualizada_em = ? WHERE planilha = ? AND empresa = ? AND situacao = ?",
+                (SUBSTITUIDA, time.time(), linha['planilha'], linha['empresa'], PENDENTE)
+            )
+            con.execute(
+                f"INSERT INTO tarefas ({', '.join(colunas)}) VALUES ({', '.join('?' * len(colunas))})",
+                tuple(linha[c] for c in colunas)
+            )
+            importadas += 1
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    logger.info(f"{importadas} de {len(linhas)} tarefa(s) pendente(s) importada(s) de '{arquivo}'.")
+    return importadas
+
+def _decodificar(linha):
+    textos = json.loads(linha['textos'])
+    ceps, latitudes, longitudes, distancias = array('q'), array('d'), array('d'), array('d')
+    ceps.frombytes(linha['ceps'])
+    latitudes.frombytes(linha['latitudes'])
+    longitudes.frombytes(linha['longitudes'])
+    distancias.frombytes(linha['distancias_km'])
+    return {
+        "id": linha['id'], "planilha": linha['planilha'], "empresa": linha['empresa'],
+        "estado": linha['estado'], "cidade": linha['cidade'], "cep_partida": linha['cep_partida'],
+        "lat_partida": linha['lat_partida'], "lon_partida": linha['lon_partida'],
+        "ceps": [str(c).zfill(8) for c in ceps], "latitudes": latitudes, "longitudes": longitudes,
+        "distancias_km": distancias, "bairros": textos['bairros'], "ruas": textos['ruas'],
+    }
+
+def reservar_proxima_tarefa():
+    """Marca a tarefa pendente mais antiga como 'em_curso' e devolve-a, ou None se a fila estiver vazia."""
+    agora = time.time()
+    con = _conexao()
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        linha = con.execute(
+            "SELECT * FROM tarefas WHERE situacao = ? OR (situacao = ? AND atualizada_em < ?) ORDER BY id LIMIT 1",
+            (PENDENTE, EM_CURSO, agora - LIMITE_EM_CURSO_S)
+        ).fetchone()
+        if linha is not None:
+            con.execute("UPDATE tarefas SET situacao = ?, atualizada_em = ? WHERE id = ?", (EM_CURSO, agora, linha['id']))
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    return _decodificar(linha) if linha is not None else None
+
+def concluir_tarefa(id_tarefa):
+    _conexao().execute(
+        "UPDATE tarefas SET situacao = ?, atualizada_em = ?, erro = NULL WHERE id = ?",
+        (CONCLUIDA, time.time(), id_tarefa)
+    )
+
+def falhar_tarefa(id_tarefa, erro):
+    _conexao().execute(
+        "UPDATE tarefas SET situacao = ?, atualizada_em = ?, erro = ? WHERE id = ?",
+        (ERRO, time.time(), str(erro), id_tarefa)
+    )
+
+def contar_pendentes():
+    (total,) = _conexao().execute("SELECT COUNT(*) FROM tarefas WHERE situacao = ?", (PENDENTE,)).fetchone()
+    return total
@@ -0,0 +1,280 @@
+# logic/metrics.py
+# Métricas de uma execução dos scripts de automação.
+#   - cronometrar(etapa): tempo por etapa (chamadas, total e máximo)
+#   - medir_fonte: chamadas a APIs e sites por resultado, com histograma de latências
+#   - registar_cache: acertos e falhas por namespace do cache, só desta execução
+#   - contar: contadores livres (tarefas, rotas sem caminho, ...)
+# execucao_monitorizada(nome) envolve o script inteiro: no fim grava um resumo JSON em 'metricas/'
+# com a duração, o pico de memória (RSS) e tudo o que foi medido, e, se a variável de ambiente
+# ROTERIZADOR_PROMETHEUS_TEXTFILE apontar para um diretório, um ficheiro .prom para o
+# textfile collector do node_exporter.
+# Com '--profile' ou ROTERIZADOR_PROFILE, cada etapa é também perfilada (ver profiling.py).
+
+import os
+import json
+import time
+import platform
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from .logger import get_logger
+from . import profiling
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = get_logger(__name__)
+
+DIRETORIO_METRICAS = "metricas"
+VARIAVEL_PROMETHEUS = "ROTERIZADOR_PROMETHEUS_TEXTFILE"
+# Limites (segundos) dos baldes do histograma de latências das fontes externas
+LIMITES_LATENCIA_S = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+SUCESSO = "sucesso"
+SEM_RESULTADO = "sem_resultado"
+FALHA = "falha"
+# Contador dos erros que um script trata sem os relançar: se não for zero, a execução conta como falhada
+ERROS_FATAIS = "erros_fatais"
+
+_trinco = threading.Lock()
+_etapas = {}
+_fontes = {}
+_caches = {}
+_contadores = {}
+
+def reiniciar():
+    """Apaga tudo o que foi medido até agora (usado no início de cada execução monitorizada)."""
+    with _trinco:
+        _etapas.clear()
+        _fontes.clear()
+        _caches.clear()
+        _contadores.clear()
+
+def registar_etapa(etapa, duracao_s):
+    with _trinco:
+        dados = _etapas.setdefault(etapa, {"chamadas": 0, "total_s": 0.0, "max_s": 0.0})
+        dados["chamadas"] += 1
+        dados["total_s"] += duracao_s
+        dados["max_s"] = max(dados["max_s"], duracao_s)
+
+@contextmanager
+def cronometrar(etapa):
+    """
+    Mede o tempo do bloco (ou da função, se usado como decorador) na etapa indicada.
+    Etapas que correm em várias threads somam o tempo de todas elas.
+    """
+    inicio = time.perf_counter()
+    try:
+        with profiling.perfilar(etapa):
+            yield
+    finally:
+        registar_etapa(etapa, time.perf_counter() - inicio)
+
+def registar_fonte(fonte, resultado, duracao_s):
+    with _trinco:
+        dados = _fontes.get(fonte)
+        if dados is None:
+            dados = _fontes[fonte] = {
+                "resultados": {}, "total_s": 0.0, "max_s": 0.0,
+                "baldes": [0] * (len(LIMITES_LATENCIA_S) + 1),
+            }
+        dados["resultados"][resultado] = dados["resultados"].get(resultado, 0) + 1
+        dados["total_s"] += duracao_s
+        dados["max_s"] = max(dados["max_s"], duracao_s)
+        balde = next((i for i, limite in enumerate(LIMITES_LATENCIA_S) if duracao_s <= limite), len(LIMITES_LATENCIA_S))
+        dados["baldes"][balde] += 1
+
+class _Chamada:
+    __slots__ = ('resultado',)
+
+    def __init__(self):
+        self.resultado = SUCESSO
+
+@contextmanager
+def medir_fonte(fonte):
+    """
+    Mede uma chamada a uma fonte externa. O bloco pode mudar 'chamada.resultado'
+    (por padrão 'sucesso'); uma exceção que escape do bloco conta como 'falha'.
+    """
+    chamada = _Chamada()
+    inicio = time.perf_counter()
+    try:
+        yield chamada
+    except BaseException:
+        chamada.resultado = FALHA
+        raise
+    finally:
+        registar_fonte(fonte, chamada.resultado, time.perf_counter() - inicio)
+
+def registar_cache(namespace, acerto):
+    with _trinco:
+        dados = _caches.setdefault(namespace, {"hits": 0, "misses": 0})
+        dados["hits" if acerto else "misses"] += 1
+
+def contar(nome, n=1):
+    with _trinco:
+        _contadores[nome] = _contadores.get(nome, 0) + n
+
+def rss_pico_bytes():
+    """Pico de memória residente do processo, ou None se a plataforma não o disponibilizar."""
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # O Linux devolve KB; o macOS devolve bytes
+    return pico if platform.system() == "Darwin" else pico * 1024
+
+def resumo():
+    """Fotografia de tudo o que foi medido, pronta a gravar em JSON."""
+    with _trinco:
+        etapas = {
+            nome: {
+                "chamadas": d["chamadas"], "total_s": round(d["total_s"], 3),
+                "media_s": round(d["total_s"] / d["chamadas"], 4), "max_s": round(d["max_s"], 3),
+            }
+            for nome, d in sorted(_etapas.items())
+        }
+        fontes = {}
+        for nome, d in sorted(_fontes.items()):
+            chamadas = sum(d["resultados"].values())
+            rotulos = [f"<={limite}" for limite in LIMITES_LATENCIA_S] + ["+Inf"]
+            fontes[nome] = {
+                "chamadas": chamadas, "resultados": dict(d["resultados"]),
+                "taxa_falha": round(d["resultados"].get(FALHA, 0) / chamadas, 3),
+                "latencia_total_s": round(d["total_s"], 4), "latencia_media_s": round(d["total_s"] / chamadas, 4),
+                "latencia_max_s": round(d["max_s"], 3),
+                "histograma_s": dict(zip(rotulos, d["baldes"])),
+            }
+        caches = {
+            ns: {**d, "taxa_acerto": round(d["hits"] / (d["hits"] + d["misses"]), 3) if d["hits"] + d["misses"] else None}
+            for ns, d in sorted(_caches.items())
+        }
+        contadores = dict(sorted(_contadores.items()))
+    return {"etapas": etapas, "fontes": fontes, "caches": caches, "contadores": contadores,
+            "rss_pico_bytes": rss_pico_bytes()}
+
+def _gravar_atomico(caminho, texto):
+    diretorio = os.path.dirname(caminho) or "."
+    os.makedirs(diretorio, exist_ok=True)
+    descritor, temporario = tempfile.mkstemp(dir=diretorio, prefix=".tmp-")
+    try:
+        with os.fdopen(descritor, 'w', encoding='utf-8') as f:
+            f.write(texto)
+        os.replace(temporario, caminho)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _rotulos(**rotulos):
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in rotulos.items()) + "}"
+
+def formato_prometheus(relatorio):
+    """Converte o relatório de uma execução para o formato de texto do Prometheus."""
+    execucao = relatorio["execucao"]
+    linhas = []
+
+    def metrica(nome, tipo, ajuda, amostras):
+        linhas.append(f"# HELP roterizador_{nome} {ajuda}")
+        linhas.append(f"# TYPE roterizador_{nome} {tipo}")
+        for sufixo, rotulos, valor in amostras:
+            linhas.append(f"roterizador_{nome}{sufixo}{_rotulos(execucao=execucao, **rotulos)} {valor}")
+
+    metrica("execucao_duracao_segundos", "gauge", "Duração da última execução.",
+            [("", {}, relatorio["duracao_s"])])
+    metrica("execucao_sucesso", "gauge", "1 se a última execução terminou sem exceção nem erro fatal.",
+            [("", {}, int(relatorio["sucesso"]))])
+    metrica("execucao_fim_timestamp_segundos", "gauge", "Fim da última execução (epoch).",
+            [("", {}, relatorio["fim_epoch"])])
+    if relatorio["rss_pico_bytes"] is not None:
+        metrica("rss_pico_bytes", "gauge", "Pico de memória residente.", [("", {}, relatorio["rss_pico_bytes"])])
+
+    metrica("etapa_segundos", "gauge", "Tempo total gasto em cada etapa.",
+            [("", {"etapa": e}, d["total_s"]) for e, d in relatorio["etapas"].items()])
+    metrica("etapa_chamadas", "gauge", "Vezes que cada etapa correu.",
+            [("", {"etapa": e}, d["chamadas"]) for e, d in relatorio["etapas"].items()])
+
+    metrica("fonte_chamadas", "gauge", "Chamadas a fontes externas por resultado.",
+            [("", {"fonte": f, "resultado": r}, n)
+             for f, d in relatorio["fontes"].items() for r, n in d["resultados"].items()])
+    amostras = []
+    for f, d in relatorio["fontes"].items():
+        acumulado = 0
+        for n, limite in zip(d["histograma_s"].values(), list(LIMITES_LATENCIA_S) + ["+Inf"]):
+            acumulado += n
+            amostras.append(("_bucket", {"fonte": f, "le": limite}, acumulado))
+        amostras.append(("_sum", {"fonte": f}, d["latencia_total_s"]))
+        amostras.append(("_count", {"fonte": f}, d["chamadas"]))
+    metrica("fonte_latencia_segundos", "histogram", "Latência das chamadas a fontes externas.", amostras)
+
+    metrica("cache_consultas", "gauge", "Consultas ao cache por namespace e resultado.",
+            [("", {"namespace": ns, "resultado": r}, d[r]) for ns, d in relatorio["caches"].items() for r in ("hits", "misses")])
+    metrica("contador", "gauge", "Contadores livres da execução.",
+            [("", {"nome": n}, v) for n, v in relatorio["contadores"].items()])
+    return "\n".join(linhas) + "\n"
+
+def _registar_no_log(relatorio):
+    logger.info(f"--- Métricas da execução '{relatorio['execucao']}' ({relatorio['duracao_s']:.1f} s) ---")
+    for nome, d in sorted(relatorio["etapas"].items(), key=lambda item: -item[1]["total_s"]):
+        logger.info(f"  etapa {nome}: {d['total_s']:.2f} s em {d['chamadas']} chamada(s), máx. {d['max_s']:.2f} s")
+    for nome, d in relatorio["fontes"].items():
+        logger.info(f"  fonte {nome}: {d['chamadas']} chamadas {d['resultados']}, média {d['latencia_media_s'] * 1000:.0f} ms")
+    for ns, d in relatorio["caches"].items():
+        if d["taxa_acerto"] is not None:
+            logger.info(f"  cache {ns}: {d['taxa_acerto']:.1%} de acertos ({d['hits']}/{d['hits'] + d['misses']})")
+    if relatorio["rss_pico_bytes"] is not None:
+        logger.info(f"  pico de memória: {relatorio['rss_pico_bytes'] / (1024 * 1024):.0f} MB")
+
+@contextmanager
+def execucao_monitorizada(nome):
+    """
+    Envolve uma execução completa de um script. No fim (mesmo com erro) grava o resumo em
+    'metricas/<nome>-<data>.json' e, se configurado, o ficheiro do Prometheus.
+    Trata também o '--profile' da linha de comando: o tempo fora das etapas fica no perfil '<nome>'.
+    """
+    reiniciar()
+    profiling.ativar_se_pedido()
+    inicio_epoch = time.time()
+    inicio = time.perf_counter()
+    erro = None
+    try:
+        with profiling.perfilar(nome):
+            yield
+    except BaseException as e:
+        erro = repr(e)
+        raise
+    finally:
+        medido = resumo()
+        fatais = medido["contadores"].get(ERROS_FATAIS, 0)
+        if erro is None and fatais:
+            erro = f"{fatais} erro(s) fatal(is) registado(s)"
+        relatorio = {
+            "execucao": nome,
+            "inicio": datetime.fromtimestamp(inicio_epoch, timezone.utc).isoformat(timespec="seconds"),
+            "fim_epoch": round(time.time(), 3),
+            "duracao_s": round(time.perf_counter() - inicio, 3),
+            "sucesso": erro is None,
+            "erro": erro,
+            **medido,
+        }
+        carimbo = datetime.fromtimestamp(inicio_epoch).strftime("%Y%m%d-%H%M%S")
+        try:
+            caminho = os.path.join(DIRETORIO_METRICAS, f"{nome}-{carimbo}.json")
+            _gravar_atomico(caminho, json.dumps(relatorio, ensure_ascii=False, indent=2))
+            _registar_no_log(relatorio)
+            logger.info(f"Métricas da execução guardadas em '{caminho}'.")
+            diretorio_prometheus = os.environ.get(VARIAVEL_PROMETHEUS)
+            if diretorio_prometheus:
+                _gravar_atomico(os.path.join(diretorio_prometheus, f"roterizador_{nome}.prom"),
+                                formato_prometheus(relatorio))
+        except OSError as e:
+            logger.warning(f"Não foi possível gravar as métricas da execução: {e}")
+        try:
+            profiling.gravar_perfis(nome, carimbo)
+        except OSError as e:
+            logger.warning(f"Não foi possível gravar os perfis da execução: {e}")
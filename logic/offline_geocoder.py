@@ -0,0 +1,227 @@
+# logic/offline_geocoder.py
+# Geocodificador local construído a partir do 'brazil-latest.osm.pbf'.
+# O índice é um ficheiro SQLite compacto com três tabelas indexadas por nome normalizado:
+#   cep   -> coordenada média de tudo o que tem 'addr:postcode' no OSM
+#   rua   -> ponto médio das vias com nome, por município
+#   lugar -> nós 'place' (bairros, vilas, localidades), por município
+# Uma consulta custa microssegundos e não precisa de rede.
+
+import os
+import sqlite3
+import threading
+from .logger import get_logger
+from .utils import normalizar_nome, normalizar_estado
+from .boundary_validation import carregar_municipios_extraidos, MAP_FILE
+
+logger = get_logger(__name__)
+
+ARQUIVO_INDICE = "brazil_geocoder.sqlite"
+
+# Tipos de via que contam como "rua" para o índice
+TIPOS_VIA = {
+    'motorway', 'trunk', 'primary', 'secondary', 'tertiary', 'unclassified',
+    'residential', 'living_street', 'pedestrian', 'service', 'road',
+}
+# Tipos de 'place' guardados como lugares
+TIPOS_LUGAR = {'suburb', 'neighbourhood', 'quarter', 'hamlet', 'village', 'locality', 'isolated_dwelling'}
+
+# Quantos pontos acumular antes de os atribuir a municípios e gravar no SQLite
+TAMANHO_LOTE = 200_000
+
+_ESQUEMA_TEMPORARIO = """
+CREATE TABLE rua_tmp (cidade TEXT, nome TEXT, estado TEXT, soma_lat REAL, soma_lon REAL, n INTEGER,
+                      PRIMARY KEY (cidade, nome, estado)) WITHOUT ROWID;
+CREATE TABLE lugar_tmp (cidade TEXT, nome TEXT, estado TEXT, soma_lat REAL, soma_lon REAL, n INTEGER,
+                        PRIMARY KEY (cidade, nome, estado)) WITHOUT ROWID;
+"""
+
+_ESQUEMA_FINAL = """
+CREATE TABLE cep (cep TEXT PRIMARY KEY, lat REAL, lon REAL) WITHOUT ROWID;
+CREATE TABLE rua (cidade TEXT, nome TEXT, estado TEXT, lat REAL, lon REAL,
+                  PRIMARY KEY (cidade, nome, estado)) WITHOUT ROWID;
+CREATE TABLE lugar (cidade TEXT, nome TEXT, estado TEXT, lat REAL, lon REAL,
+                    PRIMARY KEY (cidade, nome, estado)) WITHOUT ROWID;
+INSERT INTO rua SELECT cidade, nome, estado, ROUND(soma_lat / n, 6), ROUND(soma_lon / n, 6) FROM rua_tmp;
+INSERT INTO lugar SELECT cidade, nome, estado, ROUND(soma_lat / n, 6), ROUND(soma_lon / n, 6) FROM lugar_tmp;
+DROP TABLE rua_tmp;
+DROP TABLE lugar_tmp;
+"""
+
+_local = threading.local()
+
+def _limpar_cep(cep):
+    digitos = "".join(c for c in str(cep or '') if c.isdigit())
+    return digitos if len(digitos) == 8 else None
+
+# --- CONSTRUÇÃO DO ÍNDICE (corre uma vez, através do 'cria_geocodificador.py') ---
+
+def construir_indice(map_file=MAP_FILE, arquivo_indice=ARQUIVO_INDICE):
+    """
+    Lê o PBF uma vez e grava o índice de geocodificação.
+    Precisa dos limites dos municípios já extraídos pelo 'cria_limites.py'.
+    """
+    import osmium
+    import shapely
+
+    estados_m, cidades_m, geoms_m = carregar_municipios_extraidos()
+    if not cidades_m:
+        logger.error("Nenhum limite de município encontrado no cache. Execute o 'cria_limites.py' primeiro.")
+        return False
+    cidades_norm = [normalizar_nome(c) for c in cidades_m]
+    arvore = shapely.STRtree(geoms_m)
+
+    # Grava primeiro num ficheiro temporário, para que o índice antigo continue válido até ao fim
+    temporario = arquivo_indice + ".tmp"
+    if os.path.exists(temporario):
+        os.remove(temporario)
+    con = sqlite3.connect(temporario)
+    con.executescript(_ESQUEMA_TEMPORARIO)
+
+    somas_cep = {}
+    pendentes = {'rua': [], 'lugar': []}
+
+    def descarregar(tabela):
+        """Atribui os pontos pendentes ao município que os contém e acumula-os no SQLite."""
+        lista = pendentes[tabela]
+        if not lista:
+            return
+        pontos = shapely.points([p[2] for p in lista], [p[1] for p in lista])
+        idx_pontos, idx_municipios = arvore.query(pontos, predicate='within')
+        agregados = {}
+        for p, m in zip(idx_pontos.tolist(), idx_municipios.tolist()):
+            nome, lat, lon = lista[p]
+            chave = (cidades_norm[m], nome, estados_m[m])
+            soma = agregados.setdefault(chave, [0.0, 0.0, 0])
+            soma[0] += lat
+            soma[1] += lon
+            soma[2] += 1
+        con.executemany(
+            f"INSERT INTO {tabela}_tmp VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (cidade, nome, estado) DO UPDATE SET "
+            "soma_lat = soma_lat + excluded.soma_lat, soma_lon = soma_lon + excluded.soma_lon, n = n + excluded.n",
+            [(*chave, *soma) for chave, soma in agregados.items()]
+        )
+        lista.clear()
+
+    def adicionar(tabela, nome, lat, lon):
+        nome_norm = normalizar_nome(nome)
+        if not nome_norm:
+            return
+        pendentes[tabela].append((nome_norm, lat, lon))
+        if len(pendentes[tabela]) >= TAMANHO_LOTE:
+            descarregar(tabela)
+
+    def registar_cep(postcode, lat, lon):
+        cep = _limpar_cep(postcode)
+        if not cep:
+            return
+        soma = somas_cep.setdefault(cep, [0.0, 0.0, 0])
+        soma[0] += lat
+        soma[1] += lon
+        soma[2] += 1
+
+    def ponto_da_via(via):
+        """Usa o nó do meio da via como ponto representativo."""
+        nos = via.nodes
+        if len(nos) == 0:
+            return None
+        try:
+            local = nos[len(nos) // 2].location
+            if local.valid():
+                return local.lat, local.lon
+        except osmium.InvalidLocationError:
+            pass
+        return None
+
+    class ColetorEnderecos(osmium.SimpleHandler):
+        def node(self, no):
+            tags = no.tags
+            postcode = tags.get('addr:postcode')
+            lugar = tags.get('place') in TIPOS_LUGAR and tags.get('name')
+            if not postcode and not lugar:
+                return
+            if not no.location.valid():
+                return
+            lat, lon = no.location.lat, no.location.lon
+            if postcode:
+                registar_cep(postcode, lat, lon)
+            if lugar:
+                adicionar('lugar', tags['name'], lat, lon)
+
+        def way(self, via):
+            tags = via.tags
+            postcode = tags.get('addr:postcode')
+            nome_rua = tags.get('name') if tags.get('highway') in TIPOS_VIA else None
+            if not postcode and not nome_rua:
+                return
+            ponto = ponto_da_via(via)
+            if ponto is None:
+                return
+            if postcode:
+                registar_cep(postcode, *ponto)
+            if nome_rua:
+                adicionar('rua', nome_rua, *ponto)
+
+    logger.info(f"A construir o índice de geocodificação a partir de '{map_file}'. Isto pode demorar bastante.")
+    ColetorEnderecos().apply_file(map_file, locations=True, idx='flex_mem')
+    descarregar('rua')
+    descarregar('lugar')
+
+    con.executescript(_ESQUEMA_FINAL)
+    con.executemany(
+        "INSERT INTO cep VALUES (?, ?, ?)",
+        [(cep, round(s[0] / s[2], 6), round(s[1] / s[2], 6)) for cep, s in somas_cep.items()]
+    )
+    con.commit()
+    con.execute("VACUUM")
+    con.close()
+    os.replace(temporario, arquivo_indice)
+    logger.info(f"💾 Índice guardado em '{arquivo_indice}' com {len(somas_cep)} CEPs.")
+    return True
+
+# --- CONSULTA ---
+
+def _conexao():
+    """Uma ligação só de leitura por thread (o mapeamento de cidades usa várias threads)."""
+    con = getattr(_local, 'conexao', None)
+    if con is None:
+        if not os.path.exists(ARQUIVO_INDICE):
+            return None
+        con = sqlite3.connect(f"file:{ARQUIVO_INDICE}?mode=ro", uri=True)
+        _local.conexao = con
+    return con
+
+def _procurar_por_nome(con, tabela, cidade, nome, estado):
+    linhas = con.execute(f"SELECT lat, lon, estado FROM {tabela} WHERE cidade = ? AND nome = ?", (cidade, nome)).fetchall()
+    # O estado é comparado já normalizado, tal como a cidade e o nome
+    if estado:
+        linhas = [linha for linha in linhas if normalizar_estado(linha[2]) == estado]
+    # Duas linhas significam cidades homónimas em estados diferentes: sem estado, não arriscamos
+    return linhas[0][:2] if len(linhas) == 1 else None
+
+def geocodificar_offline(cep, endereco_info=None):
+    """
+    Procura a coordenada no índice local: primeiro pelo CEP, depois pela rua
+    e por fim pelo bairro dentro da cidade. Devolve (lat, lon) ou None.
+    """
+    con = _conexao()
+    if con is None:
+        return None
+
+    cep_limpo = _limpar_cep(cep)
+    if cep_limpo:
+        linha = con.execute("SELECT lat, lon FROM cep WHERE cep = ?", (cep_limpo,)).fetchone()
+        if linha:
+            return linha
+
+    endereco_info = endereco_info or {}
+    cidade = normalizar_nome(endereco_info.get('localidade') or '')
+    if not cidade:
+        return None
+    estado = normalizar_estado(endereco_info.get('estado'))
+    for tabela, campo in (('rua', 'logradouro'), ('lugar', 'bairro')):
+        nome = normalizar_nome(endereco_info.get(campo) or '')
+        if nome:
+            linha = _procurar_por_nome(con, tabela, cidade, nome, estado)
+            if linha:
+                return linha
+    return None
@@ -0,0 +1,72 @@
+# logic/pipeline.py
+
+import queue
+import threading
+from .logger import get_logger
+from .metrics import cronometrar
+
+logger = get_logger(__name__)
+
+# Marcador interno que indica a um trabalhador que não há mais itens na fila
+_FIM = object()
+
+def executar_pipeline(itens, estagios, tamanho_fila=2):
+    """
+    Faz passar 'itens' por uma sequência de estágios ligados por filas limitadas.
+    Cada estágio é um tuplo (nome, funcao, num_workers): a função recebe o item do
+    estágio anterior e devolve o item para o seguinte; se devolver None, o item é descartado.
+    Como os estágios correm em simultâneo, o tempo total aproxima-se do estágio mais lento.
+    Devolve a lista de resultados do último estágio.
+    """
+    filas = [queue.Queue(maxsize=tamanho_fila) for _ in estagios]
+    resultados = []
+    threads = []
+    # Quantos trabalhadores de cada estágio ainda estão ativos
+    ativos = [num_workers for _, _, num_workers in estagios]
+    trinco = threading.Lock()
+
+    def trabalhador(indice):
+        nome, funcao, _ = estagios[indice]
+        fila_entrada = filas[indice]
+        fila_saida = filas[indice + 1] if indice + 1 < len(estagios) else None
+        while True:
+            item = fila_entrada.get()
+            if item is _FIM:
+                break
+            try:
+                with cronometrar(f"pipeline.{nome}"):
+                    saida = funcao(item)
+            except Exception as e:
+                logger.error(f"Erro no estágio '{nome}': {e}", exc_info=True)
+                continue
+            if saida is None:
+                continue
+            if fila_saida is not None:
+                fila_saida.put(saida)
+            else:
+                with trinco:
+                    resultados.append(saida)
+
+        # O último trabalhador a sair avisa todos os trabalhadores do estágio seguinte
+        with trinco:
+            ativos[indice] -= 1
+            ultimo = ativos[indice] == 0
+        if ultimo and fila_saida is not None:
+            for _ in range(estagios[indice + 1][2]):
+                fila_saida.put(_FIM)
+
+    for indice, (nome, _, num_workers) in enumerate(estagios):
+        for n in range(num_workers):
+            t = threading.Thread(target=trabalhador, args=(indice,), name=f"{nome}-{n + 1}", daemon=True)
+            t.start()
+            threads.append(t)
+
+    # A fila de entrada é limitada: a leitura dos itens avança ao ritmo do primeiro estágio
+    for item in itens:
+        filas[0].put(item)
+    for _ in range(estagios[0][2]):
+        filas[0].put(_FIM)
+
+    for t in threads:
+        t.join()
+    return resultados
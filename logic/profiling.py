@@ -0,0 +1,184 @@
+# logic/profiling.py
+# Perfilagem opcional por etapa, ligada com '--profile' em qualquer script de entrada
+# ou com a variável de ambiente ROTERIZADOR_PROFILE.
+#   --profile / ROTERIZADOR_PROFILE=1           cProfile e amostragem
+#   --profile=cprofile / ROTERIZADOR_PROFILE=cprofile      só cProfile (determinístico)
+#   --profile=amostragem / ROTERIZADOR_PROFILE=amostragem  só amostragem das pilhas
+# Cada etapa de 'metrics.cronometrar' entra em 'perfilar', e no fim da execução ficam em
+# 'perfis/<execucao>-<data>/' um '<etapa>.pstats' (snakeviz, python -m pstats) e um
+# '<etapa>.collapsed' (flamegraph.pl, speedscope) por etapa.
+# Desligada, 'perfilar' só verifica uma variável global.
+
+import os
+import re
+import sys
+import time
+import cProfile
+import pstats
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+DIRETORIO_PERFIS = "perfis"
+VARIAVEL_AMBIENTE = "ROTERIZADOR_PROFILE"
+ARGUMENTO = "--profile"
+CPROFILE = "cprofile"
+AMOSTRAGEM = "amostragem"
+INTERVALO_AMOSTRAGEM_S = 0.005
+
+# Modos ativos (vazio = desligado)
+_modos = frozenset()
+_trinco = threading.Lock()
+_local = threading.local()
+# cProfile acumulado por etapa, e contagem de pilhas amostradas por etapa
+_estatisticas = {}
+_pilhas = defaultdict(Counter)
+# Etapas abertas em cada thread (a do topo recebe as amostras dessa thread)
+_etapas_por_thread = {}
+_amostrador = None
+
+def _interpretar(valor):
+    valor = (valor or "").strip().lower()
+    if valor in ("", "0", "nao", "não", "false", "off"):
+        return frozenset()
+    if valor in (CPROFILE, AMOSTRAGEM):
+        return frozenset({valor})
+    return frozenset({CPROFILE, AMOSTRAGEM})
+
+def ativo():
+    return bool(_modos)
+
+def ativar(modos=(CPROFILE, AMOSTRAGEM)):
+    global _modos, _amostrador
+    _modos = frozenset(modos)
+    if AMOSTRAGEM in _modos and _amostrador is None:
+        _amostrador = threading.Thread(target=_amostrar, name="amostrador-perfis", daemon=True)
+        _amostrador.start()
+    logger.info(f"Perfilagem ligada ({', '.join(sorted(_modos))}).")
+
+def ativar_se_pedido(argv=None):
+    """
+    Liga a perfilagem se '--profile[=modo]' estiver na linha de comando (o argumento é
+    retirado de sys.argv, para não chegar ao script) ou se ROTERIZADOR_PROFILE estiver definida.
+    """
+    argv = sys.argv if argv is None else argv
+    pedido = os.environ.get(VARIAVEL_AMBIENTE)
+    for argumento in list(argv[1:]):
+        if argumento == ARGUMENTO or argumento.startswith(ARGUMENTO + "="):
+            argv.remove(argumento)
+            pedido = argumento.partition("=")[2] or "1"
+    modos = _interpretar(pedido)
+    if modos:
+        ativar(modos)
+
+def _pilha_ativa():
+    pilha = getattr(_local, 'pilha', None)
+    if pilha is None:
+        pilha = _local.pilha = []
+    return pilha
+
+def _ligar(perfil):
+    """Liga um cProfile; devolve False se outro perfilador já estiver ativo (Python 3.12+ só admite um)."""
+    try:
+        perfil.enable()
+        return True
+    except ValueError:
+        return False
+
+@contextmanager
+def perfilar(etapa):
+    """
+    Perfila o bloco como a etapa indicada. Numa etapa aninhada, o perfil da etapa exterior
+    é pausado, por isso cada .pstats mostra só o tempo próprio da sua etapa.
+    """
+    if not _modos:
+        yield
+        return
+
+    pilha = _pilha_ativa()
+    perfil = None
+    if CPROFILE in _modos:
+        if pilha and pilha[-1][1] is not None:
+            pilha[-1][1].disable()
+        perfil = cProfile.Profile()
+        if not _ligar(perfil):
+            # Outra thread já está a perfilar: esta etapa fica só com a amostragem
+            perfil = None
+    pilha.append((etapa, perfil))
+    identificador = threading.get_ident()
+    with _trinco:
+        _etapas_por_thread[identificador] = [nome for nome, _ in pilha]
+    try:
+        yield
+    finally:
+        pilha.pop()
+        if perfil is not None:
+            perfil.disable()
+            with _trinco:
+                if etapa in _estatisticas:
+                    _estatisticas[etapa].add(perfil)
+                else:
+                    _estatisticas[etapa] = pstats.Stats(perfil)
+        if pilha and pilha[-1][1] is not None:
+            _ligar(pilha[-1][1])
+        with _trinco:
+            if pilha:
+                _etapas_por_thread[identificador] = [nome for nome, _ in pilha]
+            else:
+                _etapas_por_thread.pop(identificador, None)
+
+def _descrever(frame):
+    codigo = frame.f_code
+    return f"{os.path.basename(codigo.co_filename)}:{codigo.co_name}"
+
+def _amostrar():
+    """Thread de amostragem: regista a pilha de cada thread que esteja dentro de uma etapa."""
+    proprio = threading.get_ident()
+    while True:
+        time.sleep(INTERVALO_AMOSTRAGEM_S)
+        if AMOSTRAGEM not in _modos:
+            continue
+        with _trinco:
+            etapas = {ident: lista[-1] for ident, lista in _etapas_por_thread.items() if lista}
+        if not etapas:
+            continue
+        for ident, frame in sys._current_frames().items():
+            etapa = etapas.get(ident)
+            if etapa is None or ident == proprio:
+                continue
+            nomes = []
+            while frame is not None:
+                nomes.append(_descrever(frame))
+                frame = frame.f_back
+            pilha = ";".join(reversed(nomes))
+            with _trinco:
+                _pilhas[etapa][pilha] += 1
+
+def _nome_ficheiro(etapa):
+    return re.sub(r"[^\w.-]", "_", etapa)
+
+def gravar_perfis(nome_execucao, carimbo):
+    """Grava os perfis acumulados e limpa-os. Devolve o diretório, ou None se nada foi perfilado."""
+    if not _modos:
+        return None
+    with _trinco:
+        estatisticas = dict(_estatisticas)
+        pilhas = {etapa: dict(contagem) for etapa, contagem in _pilhas.items()}
+        _estatisticas.clear()
+        _pilhas.clear()
+    if not estatisticas and not pilhas:
+        return None
+
+    diretorio = os.path.join(DIRETORIO_PERFIS, f"{nome_execucao}-{carimbo}")
+    os.makedirs(diretorio, exist_ok=True)
+    for etapa, stats in estatisticas.items():
+        stats.dump_stats(os.path.join(diretorio, f"{_nome_ficheiro(etapa)}.pstats"))
+    for etapa, contagem in pilhas.items():
+        with open(os.path.join(diretorio, f"{_nome_ficheiro(etapa)}.collapsed"), 'w', encoding='utf-8') as f:
+            for pilha, n in sorted(contagem.items(), key=lambda item: -item[1]):
+                f.write(f"{pilha} {n}\n")
+    logger.info(f"Perfis guardados em '{diretorio}' ({len(estatisticas)} .pstats, {len(pilhas)} .collapsed).")
+    return diretorio
@@ -0,0 +1,84 @@
+# logic/routing_client.py
+# Cliente do serviço local de rotas ('servidor_rotas.py'). Todas as funções devolvem None
+# quando o serviço não está a correr ou falha, para que quem chama faça o trabalho localmente.
+# O endereço vem de ROTERIZADOR_SERVIDOR (por padrão http://127.0.0.1:8765); "off" desliga o cliente.
+
+import os
+import requests
+from .logger import get_logger
+from .cep_record import LoteCeps
+from .metrics import medir_fonte, FALHA
+
+logger = get_logger(__name__)
+
+PORTA_PADRAO = 8765
+VARIAVEL_AMBIENTE = "ROTERIZADOR_SERVIDOR"
+TIMEOUT_ESTADO_S = 0.5
+# Pedir uma cidade ainda não mapeada faz o serviço mapeá-la, o que pode levar muito tempo
+TIMEOUT_PEDIDO_S = 60 * 60
+
+_sessao = requests.Session()
+# Último /estado recebido; None obriga a perguntar de novo
+_estado = None
+
+def _url_base():
+    url = os.environ.get(VARIAVEL_AMBIENTE, f"http://127.0.0.1:{PORTA_PADRAO}")
+    return None if url.strip().lower() in ("", "off", "0") else url.rstrip("/")
+
+def estado_servidor():
+    """Devolve o resumo do serviço (grafo carregado, cidades em memória), ou None se não estiver a correr."""
+    global _estado
+    if _estado is not None:
+        return _estado
+    url = _url_base()
+    if url is None:
+        return None
+    try:
+        resposta = _sessao.get(f"{url}/estado", timeout=TIMEOUT_ESTADO_S)
+        resposta.raise_for_status()
+        _estado = resposta.json()
+        logger.info(f"Serviço de rotas encontrado em {url} ({len(_estado['cidades'])} cidade(s) em memória).")
+    except (requests.RequestException, ValueError):
+        return None
+    return _estado
+
+def _pedir(caminho, corpo):
+    global _estado
+    url = _url_base()
+    with medir_fonte("servidor_rotas") as chamada:
+        try:
+            resposta = _sessao.post(f"{url}{caminho}", json=corpo, timeout=TIMEOUT_PEDIDO_S)
+            resposta.raise_for_status()
+            return resposta.json()
+        except (requests.RequestException, ValueError) as e:
+            chamada.resultado = FALHA
+            logger.warning(f"O serviço de rotas falhou em {caminho}: {e}. A calcular localmente.")
+            # O serviço pode ter parado: a próxima chamada volta a verificar
+            _estado = None
+            return None
+
+def matriz_distancias(origens, destinos):
+    """
+    Distâncias de condução (km) de cada origem a cada destino, ambos como listas de (lat, lon).
+    Devolve uma lista de linhas (None onde não há rota), ou None se o serviço não tiver o grafo.
+    """
+    estado = estado_servidor()
+    if not estado or not estado.get("grafo_carregado"):
+        return None
+    resposta = _pedir("/matriz-distancias", {"origens": [list(p) for p in origens], "destinos": [list(p) for p in destinos]})
+    return resposta["distancias_km"] if resposta is not None else None
+
+def ceps_da_cidade(estado_uf, cidade):
+    """LoteCeps da cidade servido da memória do serviço, ou None."""
+    if not estado_servidor():
+        return None
+    resposta = _pedir("/ceps-cidade", {"estado": estado_uf, "cidade": cidade})
+    return LoteCeps.de_json(resposta) if resposta else None
+
+def cep_mais_proximo(estado_uf, cidade, pontos, raio_max_km=None):
+    """Para cada (lat, lon), o CEP mais próximo da cidade como {'cep', 'distancia_km'} (ou None), ou None."""
+    if not estado_servidor():
+        return None
+    resposta = _pedir("/cep-mais-proximo", {"estado": estado_uf, "cidade": cidade,
+                                            "pontos": [list(p) for p in pontos], "raio_max_km": raio_max_km})
+    return resposta["resultados"] if resposta is not None else None
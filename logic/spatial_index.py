@@ -0,0 +1,102 @@
+# logic/spatial_index.py
+
+import math
+from collections import defaultdict
+from .utils import haversine
+
+KM_POR_GRAU = 111.32
+
+def _perimetro(c_lat, c_lon, anel):
+    """Células exatamente a 'anel' células de distância (em Chebyshev) da célula central."""
+    if anel == 0:
+        yield c_lat, c_lon
+        return
+    for d in range(-anel, anel + 1):
+        yield c_lat - anel, c_lon + d
+        yield c_lat + anel, c_lon + d
+    for d in range(-anel + 1, anel):
+        yield c_lat + d, c_lon - anel
+        yield c_lat + d, c_lon + anel
+
+class GradeEspacial:
+    """
+    Índice em grelha regular para encontrar o ponto mais próximo de uma coordenada,
+    sem dependências externas. As células são quadradas em km (a largura em longitude
+    é corrigida pela latitude média), o que permite parar a busca em anéis com segurança.
+    """
+
+    def __init__(self, ids, lats, lons, tamanho_celula_km=0.5):
+        self.tamanho_km = tamanho_celula_km
+        lats = list(lats)
+        lat_ref = sum(lats) / len(lats) if lats else 0.0
+        self.passo_lat = tamanho_celula_km / KM_POR_GRAU
+        self.passo_lon = tamanho_celula_km / (KM_POR_GRAU * max(math.cos(math.radians(lat_ref)), 0.1))
+        self.celulas = defaultdict(list)
+        for i, lat, lon in zip(ids, lats, lons):
+            self.celulas[self._celula(lat, lon)].append((lat, lon, i))
+        self.limites_celulas = (
+            min((c[0] for c in self.celulas), default=0), max((c[0] for c in self.celulas), default=0),
+            min((c[1] for c in self.celulas), default=0), max((c[1] for c in self.celulas), default=0),
+        )
+
+    def _celula(self, lat, lon):
+        return int(math.floor(lat / self.passo_lat)), int(math.floor(lon / self.passo_lon))
+
+    def __len__(self):
+        return sum(len(pontos) for pontos in self.celulas.values())
+
+    def mais_proximo(self, lat, lon, raio_max_km=None):
+        """Devolve (id, distancia_km) do ponto mais próximo, ou (None, None) se não houver nenhum no raio."""
+        if not self.celulas:
+            return None, None
+        c_lat, c_lon = self._celula(lat, lon)
+        melhor_id, melhor_dist = None, math.inf
+        # Nunca é preciso ir além do anel que já cobre todas as células ocupadas
+        min_lat, max_lat, min_lon, max_lon = self.limites_celulas
+        anel_maximo = max(abs(c_lat - min_lat), abs(c_lat - max_lat), abs(c_lon - min_lon), abs(c_lon - max_lon))
+        if raio_max_km is not None:
+            anel_maximo = min(anel_maximo, math.ceil(raio_max_km / self.tamanho_km) + 1)
+        anel = 0
+        while anel <= anel_maximo:
+            # Qualquer ponto no anel 'anel' está a pelo menos (anel - 1) células de distância
+            if (anel - 1) * self.tamanho_km > melhor_dist:
+                break
+            for celula in _perimetro(c_lat, c_lon, anel):
+                for p_lat, p_lon, i in self.celulas.get(celula, ()):
+                    dist = haversine(lat, lon, p_lat, p_lon)
+                    if dist < melhor_dist:
+                        melhor_id, melhor_dist = i, dist
+            anel += 1
+        if melhor_id is None or (raio_max_km is not None and melhor_dist > raio_max_km):
+            return None, None
+        return melhor_id, melhor_dist
+
+class IndiceNosGrafo:
+    """
+    Nó do grafo mais próximo de cada ponto. É a mesma árvore (BallTree com distância haversine)
+    que o ox.nearest_nodes constrói em cada chamada num grafo não projetado, construída uma só
+    vez a partir de arrays do numpy e reutilizada em todas as consultas.
+    """
+
+    def __init__(self, G):
+        import numpy as np
+        from sklearn.neighbors import BallTree
+
+        total = G.number_of_nodes()
+        self.nos = list(G.nodes)
+        ys = np.fromiter((d['y'] for _, d in G.nodes(data=True)), dtype=float, count=total)
+        xs = np.fromiter((d['x'] for _, d in G.nodes(data=True)), dtype=float, count=total)
+        self.arvore = BallTree(np.radians(np.column_stack((ys, xs))), metric='haversine')
+
+    def __len__(self):
+        return len(self.nos)
+
+    def localizar(self, pontos):
+        """Nó mais próximo de cada (lat, lon), numa só consulta à árvore."""
+        if not pontos:
+            return []
+        import numpy as np
+
+        consulta = np.radians(np.asarray(pontos, dtype=float).reshape(-1, 2))
+        indices = self.arvore.query(consulta, k=1, return_distance=False)[:, 0]
+        return [self.nos[i] for i in indices]
@@ -1,5 +1,6 @@
 # logic/utils.py
 
+import unicodedata
 from math import radians, cos, sin, asin, sqrt
 
 def haversine(lat1, lon1, lat2, lon2):
@@ -9,4 +10,24 @@ def haversine(lat1, lon1, lat2, lon2):
     dlon = radians(lon2 - lon1)
     a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
     c = 2 * asin(sqrt(a))
-    return R * c
\ No newline at end of file
+    return R * c
+
+# As APIs de CEP e a planilha trazem a sigla do estado; o OSM traz o nome por extenso
+ESTADOS_POR_UF = {
+    'AC': 'Acre', 'AL': 'Alagoas', 'AP': 'Amapá', 'AM': 'Amazonas', 'BA': 'Bahia', 'CE': 'Ceará',
+    'DF': 'Distrito Federal', 'ES': 'Espírito Santo', 'GO': 'Goiás', 'MA': 'Maranhão',
+    'MT': 'Mato Grosso', 'MS': 'Mato Grosso do Sul', 'MG': 'Minas Gerais', 'PA': 'Pará',
+    'PB': 'Paraíba', 'PR': 'Paraná', 'PE': 'Pernambuco', 'PI': 'Piauí', 'RJ': 'Rio de Janeiro',
+    'RN': 'Rio Grande do Norte', 'RS': 'Rio Grande do Sul', 'RO': 'Rondônia', 'RR': 'Roraima',
+    'SC': 'Santa Catarina', 'SP': 'São Paulo', 'SE': 'Sergipe', 'TO': 'Tocantins',
+}
+
+def normalizar_nome(texto):
+    """Normaliza um nome para comparação: sem acentos, em minúsculas e com espaços simples."""
+    sem_acentos = unicodedata.normalize('NFKD', str(texto)).encode('ascii', 'ignore').decode('ascii')
+    return " ".join(sem_acentos.casefold().replace('-', ' ').split())
+
+def normalizar_estado(estado):
+    """Nome normalizado do estado, a partir da sigla (SP) ou do nome (São Paulo, sao paulo)."""
+    texto = str(estado or '').strip()
+    return normalizar_nome(ESTADOS_POR_UF.get(texto.upper(), texto))
@@ -0,0 +1,254 @@
+# Arquivo: servidor_rotas.py
+# Serviço local de longa duração que mantém em memória o grafo de ruas, um índice espacial
+# dos seus nós e os mapas de CEPs (LoteCeps) de cada cidade já pedida. O 'calcular_distancias_reais.py'
+# e o 'automacao_rotas.py' usam-no quando está a correr (ver logic/routing_client.py), e fazem
+# o trabalho localmente quando não está, por isso as execuções seguidas deixam de pagar o arranque.
+# Se o ficheiro do grafo for reconstruído (pelo 'cria_grafo.py'), é recarregado no pedido seguinte.
+#
+# Uso: python servidor_rotas.py [--porta 8765] [--sem-grafo]
+#
+# Pedidos (JSON, só em 127.0.0.1):
+#   GET  /estado              -> o que está carregado
+#   POST /matriz-distancias   {"origens": [[lat, lon], ...], "destinos": [[lat, lon], ...]}
+#                             -> {"distancias_km": [[km ou null, ...], ...]}  (uma linha por origem)
+#   POST /cep-mais-proximo    {"estado", "cidade", "pontos": [[lat, lon], ...], "raio_max_km": opcional}
+#                             -> {"resultados": [{"cep", "distancia_km"} ou null, ...]}
+#   POST /ceps-cidade         {"estado", "cidade"} -> LoteCeps em colunas (o formato do cache)
+
+import json
+import time
+import heapq
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from logic.logger import get_logger
+from logic.spatial_index import GradeEspacial, IndiceNosGrafo
+from logic.cep_processing import get_geocoded_ceps_for_city
+from logic.isochrones import versao_grafo
+from logic.metrics import cronometrar, contar, execucao_monitorizada, ERROS_FATAIS
+from logic.routing_client import PORTA_PADRAO
+
+logger = get_logger(__name__)
+
+# --- CONFIGURAÇÃO ---
+ARQUIVO_GRAFO = "brazil_drive_graph.graphml"
+ENDERECO = "127.0.0.1"
+# Limite de pontos por pedido, para um pedido enganado não prender o serviço
+MAX_PONTOS_POR_PEDIDO = 200_000
+
+class Servico:
+    """Tudo o que o serviço mantém em memória entre pedidos."""
+
+    def __init__(self):
+        # (grafo, índice dos nós, versão do ficheiro), trocados de uma só vez quando o grafo é recarregado
+        self._grafo = None
+        self.caminho_grafo = None
+        self.cidades = {}
+        self.iniciado_em = time.time()
+        self._trinco_grafo = threading.Lock()
+        # O trinco geral só protege os dicionários; o mapeamento de cada cidade tem o seu,
+        # para que uma cidade nova (que pode levar horas) não bloqueie as que já estão em memória
+        self._trinco_cidades = threading.Lock()
+        self._trincos_por_cidade = {}
+
+    def carregar_grafo(self, caminho=ARQUIVO_GRAFO):
+        import osmnx as ox
+        versao = versao_grafo(caminho)
+        logger.info(f"Carregando o grafo de ruas '{caminho}'... Este passo pode ser demorado.")
+        with cronometrar("carregar_grafo"):
+            grafo = ox.load_graphml(caminho)
+        with cronometrar("indice_nos"):
+            indice = IndiceNosGrafo(grafo)
+        self.caminho_grafo = caminho
+        self._grafo = (grafo, indice, versao)
+        logger.info(f"Grafo carregado: {len(indice)} nós indexados.")
+
+    def grafo_atual(self):
+        """
+        (grafo, índice dos nós) em memória. Se o ficheiro do grafo mudou desde que foi lido
+        (a mesma versão que logic/isochrones.py usa no cache), é recarregado antes de responder.
+        """
+        if self._grafo is None:
+            return None, None
+        versao = versao_grafo(self.caminho_grafo)
+        if versao is not None and versao != self._grafo[2]:
+            with self._trinco_grafo:
+                if versao != self._grafo[2]:
+                    logger.info(f"O ficheiro '{self.caminho_grafo}' mudou: a recarregar o grafo e a esquecer as cidades em memória.")
+                    self.carregar_grafo(self.caminho_grafo)
+                    # Um grafo novo vem de um PBF novo, com o qual o 'cria_limites.py' revalida os mapas das cidades
+                    with self._trinco_cidades:
+                        self.cidades.clear()
+        grafo, indice, _ = self._grafo
+        return grafo, indice
+
+    def _trinco_da_cidade(self, chave):
+        with self._trinco_cidades:
+            return self._trincos_por_cidade.setdefault(chave, threading.Lock())
+
+    def cidade_com_indice(self, estado, cidade):
+        """
+        (LoteCeps, índice dos seus CEPs) da cidade, lidos (ou mapeados) uma única vez e
+        guardados em memória, ou (None, None) se a cidade não tiver CEPs.
+        """
+        chave = (estado.lower(), cidade.lower())
+        with self._trinco_cidades:
+            guardada = self.cidades.get(chave)
+        if guardada is not None:
+            return guardada
+        with self._trinco_da_cidade(chave):
+            with self._trinco_cidades:
+                guardada = self.cidades.get(chave)
+            if guardada is None:
+                lote = get_geocoded_ceps_for_city(estado, cidade)
+                if not lote:
+                    return None, None
+                guardada = (lote, GradeEspacial(range(len(lote)), lote.latitudes, lote.longitudes))
+                with self._trinco_cidades:
+                    self.cidades[chave] = guardada
+            return guardada
+
+    def cidade(self, estado, cidade):
+        """LoteCeps da cidade (ver cidade_com_indice)."""
+        return self.cidade_com_indice(estado, cidade)[0]
+
+    def resumo(self):
+        with self._trinco_cidades:
+            cidades = sorted(self.cidades)
+        grafo = self._grafo[0] if self._grafo is not None else None
+        return {
+            "grafo_carregado": grafo is not None,
+            "nos": grafo.number_of_nodes() if grafo is not None else 0,
+            "cidades": [f"{c}/{e}" for e, c in cidades],
+            "ativo_ha_s": round(time.time() - self.iniciado_em, 1),
+        }
+
+def _distancias_para_alvos(G, origem, alvos):
+    """
+    Dijkstra a partir de 'origem' que pára assim que todos os 'alvos' estão resolvidos:
+    uma travessia por origem em vez de uma procura de caminho por destino.
+    Devolve {no: metros} só para os alvos alcançáveis.
+    """
+    por_resolver = set(alvos)
+    resolvidos = {}
+    encontrados = {}
+    fila = [(0.0, origem)]
+    while fila and por_resolver:
+        dist, u = heapq.heappop(fila)
+        if u in resolvidos:
+            continue
+        resolvidos[u] = dist
+        if u in por_resolver:
+            por_resolver.discard(u)
+            encontrados[u] = dist
+        for v, arestas in G.adj[u].items():
+            if v not in resolvidos:
+                # Entre arestas paralelas, fica a mais curta
+                comprimento = min(float(d.get('length', 0)) for d in arestas.values())
+                heapq.heappush(fila, (dist + comprimento, v))
+    return encontrados
+
+def matriz_distancias(servico, origens, destinos):
+    G, indice_nos = servico.grafo_atual()
+    if G is None:
+        raise ValueError("o serviço foi iniciado sem grafo")
+    with cronometrar("localizacao_no_mapa"):
+        nos_origem = indice_nos.localizar(origens)
+        nos_destino = indice_nos.localizar(destinos)
+    linhas = []
+    with cronometrar("rotas"):
+        for no_origem in nos_origem:
+            metros = _distancias_para_alvos(G, no_origem, nos_destino)
+            linha = [round(metros[n] / 1000, 2) if n in metros else None for n in nos_destino]
+            contar("rotas_sem_caminho", linha.count(None))
+            linhas.append(linha)
+    contar("rotas_calculadas", len(origens) * len(destinos))
+    return {"distancias_km": linhas}
+
+def cep_mais_proximo(servico, estado, cidade, pontos, raio_max_km=None):
+    lote, indice = servico.cidade_com_indice(estado, cidade)
+    if lote is None:
+        return {"resultados": [None] * len(pontos)}
+    resultados = []
+    for lat, lon in pontos:
+        i, distancia_km = indice.mais_proximo(lat, lon, raio_max_km)
+        resultados.append(None if i is None else {"cep": lote.cep(i), "distancia_km": round(distancia_km, 3)})
+    return {"resultados": resultados}
+
+def criar_manipulador(servico):
+    class Manipulador(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _responder(self, codigo, corpo):
+            dados = json.dumps(corpo, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            self.send_response(codigo)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(dados)))
+            self.end_headers()
+            self.wfile.write(dados)
+
+        def do_GET(self):
+            if self.path == "/estado":
+                self._responder(200, servico.resumo())
+            else:
+                self._responder(404, {"erro": f"caminho desconhecido: {self.path}"})
+
+        def do_POST(self):
+            try:
+                tamanho = int(self.headers.get("Content-Length", 0))
+                pedido = json.loads(self.rfile.read(tamanho) or b"{}")
+                with cronometrar(f"pedido{self.path.replace('/', '.')}"):
+                    if self.path == "/matriz-distancias":
+                        origens, destinos = pedido["origens"], pedido["destinos"]
+                        if len(origens) + len(destinos) > MAX_PONTOS_POR_PEDIDO:
+                            raise ValueError(f"mais de {MAX_PONTOS_POR_PEDIDO} pontos num só pedido")
+                        resposta = matriz_distancias(servico, origens, destinos)
+                    elif self.path == "/cep-mais-proximo":
+                        resposta = cep_mais_proximo(servico, pedido["estado"], pedido["cidade"],
+                                                    pedido["pontos"], pedido.get("raio_max_km"))
+                    elif self.path == "/ceps-cidade":
+                        lote = servico.cidade(pedido["estado"], pedido["cidade"])
+                        resposta = lote.para_json() if lote is not None else None
+                    else:
+                        self._responder(404, {"erro": f"caminho desconhecido: {self.path}"})
+                        return
+            except (KeyError, TypeError, ValueError) as e:
+                self._responder(400, {"erro": str(e)})
+                return
+            except Exception as e:
+                logger.error(f"Erro ao responder a {self.path}: {e}", exc_info=True)
+                self._responder(500, {"erro": str(e)})
+                return
+            self._responder(200, resposta)
+
+        def log_message(self, formato, *args):
+            logger.debug(f"{self.address_string()} {formato % args}")
+
+    return Manipulador
+
+def iniciar_servidor(porta=PORTA_PADRAO, com_grafo=True):
+    servico = Servico()
+    if com_grafo:
+        try:
+            servico.carregar_grafo()
+        except FileNotFoundError:
+            logger.error(f"ERRO: Ficheiro do grafo '{ARQUIVO_GRAFO}' não encontrado. Execute o 'cria_grafo.py' primeiro.")
+            contar(ERROS_FATAIS)
+            return
+    servidor = ThreadingHTTPServer((ENDERECO, porta), criar_manipulador(servico))
+    servidor.daemon_threads = True
+    logger.info(f"✅ Serviço de rotas à escuta em http://{ENDERECO}:{porta} (Ctrl+C para parar).")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("A parar o serviço de rotas...")
+    finally:
+        servidor.server_close()
+
+if __name__ == "__main__":
+    with execucao_monitorizada("servidor_rotas"):
+        parser = argparse.ArgumentParser(description="Serviço local que mantém o grafo e os mapas de CEPs em memória.")
+        parser.add_argument("--porta", type=int, default=PORTA_PADRAO)
+        parser.add_argument("--sem-grafo", action="store_true", help="Servir só os mapas de CEPs (sem matriz de distâncias).")
+        args = parser.parse_args()
+        iniciar_servidor(args.porta, com_grafo=not args.sem_grafo)